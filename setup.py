@@ -3,5 +3,18 @@ from setuptools import setup, find_packages
 setup(
     name="validate",
     packages=find_packages(where="src"),
-    package_dir={"": "src"}
-)
\ No newline at end of file
+    package_dir={"": "src"},
+    install_requires=["urllib3"],
+    extras_require={
+        # faster JSON encoding of large responses, see serialization.dumps()
+        "orjson": ["orjson"],
+        # validate-server runs the API itself (the Lambda runtime provides boto3, src/requirements.txt the rest)
+        "server": ["boto3", "requests", "pyyaml"]
+    },
+    entry_points={
+        "console_scripts": [
+            "validate-templates=validate.client:main",
+            "validate-server=validate.server:main"
+        ]
+    }
+)
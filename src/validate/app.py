@@ -1,17 +1,19 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 import json
+import math
 import boto3
-import requests
 import os
+import time
 import traceback
-import logging
 from botocore.exceptions import ClientError
-from typing import Any, Dict, List
-from validate import exceptions
+from concurrent.futures import as_completed
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from validate import (backends, costs, endpoints, exceptions, formats, history, logs, metrics, nested, profiling,
+                      scheduler, serialization, singleflight, sources)
+from validate.results import CheckResult, ResultStore
 
-logger = logging.getLogger("templateScanner")
-logger.setLevel(logging.DEBUG)
+logger = logs.get_logger("templateScanner")
 
 # Failing checks in this list will be returned.
 FAILURE_FILTER = ["VERY_HIGH", "HIGH", "MEDIUM", "LOW"]
@@ -44,8 +46,9 @@ def populate_api_key():
     secret = ''
     try:
         logger.debug(f'Looking for API key in Secrets Manager at {secret_name}')
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name)
+        with metrics.timer('SecretsManagerTime'):
+            get_secret_value_response = client.get_secret_value(
+                SecretId=secret_name)
 
     except ClientError as e:
         raise e
@@ -92,13 +95,19 @@ def get_scan_result(payload: Dict[str, Any]) -> Any:
     :return: requests.Response object (https://docs.python-requests.org/en/latest/api/#requests.Response)
              Actual results from CloudConformity API call are in respone.text
     """
-    logger.info('get_scan_result - request payload:\n' + json.dumps(payload, indent=2))
+    logger.debug('get_scan_result - request payload: %s', logs.payload(payload))
     resp: Any = ''
     try:
-        region_name = os.environ['AWS_REGION']
-        template_scanner_url = f'https://{region_name}-api.cloudconformity.com/v1/template-scanner/scan'
-        resp = requests.post(template_scanner_url, data=json.dumps(payload), headers=get_cloud_conformity_headers())
-        logger.debug('get_scan_result - response:\n' + resp.text + "\n\n")
+        headers = get_cloud_conformity_headers()
+        metrics.count('Scans')
+        metrics.count('TemplateBytes', len(payload['data']['attributes']['contents']))
+        with metrics.timer('ScanTime'):
+            # identical scans running in other invocations are only sent to Conformity once, see singleflight.py
+            resp = singleflight.run(payload, lambda: endpoints.request('POST', '/v1/template-scanner/scan',
+                                                                       data=json.dumps(payload), headers=headers))
+        # only the status and size at INFO, summarising the body isn't free for large results
+        logger.info('get_scan_result - response: %s', logs.Fields(status=resp.status_code, bytes=len(resp.content)))
+        logger.debug('get_scan_result - response body: %s', logs.payload(resp.text))
     except Exception:
         logger.error("Exception occurred in get_scan_result! " + traceback.format_exc())
 
@@ -115,19 +124,17 @@ def populate_accounts_list() -> None:
     logger.info('populate_accounts_list()')
     try:
         global ACCOUNTS_LIST
-        region_name = os.environ['AWS_REGION']
-        accountsUrl = f'https://{region_name}-api.cloudconformity.com/v1/accounts'
-
-        resp = requests.get(accountsUrl,
-                            headers=get_cloud_conformity_headers())
-        logger.debug('Accounts Response:\n' + resp.text + '\n\n')
+        headers = get_cloud_conformity_headers()
+        with metrics.timer('AccountsRefreshTime'):
+            resp = endpoints.request('GET', '/v1/accounts', headers=headers)
+        logger.debug('Accounts Response: %s', logs.payload(resp.text))
 
         if (resp.status_code != 200):
             resp.raise_for_status()
 
         respObj = json.loads(resp.text)
 
-        ACCOUNTS_LIST.clear()
+        # rebind rather than clear() and refill, other threads (see server.py) may be searching the current list
         ACCOUNTS_LIST = respObj["data"]
 
         logger.debug(f'respObj["data"] size: {len(respObj["data"])}')
@@ -160,23 +167,31 @@ def get_account(awsAccount: str) -> str:
     present. If ACCOUNTS_LIST is empty, will make call to populate from CloudConformity.
     """
     logger.info(f'get_account({awsAccount})')
-    try:
-        conformity_id = ''
+    return get_accounts([awsAccount])[awsAccount]
 
+
+def get_accounts(awsAccounts: List[str]) -> Dict[str, str]:
+    """
+    get_account() for several AWS accounts at once: ACCOUNTS_LIST is refreshed at most once, however many of
+    the accounts are missing from it
+    :return: AWS account id -> CloudConformity account id, empty for accounts that aren't monitored
+    """
+    try:
         # first time call, populate global var to cache for next time
         if (len(ACCOUNTS_LIST) == 0):
             populate_accounts_list()
 
-        conformity_id = search_accounts(awsAccount)
-        if (conformity_id == ''):
-            logger.debug('Did not find AWS account id. Account data maybe stale, refreshing...')
+        conformity_ids = {awsAccount: search_accounts(awsAccount) for awsAccount in awsAccounts}
+        missing = [awsAccount for awsAccount, conformity_id in conformity_ids.items() if conformity_id == '']
+        if (missing):
+            logger.debug('Did not find AWS account ids %s. Account data maybe stale, refreshing...', missing)
             populate_accounts_list()
-            conformity_id = search_accounts(awsAccount)
+            conformity_ids.update((awsAccount, search_accounts(awsAccount)) for awsAccount in missing)
 
-        return conformity_id
+        return conformity_ids
 
     except Exception as e:
-        logger.debug("Exception occurred in get_account! " + traceback.format_exc())
+        logger.debug("Exception occurred in get_accounts! " + traceback.format_exc())
         raise e
 
 
@@ -200,7 +215,7 @@ def lambda_handler(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None
     :param dynamodb: Pass in for unit testing, otherwise None will mean dynamodb resource will be created
     :returns:
         {
-            "statusCode": "[200|500]",
+            "statusCode": "[200|400|500]",
             "body": {
                 "failures": {
                     "VERY_HIGH": 12,
@@ -211,15 +226,67 @@ def lambda_handler(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None
                 "results" : "<cucumber JSON with validate results>"
             }
         }
+        If "describeOnly": true is set in the body, templates are not scanned (only their filenames are needed),
+        see build_describe_body()
+        The body may be gzip compressed (Content-Encoding: gzip, base64 encoded by API Gateway). Responses
+        are gzip compressed if the caller sends Accept-Encoding: gzip
+        If "responseVersion": 2 is set in the body (or the X-Response-Version header), "results"
+        is returned as a nested list rather than a JSON encoded string, along with "version": 2
+        If "includeTimings": true is set in the body, a "timings" block with the time spent in each
+        phase (Secrets Manager, accounts refresh, exceptions query, scans, post-processing) is added
+        If "ref" is set (eg. a commit id or branch), the failed checks are stored as the scan history for that
+        ref. If "baseline" is set to an earlier ref, only the failures that are new since then are returned,
+        along with the checks fixed since then (as passed), and a "baseline" summary, see history.py
+        If "resolveNestedStacks" is true, templates used as nested stacks (AWS::CloudFormation::Stack TemplateURL)
+        by other templates in the request are reported under each parent as "<parent> > <child>", see nested.py
+        If "failFast" is set to a risk level (or true for VERY_HIGH), scanning stops at the first failure at or
+        above it: the body is marked "partial": true and the templates not scanned are listed as "notScanned"
+        If "prescan" is true, quick local checks (see prescan.py) run as well as the Conformity scan. With
+        "skipRemote", templates failing them at the blocking level are not sent to Conformity
+        "scanners" lists the scanner backends to scan with (default SCANNER_BACKENDS, ie. "conformity"), run
+        concurrently and merged into the same results, see backends.py
+        Instead of "accountId" and "templates", "groups" may list several {"accountId", "templates"}, each validated
+        as if sent on its own, see validate_groups()
+        Template entries may give the S3 location of the template ("s3": {"bucket", "key", "version"}) rather
+        than the template itself, see sources.py
+    Per phase timings and counters are also logged as CloudWatch Embedded Metric Format, see metrics.py
+    In stages listed in PROFILE_STAGES, requests can be profiled with the X-Profile header, see profiling.py
+    """
+    with metrics.invocation('Validate', context):
+        profile = profiling.start(event)
+        if profile is None:
+            return serialization.encode_response(event, validate(event, context, dynamodb))
+
+        try:
+            response = validate(event, context, dynamodb)
+        finally:
+            profiling.finish(profile, 'Validate')
+        return serialization.encode_response(event, profile.attach(response))
+
+
+def validate(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Dict[str, Any]:
+    """
+    Handles a validate request, see lambda_handler()
+    :return: response, with the body not yet compressed
     """
     try:
-        logger.info("lambda_handler(event): " + json.dumps(event, indent=2))
+        logger.info('lambda_handler(event): %s', logs.Fields(bodyBytes=len(event.get('body') or '')))
+        logger.debug('lambda_handler(event) payload: %s', logs.payload(event))
+
+        body = json.loads(serialization.load_request_body(event), strict=False)
+        version = serialization.response_version(event, body)
+        outputFormat = formats.output_format(body)
+        ref, baselineRef = history.request_refs(body)
+        blockingLevels = fail_fast_levels(body)
 
-        body = json.loads(event['body'], strict=False)
+        options = ScanOptions(ref, baselineRef, blockingLevels, bool(body.get('resolveNestedStacks', False)),
+                              *scanner_options(body, blockingLevels))
+        if ('groups' in body):
+            responseBody = validate_groups(body, version, outputFormat, options, dynamodb)
+            return {"statusCode": 200, "body": responseBody}
 
         # List of HIGH-RISK failures
-        failuresList: Dict[str, Any] = {}
-        filename: str = ''
+        failuresList = ResultStore(FAILURE_FILTER)
 
         cc_account_id: str = ''
         cc_account_id = extract_account(body, failuresList)
@@ -229,37 +296,33 @@ def lambda_handler(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None
             exceptionList = exceptions.get_approved_exceptions(body["accountId"], dynamodb)
 
         templates: List[Dict[str, Any]] = body['templates']
-        for entry in templates:
-            if ('filename' in entry):
-                filename = entry['filename']
-            scan_template(filename, failuresList, cc_account_id, entry['template'], exceptionList)
+        if (body.get('describeOnly')):
+            return {
+                "statusCode": 200,
+                "body": build_describe_body(cc_account_id, exceptionList, templates, failuresList)
+            }
 
-        # get the results in order (highest sev first)
-        results = []
-        failuresCount = {
-            "VERY_HIGH": 0,
-            "HIGH": 0,
-            "MEDIUM": 0,
-            "LOW": 0
-        }
+        templates = fetch_templates(templates, failuresList)
+        filenames, notScanned = scan_templates(body.get('accountId', ''), templates, failuresList, cc_account_id,
+                                               exceptionList, options)
+        failuresList, baseline = apply_history(body.get('accountId', ''), failuresList, filenames, options, dynamodb)
 
-        for riskLevel in reversed(list(failuresList.keys())):
-            for check in failuresList[riskLevel]['elements']:
-                if (check['steps'][0]['result']['status'] == "failed"):
-                    failuresCount[riskLevel] += 1
-            results.append(failuresList[riskLevel])
+        # failures are counted as results are added
+        failuresCount = failuresList.failures
 
-        logger.debug('failuresCount: ' + json.dumps(failuresCount, indent=2))
+        logger.info('failuresCount: %s', logs.Fields(**failuresCount))
 
-        cucumberResults = json.dumps(results)
+        timings = None
+        if (body.get('includeTimings')):
+            timings = metrics.current().timings()
 
-        logger.debug(f'Results converted to Cucumber: {cucumberResults}')
+        responseBody = build_response_body(version, outputFormat, failuresList, timings, baseline, notScanned)
 
         return_response = {
             "statusCode": 200,
-            "body": json.dumps({'failures': failuresCount, 'results': cucumberResults})
+            "body": responseBody
         }
-        logger.debug(f'return_response: {json.dumps(return_response, indent=2)}')
+        logger.debug('return_response: %s', logs.payload(return_response))
 
         return return_response
 
@@ -269,6 +332,25 @@ def lambda_handler(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None
             'statusCode': 500,
             'body': json.dumps({'message': 'Invalid JSON provided in request'})
         }
+    except serialization.RequestTooLargeError as e:
+        logger.error(f'Request too large: {e}')
+        return {
+            'statusCode': 413,
+            'body': json.dumps({'message': str(e)})
+        }
+    except serialization.InvalidRequestError as e:
+        logger.error(f'Invalid request option: {e}')
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': str(e)})
+        }
+    except scheduler.ThrottledError as e:
+        retryAfter = math.ceil(e.retryAfter)
+        return {
+            'statusCode': 429,
+            'headers': {'Retry-After': str(retryAfter)},
+            'body': json.dumps({'message': str(e), 'retryAfter': retryAfter})
+        }
     except TypeError as e:
         logger.error("Malformed request payload, missing elements")
         logger.error(traceback.format_exc())
@@ -285,11 +367,212 @@ def lambda_handler(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None
         }
 
 
-def extract_account(body: Dict[str, Any], failuresList: Dict[str, Any]) -> str:
+class ScanOptions(NamedTuple):
+    """Request options that apply to every account's templates"""
+    ref: str
+    baselineRef: str
+    blockingLevels: List[str]
+    resolveNested: bool
+    # scanner backends, empty for SCANNER_BACKENDS (see backends.py)
+    scanners: List[str] = []
+    # risk levels of local findings that make a Conformity scan pointless, see prescan_options()
+    skipRemoteLevels: List[str] = []
+
+
+DEFAULT_SCAN_OPTIONS = ScanOptions('', '', [], False)
+
+
+def fetch_templates(templates: List[Dict[str, Any]], failuresList: ResultStore) -> List[Dict[str, Any]]:
+    """
+    :return: the templates, with the ones sent by S3 location downloaded (see sources.py). Templates that
+             can't be downloaded are left out, with a failed check added to failuresList
+    """
+    templates, failedDownloads = sources.fetch_templates(templates)
+    for filename, reason in failedDownloads:
+        addTestResult('cloud-conformity-tests', 'Template download error', 'VERY_HIGH', reason,
+                      filename, 'failed', failuresList, error=True)
+    return templates
+
+
+def apply_history(accountId: str, failuresList: ResultStore, filenames: List[str], options: ScanOptions,
+                  dynamodb: Any = None) -> Tuple[ResultStore, Optional[Dict[str, Any]]]:
+    """
+    Stores the results as the scan history of the request's "ref", and compares them to its "baseline"
+    (see history.py), if set
+    :param filenames: the templates the results are for, as returned by scan_templates()
+    :return: (results, compared to the baseline if set, "baseline" summary if compared)
+    """
+    baseline = None
+    baselineResults = None
+    if (options.baselineRef):
+        # loaded before saving, so a request can record a ref and compare against the same ref
+        baselineResults = history.load(accountId, options.baselineRef, filenames, dynamodb)
+    if (options.ref):
+        history.save(accountId, options.ref, failuresList, filenames, dynamodb)
+    if (options.baselineRef):
+        failuresList, changes = history.compare(failuresList, baselineResults, FAILURE_FILTER)
+        baseline = dict(ref=options.baselineRef, found=baselineResults is not None, **changes)
+    return failuresList, baseline
+
+
+def request_groups(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    :return: the "groups" of a multi-account request
+    :raises serialization.InvalidRequestError: if a group has no "accountId" or "templates", or the request
+                                               also sets "templates" or "describeOnly"
+    """
+    groups = body['groups']
+    if ('templates' in body or 'accountId' in body or body.get('describeOnly')):
+        raise serialization.InvalidRequestError('"groups" can not be combined with "accountId", "templates" or "describeOnly"')
+    if (not isinstance(groups, list) or not groups or not all(
+            isinstance(group, dict) and isinstance(group.get('accountId'), str) and isinstance(group.get('templates'), list)
+            for group in groups)):
+        raise serialization.InvalidRequestError('"groups" must be a list of objects with an "accountId" and "templates"')
+    return groups
+
+
+def validate_groups(body: Dict[str, Any], version: int, outputFormat: str, options: ScanOptions,
+                    dynamodb: Any = None) -> str:
+    """
+    Validates a multi-account request: the templates of each group are scanned as if sent in a request of
+    their own, with that group's "accountId". Conformity accounts are looked up with a single accounts refresh
+    and each account's exceptions are queried once, however many groups it has. All the groups' scans are
+    queued on the shared scan scheduler at once, so they share its workers and the Conformity connection pool
+    :return: JSON string for the response body, see build_groups_body()
+    """
+    groups = request_groups(body)
+    accountIds = list(dict.fromkeys(group['accountId'] for group in groups))
+    ccAccounts = get_accounts(accountIds)
+    exceptionLists = exceptions.get_approved_exceptions_for_accounts(accountIds, dynamodb)
+    metrics.count('AccountGroups', len(groups))
+
+    stores = []
+    for group in groups:
+        store = ResultStore(FAILURE_FILTER)
+        extract_account(group, store, ccAccounts)
+        stores.append((store, fetch_templates(group['templates'], store)))
+
+    # every group's scans are queued before waiting on any, so they share the scan workers
+    batches: List[TemplateScans] = []
+    scanned = []
+    try:
+        for group, (store, templates) in zip(groups, stores):
+            batches.append(start_scans(group['accountId'], templates, ccAccounts[group['accountId']],
+                                       exceptionLists[group['accountId']], options))
+        for group, (store, _), batch in zip(groups, stores, batches):
+            filenames, notScanned = batch.finish(store, options)
+            store, baseline = apply_history(group['accountId'], store, filenames, options, dynamodb)
+            scanned.append((store, baseline, notScanned))
+    except BaseException:
+        for batch in batches:
+            batch.cancel()
+        raise
+
+    timings = None
+    if (body.get('includeTimings')):
+        timings = metrics.current().timings()
+    return build_groups_body(version, outputFormat, [group['accountId'] for group in groups], scanned, timings)
+
+
+def build_groups_body(version: int, outputFormat: str, accountIds: List[str],
+                      scanned: List[Tuple[ResultStore, Optional[Dict[str, Any]], List[str]]],
+                      timings: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Renders a multi-account response: "failures" summed over the groups, and "groups" with each group's
+    response body (see build_response_body()) along with its "accountId"
+    :return: JSON string for the response body
+    """
+    failuresCount = dict.fromkeys(FAILURE_FILTER, 0)
+    groupBodies = []
+    for accountId, (failuresList, baseline, notScanned) in zip(accountIds, scanned):
+        for riskLevel, count in failuresList.failures.items():
+            failuresCount[riskLevel] += count
+        groupBody = build_response_body(version, outputFormat, failuresList, None, baseline, notScanned)
+        groupBodies.append('{"accountId":' + json.dumps(accountId) + ',' + groupBody[1:])
+    logger.info('failuresCount: %s', logs.Fields(groups=len(groupBodies), **failuresCount))
+
+    envelope: Dict[str, Any] = {'failures': failuresCount}
+    if (version != 1):
+        envelope = {'version': version, 'format': outputFormat, **envelope}
+    if timings is not None:
+        envelope['timings'] = timings
+    return serialization.dumps(envelope)[:-1] + ',"groups":[' + ','.join(groupBodies) + ']}'
+
+
+def build_response_body(version: int, outputFormat: str, failuresList: ResultStore,
+                        timings: Optional[Dict[str, Any]] = None, baseline: Optional[Dict[str, Any]] = None,
+                        notScanned: Sequence[str] = ()) -> str:
+    """
+    Renders the validate response body in the requested response version and output format
+    :param timings: added to the body as "timings" if set
+    :param baseline: added to the body as "baseline" if set, see history.compare()
+    :param notScanned: templates a fail fast request stopped before scanning, if any the body is marked
+                       "partial": true and they are listed as "notScanned"
+    :return: JSON string for the response body
+    """
+    extra: Dict[str, Any] = {} if timings is None else {'timings': timings}
+    if baseline is not None:
+        extra['baseline'] = baseline
+    if notScanned:
+        extra['partial'] = True
+        extra['notScanned'] = list(notScanned)
+    failuresCount = failuresList.failures
+
+    if (version == 1):
+        # get the results in order (highest sev first)
+        renderedResults = formats.render(failuresList, outputFormat)
+        logger.debug('Results converted to %s: %s', outputFormat, logs.payload(renderedResults))
+        return json.dumps({'failures': failuresCount, 'results': renderedResults, **extra})
+
+    if (outputFormat == 'cucumber'):
+        return serialization.dumps({'version': version, 'format': outputFormat,
+                                    'failures': failuresCount, 'results': failuresList.cucumber(), **extra})
+
+    renderedResults = formats.render(failuresList, outputFormat)
+    if formats.is_json(outputFormat):
+        # the rendered document is already JSON, so nest it as is rather than decoding and re-encoding it
+        envelope = serialization.dumps({'version': version, 'format': outputFormat, 'failures': failuresCount,
+                                        **extra})
+        return envelope[:-1] + ',"results":' + renderedResults + '}'
+
+    return serialization.dumps({'version': version, 'format': outputFormat,
+                                'failures': failuresCount, 'results': renderedResults, **extra})
+
+
+def build_describe_body(cc_account_id: str, exceptionList: Dict[str, Any], templates: List[Dict[str, Any]],
+                        failuresList: ResultStore) -> str:
+    """
+    Response for "describeOnly" requests - nothing is scanned. Returns what scan results depend on
+    (besides the template itself), so clients can cache results. Always a v2 style response.
+    :return: JSON string for the response body, eg.
+        {
+            "version": 2,
+            "conformityAccount": "<CloudConformity account id, empty if not monitored>",
+            "exceptionsVersions": { "<filename>": "<hash of approved exceptions for the file>", ... },
+            "failures": {...},
+            "results": [<request level checks, eg. account validation, as cucumber JSON>]
+        }
+    """
+    return serialization.dumps({
+        'version': 2,
+        'conformityAccount': cc_account_id,
+        'exceptionsVersions': {entry['filename']: exceptions.exceptions_version(exceptionList, entry['filename'])
+                               for entry in templates if 'filename' in entry},
+        'failures': failuresList.failures,
+        'results': failuresList.cucumber()
+    })
+
+
+def extract_account(body: Dict[str, Any], failuresList: ResultStore, ccAccounts: Optional[Dict[str, str]] = None) -> str:
+    """
+    :param ccAccounts: Conformity account ids already looked up with get_accounts(), otherwise get_account() is used
+    :return: the Conformity account id of the request's "accountId", empty (with a failed check added to
+             failuresList) if it isn't monitored or not given
+    """
     ccAccount: str = ''
     if ('accountId' in body):
         accountId = body['accountId']
-        ccAccount = get_account(accountId)
+        ccAccount = ccAccounts[accountId] if ccAccounts is not None else get_account(accountId)
         if ccAccount == '':
             addTestResult('cloud-conformity-tests',
                           'AWS account number validation', 'VERY_HIGH',
@@ -304,7 +587,279 @@ def extract_account(body: Dict[str, Any], failuresList: Dict[str, Any]) -> str:
     return ccAccount
 
 
-def scan_template(filename: str, failuresList, cc_account_id: str, cfn_template: str, exceptionList: Dict[str, Any]) -> None:
+def scan_templates(accountId: str, templates: List[Dict[str, Any]], failuresList: ResultStore, cc_account_id: str,
+                   exceptionList: Dict[str, Any], options: Optional['ScanOptions'] = None) -> Tuple[List[str], List[str]]:
+    """
+    Scans the templates in parallel on the shared scan scheduler (see scheduler.py), then adds the results to
+    failuresList in template order, so the response doesn't depend on which scan finished first.
+    See start_scans() and TemplateScans.finish()
+    :return: (the filenames the results are reported against, in order,
+              the filenames that weren't scanned because of a blocking failure)
+    :raises scheduler.ThrottledError: if the account is over its scan quota, remaining scans are cancelled
+    """
+    return start_scans(accountId, templates, cc_account_id, exceptionList, options).finish(failuresList, options)
+
+
+def start_scans(accountId: str, templates: List[Dict[str, Any]], cc_account_id: str,
+                exceptionList: Dict[str, Any], options: Optional['ScanOptions'] = None) -> 'TemplateScans':
+    """
+    Submits the templates' scans to the shared scan scheduler. Templates with the same contents are only
+    scanned once, and the scans are submitted longest predicted scan first (see costs.py)
+    :param accountId: AWS account the scans count against for fair scheduling and quotas
+    :param options: options.scanners are the backends each template is scanned with, see backends.py
+    """
+    options = options or DEFAULT_SCAN_OPTIONS
+    filenames: List[str] = []
+    filename = ''
+    for entry in templates:
+        if ('filename' in entry):
+            filename = entry['filename']
+        filenames.append(filename)
+    bodies = [entry['template'] for entry in templates]
+
+    # one scan per unique template body, its results are processed for each filename it was submitted as
+    sched = scheduler.scheduler()
+    stores = [ResultStore(FAILURE_FILTER) for _ in templates]
+    uniqueScans: Dict[str, List[int]] = {}
+    for index, body in enumerate(bodies):
+        uniqueScans.setdefault(nested.digest(body), []).append(index)
+    if (len(uniqueScans) < len(bodies)):
+        metrics.count('DuplicateTemplates', len(bodies) - len(uniqueScans))
+    # longest predicted scan first, so no long scan is left running on its own at the end. Scans of one account
+    # run in submission order (see scheduler.py), ties keep template order
+    model = costs.model()
+    ordered = sorted(uniqueScans.values(),
+                     key=lambda indexes: -model.predict(accountId, filenames[indexes[0]], len(bodies[indexes[0]])))
+    futures = {
+        sched.submit(accountId, len(bodies[indexes[0]]), scan_shared_template,
+                     [(filenames[i], stores[i]) for i in indexes], cc_account_id, bodies[indexes[0]],
+                     exceptionList, accountId, options.scanners, options.skipRemoteLevels): indexes
+        for indexes in ordered
+    }
+    return TemplateScans(filenames, bodies, stores, futures)
+
+
+class TemplateScans:
+    """
+    Scans started by start_scans()
+    :param stores: each template's results, filled in by its scan
+    :param futures: scan future -> indexes of the templates it scans
+    """
+
+    def __init__(self, filenames: List[str], bodies: List[str], stores: List[ResultStore],
+                 futures: Dict[Any, List[int]]) -> None:
+        self.filenames = filenames
+        self.bodies = bodies
+        self.stores = stores
+        self.futures = futures
+
+    def cancel(self) -> None:
+        for future in self.futures:
+            future.cancel()
+
+    def finish(self, failuresList: ResultStore, options: Optional['ScanOptions'] = None) -> Tuple[List[str], List[str]]:
+        """
+        Waits for the scans, and adds the results to failuresList in template order (or the "found ZERO issues"
+        check, if failuresList is still empty, see addPassedResult()). With options.resolveNested,
+        templates used as nested stacks by other templates are reported under each parent instead, see nested.py
+        With options.blockingLevels (see fail_fast_levels()), as soon as a scan finds a failure at one of them the
+        scans not yet started are cancelled, and only the finished scans are reported
+        :return: (the filenames the results are reported against, in order,
+                  the filenames whose scans were cancelled, or were still running, because of a blocking failure)
+        :raises scheduler.ThrottledError: if the account is over its scan quota, remaining scans are cancelled
+        """
+        options = options or DEFAULT_SCAN_OPTIONS
+        blockingLevels = options.blockingLevels
+        futures, stores = self.futures, self.stores
+        scanned = set(range(len(stores)))
+        try:
+            if (blockingLevels):
+                scanned = set()
+                for future in as_completed(futures):
+                    future.result()
+                    scanned.update(futures[future])
+                    if any(stores[i].failures.get(level) for i in futures[future] for level in blockingLevels):
+                        break
+            else:
+                for future in futures:
+                    future.result()
+        except BaseException:
+            self.cancel()
+            raise
+
+        if (len(scanned) < len(stores)):
+            # scans already running finish in the background, their results are dropped
+            cancelled = sum(future.cancel() for future in futures if not future.done())
+            metrics.count('ScansCancelled', cancelled)
+            logger.info('Blocking failure found, %d of %d scans cancelled', cancelled, len(futures))
+            # scans that finished while the blocking failure was being handled are reported as well
+            for future in futures:
+                if (future.done() and not future.cancelled() and future.exception() is None):
+                    scanned.update(futures[future])
+
+        reported = [(name, index) for index, name in enumerate(self.filenames)]
+        if (options.resolveNested):
+            reported = nested_reports(self.filenames, self.bodies)
+        for name, index in reported:
+            if (index in scanned):
+                failuresList.merge(stores[index] if name == self.filenames[index] else stores[index].renamed(name))
+        filenames = [name for name, index in reported if index in scanned]
+        addPassedResult(filenames, failuresList)
+        notScanned = list(dict.fromkeys(name for name, index in reported if index not in scanned))
+        return filenames, notScanned
+
+
+def prescan_options(body: Dict[str, Any], blockingLevels: List[str]) -> Tuple[bool, List[str]]:
+    """
+    :return: (whether to run the local checks, the risk levels of local findings that skip the Conformity scan)
+             from the request's "prescan": true runs the checks as well as Conformity, "skipRemote" also skips
+             the Conformity scan of templates with a local failure at or above the "failFast" level (VERY_HIGH
+             if not set)
+    :raises serialization.InvalidRequestError: if "prescan" isn't a boolean or "skipRemote"
+    """
+    mode = body.get('prescan', False)
+    if (mode is False or mode is True):
+        return mode, []
+    if (mode == 'skipRemote'):
+        return True, blockingLevels or FAILURE_FILTER[:1]
+    raise serialization.InvalidRequestError('"prescan" must be true, false or "skipRemote"')
+
+
+def scanner_options(body: Dict[str, Any], blockingLevels: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    :return: (the scanner backends from the request's "scanners", SCANNER_BACKENDS if not set, with the local
+              checks first if "prescan" is set, the risk levels of local findings that skip the remote scans)
+             see backends.py and prescan_options()
+    :raises serialization.InvalidRequestError: if "scanners" isn't a list of available backends
+    """
+    runPrescan, skipRemoteLevels = prescan_options(body, blockingLevels)
+    names = body.get('scanners')
+    if (names is None):
+        names = backends.default_names()
+    elif (not isinstance(names, list) or not names or not all(isinstance(name, str) for name in names)):
+        raise serialization.InvalidRequestError('"scanners" must be a list of scanner names')
+    names = list(dict.fromkeys(names))
+    if (runPrescan and backends.PrescanBackend.name not in names):
+        names.insert(0, backends.PrescanBackend.name)
+    backends.validate(names)
+    return names, skipRemoteLevels
+
+
+def fail_fast_levels(body: Dict[str, Any]) -> List[str]:
+    """
+    :return: the risk levels at or above the request's "failFast" severity (true means VERY_HIGH), empty if
+             it isn't set
+    :raises serialization.InvalidRequestError: if "failFast" isn't a boolean or one of FAILURE_FILTER
+    """
+    severity = body.get('failFast', False)
+    if (severity is False):
+        return []
+    if (severity is True):
+        severity = FAILURE_FILTER[0]
+    if (severity not in FAILURE_FILTER):
+        raise serialization.InvalidRequestError(f'"failFast" must be true, false or one of {", ".join(FAILURE_FILTER)}')
+    return FAILURE_FILTER[:FAILURE_FILTER.index(severity) + 1]
+
+
+def nested_reports(filenames: List[str], bodies: List[str]) -> List[Any]:
+    """
+    :return: (reported filename, template index) for each template, with nested stacks reported under their
+             parents, see nested.StackGraph.reported()
+    """
+    unchanged = [(name, index) for index, name in enumerate(filenames)]
+    if not any(nested.STACK_TYPE in body for body in bodies):
+        return unchanged
+    if (len(set(filenames)) < len(filenames)):
+        logger.warning('Not resolving nested stacks, template filenames are not unique')
+        return unchanged
+
+    with metrics.timer('NestedStackTime'):
+        graph = nested.resolve(filenames, bodies)
+        indexes = {name: index for index, name in enumerate(filenames)}
+        reported = [(name, indexes[filename]) for name, filename in graph.reported()]
+    metrics.count('NestedStacks', sum(len(children) for children in graph.children.values()))
+    return reported
+
+
+def scan_shared_template(targets: List[Any], cc_account_id: str, cfn_template: str,
+                         exceptionList: Dict[str, Any], accountId: str = '', scanners: Sequence[str] = (),
+                         skipRemoteLevels: Sequence[str] = ()) -> None:
+    """
+    Scans a template once with each scanner backend (see backends.py), and adds the merged results for each
+    (filename, ResultStore) in targets
+    :param accountId: AWS account the scan time is recorded against, see costs.py
+    :param scanners: the backends to scan with, SCANNER_BACKENDS if empty
+    :param skipRemoteLevels: run the local backends first, and don't send the template to the remote ones
+                             (Conformity) if they found a failure at one of these risk levels (that isn't covered
+                             by an exception)
+    """
+    selected = backends.selected(scanners)
+    context = backends.ScanContext(accountId, cc_account_id, [filename for filename, _ in targets])
+    # each backend's results for each target, merged once all have run
+    stores = {backend.name: [ResultStore(FAILURE_FILTER) for _ in targets] for backend in selected}
+
+    def scan(group: List[Any]) -> None:
+        for backend, result in zip(group, backends.run(group, cfn_template, context)):
+            for (filename, _), store in zip(targets, stores[backend.name]):
+                backends.report(backend, result, filename, store, exceptionList)
+
+    local = [backend for backend in selected if not backend.remote]
+    if (skipRemoteLevels and local and len(local) < len(selected)):
+        scan(local)
+        if (all(any(blocking_failure(stores[backend.name][index], skipRemoteLevels) for backend in local)
+                for index in range(len(targets)))):
+            logger.info('Not scanning template remotely, the local checks found blocking failures')
+            metrics.count('RemoteScansSkipped')
+            selected = local
+            # only the local findings, so not stored as the template's history, see history.errored_files()
+            for filename, store in targets:
+                store.incomplete.add(filename)
+        else:
+            scan([backend for backend in selected if backend.remote])
+    else:
+        scan(selected)
+
+    for index, (_, store) in enumerate(targets):
+        backends.merge([stores[backend.name][index] for backend in selected], store)
+
+
+def blocking_failure(store: ResultStore, levels: Sequence[str]) -> bool:
+    """
+    :return: whether a local backend found a failure at one of levels. A backend that couldn't scan the
+             template (a scan error) found nothing, so doesn't block the remote scan
+    """
+    return any(result.status == 'failed' and not result.error
+               for level in levels for result in store.groups.get(level, ()))
+
+
+def scan_template(filename: str, failuresList: ResultStore, cc_account_id: str, cfn_template: str, exceptionList: Dict[str, Any]) -> None:
+    scan_shared_template([(filename, failuresList)], cc_account_id, cfn_template, exceptionList)
+
+
+class ConformityBackend(backends.Backend):
+    """The Conformity Template Scanner, the default scanner backend"""
+    name = backends.DEFAULT_BACKEND
+    title = 'CloudConformity'
+    remote = True
+
+    def scan(self, template: str, context: backends.ScanContext) -> Any:
+        start = time.perf_counter()
+        resp = request_scan(context.ccAccountId, template)
+        # responses shared by another invocation (see singleflight.py) say nothing about how long a scan takes
+        if (resp.status_code == 200 and resp.reason != 'Shared'):
+            elapsed = time.perf_counter() - start
+            for filename in context.filenames:
+                costs.model().observe(context.accountId, filename, len(template), elapsed)
+        return resp
+
+    def report(self, result: Any, filename: str, store: ResultStore, exceptionList: Dict[str, Any]) -> None:
+        process_scan_response(result, filename, store, exceptionList)
+
+
+backends.register(ConformityBackend())
+
+
+def request_scan(cc_account_id: str, cfn_template: str) -> Any:
 
     payload = {
         'data': {
@@ -320,15 +875,19 @@ def scan_template(filename: str, failuresList, cc_account_id: str, cfn_template:
     else:
         logger.warning('No valid, monitored, AWS account ID provided - using default CloudConformity rules')
 
-    resp = get_scan_result(payload)
+    return get_scan_result(payload)
+
+
+def process_scan_response(resp: Any, filename: str, failuresList: ResultStore, exceptionList: Dict[str, Any]) -> None:
     if (resp.status_code != 200):
+        metrics.count('ScanErrors')
         errors = json.loads(resp.text)
-        logger.debug(f'error: {errors}')
+        logger.debug('error: %s', errors)
         details = errors['errors'][0]['detail']
         addTestResult('cloud-conformity-tests',
                       'CloudConformity Response Error', 'VERY_HIGH',
                       f'CloudConformity replied with {resp.status_code} error: {details}',
-                      filename, 'failed', failuresList)
+                      filename, 'failed', failuresList, error=True)
     processScanResults(resp.text, filename, failuresList, exceptionList)
 
 
@@ -341,10 +900,16 @@ def convertStatus(status: str) -> str:
         return status
 
 
-def processScanResults(ccResults: str, filename: str, tests: Dict[str, Any], exceptionList: Dict[str, Any]) -> None:
+def processScanResults(ccResults: str, filename: str, tests: ResultStore, exceptionList: Dict[str, Any]) -> None:
     logger.info('processScanResults')
+    with metrics.timer('ProcessResultsTime'):
+        _processScanResults(ccResults, filename, tests, exceptionList)
+
+
+def _processScanResults(ccResults: str, filename: str, tests: ResultStore, exceptionList: Dict[str, Any]) -> None:
     try:
         resultsObj = json.loads(ccResults)
+        metrics.count('Checks', len(resultsObj["data"]))
 
         for check in resultsObj["data"]:
             ruleId = check['relationships']['rule']['data']['id']
@@ -353,7 +918,7 @@ def processScanResults(ccResults: str, filename: str, tests: Dict[str, Any], exc
             # Check to see if any failed checks are OK because on exception list
             if (f'{filename}#{ruleId}' in exceptionList):
                 rule = check['attributes']['message']
-                logger.debug(f'Rule {rule} passed as there is an approved exception')
+                logger.debug('Rule %s passed as there is an approved exception', rule)
                 status = 'skipped'
 
             addTestResult(check['id'],
@@ -362,24 +927,31 @@ def processScanResults(ccResults: str, filename: str, tests: Dict[str, Any], exc
                           f'{ruleId}: {message}',
                           filename,
                           status,
-                          tests)
-
-        # If 'tests' is empty means we are good to go
-        if (len(tests) == 0):
-            logger.debug(
-                f'No issues added to the list - therefore file {filename} has PASSED')
-            addTestResult('cloud-conformity-tests',
-                          'Template Scanning',
-                          'PASSED',
-                          'template scan found ZERO issues',
-                          filename,
-                          'passed',
-                          tests)
+                          tests,
+                          ruleId)
 
     except Exception:
         logger.debug("Could not convert results to cucumber format! " + traceback.format_exc())
 
 
+def addPassedResult(filenames: Sequence[str], failuresList: ResultStore) -> None:
+    """
+    Adds the single "found ZERO issues" check for a request (or account group) if nothing else was added to
+    failuresList, reported against the first scanned template
+    """
+    # If 'failuresList' is empty means we are good to go
+    if (len(failuresList) == 0 and filenames):
+        logger.debug(
+            f'No issues added to the list - therefore file {filenames[0]} has PASSED')
+        addTestResult('cloud-conformity-tests',
+                      'Template Scanning',
+                      'PASSED',
+                      'template scan found ZERO issues',
+                      filenames[0],
+                      'passed',
+                      failuresList)
+
+
 def addTestResult(
         id: str,
         ruleTitle: str,
@@ -387,38 +959,16 @@ def addTestResult(
         message: str,
         filename: str,
         status: str,
-        resultsArray: Dict[str, Any]):
-    logger.debug(f'Adding test {status} with message: {message}')
+        resultsArray: ResultStore,
+        ruleId: str = '',
+        error: bool = False):
+    logger.debug('Adding test %s with message: %s', status, message)
 
     status = convertStatus(status)
 
     # TODO add error handling
     if (riskLevel in FAILURE_FILTER or riskLevel == "PASSED" or riskLevel == "EXEMPTED"):
-
-        if riskLevel not in resultsArray:
-            resultsArray[riskLevel] = {
-                "id": "cloud-conformity-rules",
-                "description": "Results from scanning templates through Cloud Conformity",
-                "name": riskLevel,
-                "elements": []
-            }
-
-        failedCheck = {
-            "id": id,
-            "name": ruleTitle,
-            "steps": [
-                {
-                    "result": {
-                        "status": status
-                    },
-                    "name": message,
-                    "keyword": f'{filename}: '
-                }
-            ]
-        }
-
-        resultsArray[riskLevel]['elements'].append(failedCheck)
+        resultsArray.add(riskLevel, CheckResult(id, ruleTitle, message, filename, status, ruleId, error))
 
     else:
-        logger.debug(
-            f'Test result was ignored because risk level is {riskLevel}')
+        logger.debug('Test result was ignored because risk level is %s', riskLevel)
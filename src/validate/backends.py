@@ -0,0 +1,241 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Scanner backends: the engines a template is scanned with. The Conformity Template Scanner (registered by
+app.py) is the default, local engines such as the pre-scan rules (see prescan.py) or cfn-lint can run
+alongside it. SCANNER_BACKENDS, or a request's "scanners", picks the backends.
+
+A template's backends run concurrently: the first on the scan worker, the others on a shared pool of
+BACKEND_CONCURRENCY threads. Each backend's results are normalised to the Conformity risk levels, reported
+into a ResultStore of their own, then merged into the template's results in backend order, with a check id
+already reported for the file (eg. cfn-lint matching the same rule on the same line twice) left out.
+"""
+import abc
+import contextvars
+import importlib.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from validate import logs, metrics, prescan, profiling, serialization
+from validate.results import CheckResult, ResultStore
+
+logger = logs.get_logger("templateScannerBackends")
+
+# Comma separated backends templates are scanned with when the request doesn't say, default conformity
+SCANNER_BACKENDS_ENV = 'SCANNER_BACKENDS'
+# Backend scans run in parallel per Lambda container, besides the one running on each scan worker
+BACKEND_CONCURRENCY_ENV = 'BACKEND_CONCURRENCY'
+
+DEFAULT_BACKEND = 'conformity'
+DEFAULT_CONCURRENCY = 4
+
+# other engines' severities, as Conformity risk levels
+RISK_LEVELS = {
+    'critical': 'VERY_HIGH',
+    'extreme': 'VERY_HIGH',
+    'very_high': 'VERY_HIGH',
+    'error': 'HIGH',
+    'high': 'HIGH',
+    'warning': 'MEDIUM',
+    'medium': 'MEDIUM',
+    'informational': 'LOW',
+    'info': 'LOW',
+    'low': 'LOW',
+}
+
+BACKENDS: Dict[str, 'Backend'] = {}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executorWorkers = 0
+_executorLock = threading.Lock()
+
+
+class Check(NamedTuple):
+    """A check failed by a local backend, see Backend.report()"""
+    id: str
+    ruleId: str
+    title: str
+    riskLevel: str
+    message: str
+
+
+class ScanContext(NamedTuple):
+    # AWS account the scan is for
+    accountId: str
+    # its Conformity account, empty for the default rules
+    ccAccountId: str
+    # the filenames the template was sent as
+    filenames: List[str]
+
+
+class Backend(abc.ABC):
+    """
+    A template scanner. scan() runs once per unique template, report() adds its result to the results of each
+    filename the template was sent as
+    """
+    name = ''
+    title = ''
+    # sends the template outside the Lambda, skipped when the local backends already found a blocking failure
+    remote = False
+
+    def available(self) -> bool:
+        """:return: whether the engine can be used in this deployment"""
+        return True
+
+    @abc.abstractmethod
+    def scan(self, template: str, context: ScanContext) -> Any:
+        """:return: the scan result, by default a list of Checks"""
+
+    def report(self, result: Any, filename: str, store: ResultStore, exceptionList: Dict[str, Any]) -> None:
+        """
+        Adds the Checks of a scan as failed checks, or skipped if there is an approved exception for the rule
+        """
+        for check in result:
+            status = 'skipped' if f'{filename}#{check.ruleId}' in exceptionList else 'failed'
+            store.add(check.riskLevel,
+                      CheckResult(check.id, check.title, f'{check.ruleId}: {check.message}', filename, status,
+                                  check.ruleId))
+
+
+class PrescanBackend(Backend):
+    """The local pre-scan rules, see prescan.py"""
+    name = 'prescan'
+    title = 'Local checks'
+
+    def scan(self, template: str, context: ScanContext) -> Any:
+        return [Check(finding.id, finding.ruleId, finding.title, finding.riskLevel, finding.message)
+                for finding in prescan.scan(template)]
+
+
+class CfnLintBackend(Backend):
+    """cfn-lint (https://github.com/aws-cloudformation/cfn-lint), if it is in the deployment package"""
+    name = 'cfnlint'
+    title = 'cfn-lint'
+
+    def available(self) -> bool:
+        return importlib.util.find_spec('cfnlint') is not None
+
+    def scan(self, template: str, context: ScanContext) -> Any:
+        from cfnlint import api  # optional, see available()
+        with metrics.timer('CfnLintTime'):
+            matches = api.lint(template)
+        return [Check(f'cfnlint-{match.rule.id}-{match.linenumber}', match.rule.id, match.rule.shortdesc,
+                      risk_level(match.rule.severity), f'{match.message} (line {match.linenumber})')
+                for match in matches]
+
+
+def risk_level(severity: str) -> str:
+    """:return: the Conformity risk level of another engine's severity, LOW if it isn't known"""
+    level = RISK_LEVELS.get(str(severity).strip().lower().replace(' ', '_').replace('-', '_'))
+    if level is None:
+        logger.debug('Unknown severity %s reported as LOW', severity)
+        return 'LOW'
+    return level
+
+
+def register(backend: Backend) -> None:
+    BACKENDS[backend.name] = backend
+
+
+def default_names() -> List[str]:
+    names = [name.strip() for name in os.environ.get(SCANNER_BACKENDS_ENV, DEFAULT_BACKEND).split(',')]
+    return [name for name in names if name] or [DEFAULT_BACKEND]
+
+
+def validate(names: Sequence[str]) -> None:
+    """
+    :raises serialization.InvalidRequestError: if a backend isn't registered or can't be used here
+    """
+    for name in names:
+        backend = BACKENDS.get(name)
+        if backend is None:
+            raise serialization.InvalidRequestError(
+                f'Unknown scanner {name}, must be one of {", ".join(sorted(BACKENDS))}')
+        if not backend.available():
+            raise serialization.InvalidRequestError(f'Scanner {name} is not installed')
+
+
+def selected(names: Sequence[str] = ()) -> List[Backend]:
+    """:return: the named backends, SCANNER_BACKENDS if none are named"""
+    return [BACKENDS[name] for name in (names or default_names())]
+
+
+def executor() -> ThreadPoolExecutor:
+    """Shared pool the backends besides a template's first run on, rebuilt if BACKEND_CONCURRENCY changes"""
+    global _executor, _executorWorkers
+    workers = max(1, int(os.environ.get(BACKEND_CONCURRENCY_ENV, DEFAULT_CONCURRENCY)))
+    with _executorLock:
+        if _executor is None or _executorWorkers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(workers, thread_name_prefix='backend')
+            _executorWorkers = workers
+        return _executor
+
+
+def _scan(backend: Backend, template: str, context: ScanContext) -> Any:
+    try:
+        with profiling.worker():
+            return backend.scan(template, context)
+    except Exception as e:
+        logger.exception('Scanner %s failed', backend.name)
+        metrics.count('BackendErrors')
+        return e
+
+
+def run(backends: Sequence[Backend], template: str, context: ScanContext) -> List[Any]:
+    """
+    Scans a template with each backend, concurrently
+    :return: each backend's result, in order. A backend that failed returns the exception, see report()
+    """
+    pool = executor() if len(backends) > 1 else None
+    # the other backends' scans record into this invocation's metrics
+    futures = [pool.submit(contextvars.copy_context().run, _scan, backend, template, context)
+               for backend in backends[1:]] if pool else []
+    return [_scan(backends[0], template, context)] + [future.result() for future in futures]
+
+
+def report(backend: Backend, result: Any, filename: str, store: ResultStore, exceptionList: Dict[str, Any]) -> None:
+    """Adds a backend's result for filename, a failed scan as a failed VERY_HIGH check"""
+    if isinstance(result, Exception):
+        store.add('VERY_HIGH', CheckResult(f'{backend.name}-scan-error', f'{backend.title} scan error',
+                                           f'{backend.title} could not scan the template: {result}', filename,
+                                           'failed', error=True))
+    else:
+        backend.report(result, filename, store, exceptionList)
+
+
+def merge(stores: Sequence[ResultStore], into: ResultStore) -> None:
+    """
+    Adds the results of a template's backends, in backend order. A check whose id was already reported for the
+    file, by the same backend or an earlier one, is left out. Each engine has rule ids of its own, so a problem
+    found by more than one engine is still reported by each of them
+    """
+    seen = set()
+    duplicates = 0
+    for store in stores:
+        for riskLevel, results in store.groups.items():
+            for result in results:
+                key = (result.filename, result.id)
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                into.add(riskLevel, result)
+        into.incomplete |= store.incomplete
+    metrics.count('DuplicateChecks', duplicates)
+
+
+def reset() -> None:
+    """Drops the shared backend pool"""
+    global _executor
+    with _executorLock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+register(PrescanBackend())
+register(CfnLintBackend())
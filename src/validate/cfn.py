@@ -0,0 +1,83 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Parses CloudFormation templates (JSON, or YAML with the short form intrinsic function tags such as !Ref and
+!Sub) into plain dicts, with the tags expanded to their long form ({"Ref": ...}, {"Fn::Sub": ...}).
+"""
+import json
+from typing import Any, Dict
+
+# PyYAML is optional, without it only JSON templates can be parsed
+try:
+    import yaml
+except ImportError:  # pragma: no cover - depends on the deployment package
+    yaml = None
+
+
+class TemplateParseError(ValueError):
+    """Raised when a template is not valid JSON / YAML, or is not a mapping"""
+
+
+class ParserUnavailableError(TemplateParseError):
+    """Raised for a YAML template when PyYAML isn't installed, the template itself may well be valid"""
+
+
+# tags whose long form isn't simply Fn::<tag>
+_SPECIAL_TAGS = {'Ref': 'Ref', 'Condition': 'Condition'}
+INTRINSIC_TAGS = ('Ref', 'Condition', 'Base64', 'Cidr', 'FindInMap', 'GetAtt', 'GetAZs', 'ImportValue', 'Join',
+                  'Select', 'Split', 'Sub', 'Transform', 'And', 'Equals', 'If', 'Not', 'Or', 'Length', 'ToJsonString')
+
+
+if yaml is not None:
+    _BaseLoader: Any = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+    class TemplateLoader(_BaseLoader):  # type: ignore[misc, valid-type]
+        """SafeLoader that understands the CloudFormation tags, and leaves dates (eg. the template version) as text"""
+
+    # CloudFormation treats 2010-09-09 as a string, not a date
+    TemplateLoader.yaml_implicit_resolvers = {
+        first: [(tag, regexp) for tag, regexp in resolvers if tag != 'tag:yaml.org,2002:timestamp']
+        for first, resolvers in _BaseLoader.yaml_implicit_resolvers.items()
+    }
+
+    def _construct_intrinsic(loader: Any, tagSuffix: str, node: Any) -> Dict[str, Any]:
+        key = _SPECIAL_TAGS.get(tagSuffix, f'Fn::{tagSuffix}')
+        if isinstance(node, yaml.ScalarNode):
+            value: Any = loader.construct_scalar(node)
+            # !GetAtt Resource.Attribute is the short form of [Resource, Attribute]
+            if tagSuffix == 'GetAtt' and isinstance(value, str):
+                value = value.split('.', 1)
+        elif isinstance(node, yaml.SequenceNode):
+            value = loader.construct_sequence(node, deep=True)
+        else:
+            value = loader.construct_mapping(node, deep=True)
+        return {key: value}
+
+    for _tag in INTRINSIC_TAGS:
+        TemplateLoader.add_constructor(f'!{_tag}', lambda loader, node, _tag=_tag: _construct_intrinsic(loader, _tag, node))
+
+
+def parse(body: str) -> Dict[str, Any]:
+    """
+    :param body: template as JSON or YAML
+    :return: the template, with intrinsic function tags in their long (JSON) form
+    :raises TemplateParseError: if the template can't be parsed, ParserUnavailableError if it is YAML and PyYAML
+                                isn't installed
+    """
+    text = body.lstrip()
+    if text.startswith('{'):
+        try:
+            template = json.loads(text)
+        except ValueError as e:
+            raise TemplateParseError(f'Invalid JSON: {e}')
+    elif yaml is None:
+        raise ParserUnavailableError('YAML templates need PyYAML installed')
+    else:
+        try:
+            template = yaml.load(text, Loader=TemplateLoader)
+        except yaml.YAMLError as e:
+            raise TemplateParseError(f'Invalid YAML: {e}')
+
+    if not isinstance(template, dict):
+        raise TemplateParseError('Template is not a mapping')
+    return template
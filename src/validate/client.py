@@ -0,0 +1,366 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Command line client for the Validate API, intended to run inside CodeBuild.
+Finds CloudFormation templates under CFN_PATH, sends them to the Validate API in
+size limited chunks (in parallel), and writes the merged Cucumber results to results.json
+"""
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import urllib3
+
+from validate.client_cache import (DEFAULT_CACHE_DIR, DEFAULT_CACHE_TTL, CachedResults, ResultCache, as_response,
+                                   cache_key, file_digest, split_results)
+
+TEMPLATE_EXTENSIONS = ('.yml', '.yaml', '.template', '.json')
+IGNORE_FILENAME = '.validateignore'
+
+# Lambda proxy integrations accept at most 6MB request payloads, and API Gateway base64 encodes
+# the body (+33%), so keep each request body comfortably under that
+DEFAULT_MAX_CHUNK_BYTES = 3584 * 1024
+# CloudFormation templates typically compress 5-10x. Chunks are sized assuming a conservative ratio,
+# and any chunk that still compresses to more than the limit is split
+GZIP_CHUNK_RATIO = 3
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 30.0
+
+FAILURE_LEVELS = ("VERY_HIGH", "HIGH", "MEDIUM", "LOW")
+
+
+class ValidateApiError(Exception):
+    """Raised when the Validate API returns a non 200 response"""
+
+    def __init__(self, status: int, body: str) -> None:
+        super().__init__(f'Validate API returned {status}: {body}')
+        self.status = status
+        self.body = body
+
+
+class Template:
+    __slots__ = ('filename', 'path', 'size')
+
+    def __init__(self, filename: str, path: str, size: int) -> None:
+        # filename is relative to CFN_PATH, and is what exceptions are keyed on
+        self.filename = filename
+        self.path = path
+        self.size = size
+
+    def read(self) -> str:
+        return Path(self.path).read_text()
+
+
+def load_ignore_patterns(root: str, patterns: Sequence[str] = ()) -> List[str]:
+    """
+    Combines ignore patterns passed on the command line with any in <root>/.validateignore
+    (one glob per line, # for comments)
+    """
+    combined = list(patterns)
+    ignoreFile = os.path.join(root, IGNORE_FILENAME)
+    if os.path.isfile(ignoreFile):
+        with open(ignoreFile) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    combined.append(line)
+    return combined
+
+
+def is_ignored(relpath: str, patterns: Sequence[str]) -> bool:
+    name = relpath.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        pattern = pattern.rstrip('/')
+        if fnmatch.fnmatch(relpath, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def discover_templates(root: str,
+                       ignore: Sequence[str] = (),
+                       extensions: Sequence[str] = TEMPLATE_EXTENSIONS) -> List[Template]:
+    """
+    Recursively finds templates under root. Files and directories matching an ignore
+    pattern (matched against the path relative to root, or the bare name) are skipped.
+    :return: templates sorted by filename, so chunking is deterministic between builds
+    """
+    templates = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        reldir = '' if reldir == '.' else reldir.replace(os.sep, '/') + '/'
+
+        # prune ignored directories so they are not walked at all
+        dirnames[:] = [d for d in dirnames if not is_ignored(reldir + d, ignore)]
+
+        for name in filenames:
+            relpath = reldir + name
+            path = os.path.join(dirpath, name)
+            if name.lower().endswith(tuple(extensions)) and os.path.isfile(path) and not is_ignored(relpath, ignore):
+                templates.append(Template(relpath, path, os.path.getsize(path)))
+
+    return sorted(templates, key=lambda t: t.filename)
+
+
+def chunk_templates(templates: Sequence[Template], maxBytes: int) -> List[List[Template]]:
+    """
+    Splits templates into chunks whose combined size is under maxBytes. A template that
+    is bigger than maxBytes on its own is sent in a chunk by itself.
+    """
+    chunks: List[List[Template]] = []
+    current: List[Template] = []
+    currentSize = 0
+    for template in templates:
+        if current and currentSize + template.size > maxBytes:
+            chunks.append(current)
+            current, currentSize = [], 0
+        current.append(template)
+        currentSize += template.size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def account_from_build_arn(buildArn: str) -> Optional[str]:
+    match = re.search(r'arn:aws:codebuild:[a-z0-9-]+:(\d{12}):build', buildArn or '')
+    return match.group(1) if match else None
+
+
+class ValidateClient:
+    """
+    Sends chunks of templates to the Validate API over a single connection pool shared
+    by all worker threads
+    """
+
+    def __init__(self, url: str, hostHeader: Optional[str] = None, accountId: Optional[str] = None,
+                 workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT, compress: bool = True,
+                 maxBodyBytes: int = DEFAULT_MAX_CHUNK_BYTES) -> None:
+        self.url = url
+        self.accountId = accountId
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.compress = compress
+        self.maxBodyBytes = maxBodyBytes
+        self.headers = {'Content-Type': 'application/json'}
+        if hostHeader:
+            self.headers['Host'] = hostHeader
+        if compress:
+            # responses are decompressed by urllib3
+            self.headers['Accept-Encoding'] = 'gzip'
+        self.http = urllib3.PoolManager(maxsize=self.workers, retries=urllib3.Retry(total=2, backoff_factor=0.5))
+
+    def build_payload(self, chunk: Sequence[Template]) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            'templates': [{'filename': t.filename, 'template': t.read()} for t in chunk],
+            'responseVersion': 2
+        }
+        if self.accountId:
+            payload['accountId'] = self.accountId
+        return payload
+
+    def encode(self, payload: Dict[str, Any]) -> bytes:
+        body = json.dumps(payload).encode('utf-8')
+        return gzip.compress(body) if self.compress else body
+
+    def post(self, payload: Dict[str, Any], body: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        :param body: payload already encoded with encode(), if available
+        :raises ValidateApiError: if the API doesn't return 200
+        """
+        headers = dict(self.headers, **({'Content-Encoding': 'gzip'} if self.compress else {}))
+        resp = self.http.request('POST', self.url, headers=headers, body=body or self.encode(payload), timeout=self.timeout)
+        text = resp.data.decode('utf-8')
+        if resp.status != 200:
+            raise ValidateApiError(resp.status, text)
+        return json.loads(text)
+
+    def validate_chunk(self, chunk: Sequence[Template]) -> Dict[str, Any]:
+        """
+        POSTs one chunk of templates. Templates are only read from disk here, so at most
+        'workers' chunks are held in memory at once. If the encoded chunk is over the
+        payload limit it is split in two and sent as two requests.
+        """
+        payload = self.build_payload(chunk)
+        body = self.encode(payload)
+        if len(body) > self.maxBodyBytes and len(chunk) > 1:
+            middle = len(chunk) // 2
+            return merge_responses([self.validate_chunk(chunk[:middle]), self.validate_chunk(chunk[middle:])])
+        return self.post(payload, body)
+
+    def validate_responses(self, chunks: Sequence[Sequence[Template]]) -> List[Dict[str, Any]]:
+        """
+        Validates all chunks concurrently
+        :return: the responses, in chunk order
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.validate_chunk, chunks))
+
+    def validate(self, chunks: Sequence[Sequence[Template]]) -> Dict[str, Any]:
+        """
+        Validates all chunks concurrently and merges the responses (in chunk order)
+        """
+        return merge_responses(self.validate_responses(chunks))
+
+    def describe(self, templates: Sequence[Template]) -> Dict[str, Any]:
+        """
+        Asks the API what results for these templates depend on (CloudConformity account and
+        approved exceptions) without scanning anything. Only filenames are sent.
+        """
+        payload: Dict[str, Any] = {'templates': [{'filename': t.filename} for t in templates], 'describeOnly': True}
+        if self.accountId:
+            payload['accountId'] = self.accountId
+        return self.post(payload)
+
+
+def validate_with_cache(client: ValidateClient, templates: Sequence[Template], cache: ResultCache,
+                        maxChunkBytes: int) -> Dict[str, Any]:
+    """
+    Only sends templates without a (fresh) cached result to be scanned, and merges cached results
+    back in. Cache keys include the CloudConformity account and a version of the approved exceptions
+    for each file, both fetched from the API on every run, so cached results are not reused once
+    the account or exceptions change server side.
+    """
+    describe = client.describe(templates)
+    account = describe['conformityAccount']
+    versions = describe['exceptionsVersions']
+
+    keys: Dict[str, str] = {}
+    cached: List[CachedResults] = []
+    misses: List[Template] = []
+    for template in templates:
+        key = cache_key(template.filename, file_digest(template.path), account, versions.get(template.filename, ''))
+        keys[template.filename] = key
+        hit = cache.get(key)
+        if hit is None:
+            misses.append(template)
+        else:
+            cached.append(hit)
+
+    chunks = chunk_templates(misses, maxChunkBytes)
+    print(f'{len(cached)} template(s) unchanged since last scan, sending {len(misses)} in {len(chunks)} request(s)')
+
+    responses = client.validate_responses(chunks) if chunks else []
+    # templates that couldn't be scanned aren't split out, so they aren't cached
+    for chunk, response in zip(chunks, responses):
+        for filename, entries in split_results(response['results'], [t.filename for t in chunk]).items():
+            cache.put(keys[filename], entries)
+    cache.prune()
+
+    # describe carries the request level checks (eg. account validation)
+    return merge_responses([describe, as_response(cached)] + responses)
+
+
+def _request_level(element: Dict[str, Any]) -> bool:
+    # checks not tied to a template (eg. account validation) are repeated in every chunk
+    return element['steps'][0]['keyword'] == ': '
+
+
+def merge_responses(responses: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges v2 Validate API responses into a single response. Features are merged by
+    risk level, highest severity first then PASSED (any others after, in the order first seen),
+    request level checks are de-duplicated, and failures are recounted from the merged results.
+    """
+    features: Dict[str, Dict[str, Any]] = {}
+    seenRequestLevel = set()
+    for response in responses:
+        for feature in response['results']:
+            merged = features.get(feature['name'])
+            if merged is None:
+                merged = features[feature['name']] = dict(feature, elements=[])
+            for element in feature['elements']:
+                if _request_level(element):
+                    key = json.dumps(element, sort_keys=True)
+                    if key in seenRequestLevel:
+                        continue
+                    seenRequestLevel.add(key)
+                merged['elements'].append(element)
+
+    failures = dict.fromkeys(FAILURE_LEVELS, 0)
+    for riskLevel, feature in features.items():
+        if riskLevel in failures:
+            failures[riskLevel] = sum(1 for e in feature['elements'] if e['steps'][0]['result']['status'] == 'failed')
+
+    order = {riskLevel: rank for rank, riskLevel in enumerate(FAILURE_LEVELS + ('PASSED',))}
+    ordered = sorted(features.values(), key=lambda feature: order.get(feature['name'], len(order)))
+    return {'failures': failures, 'results': ordered}
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='validate-templates', description=__doc__)
+    parser.add_argument('--path', default=os.environ.get('CFN_PATH', 'build/'),
+                        help='Directory to search (recursively) for templates. Default: $CFN_PATH or build/')
+    parser.add_argument('--url', default=os.environ.get('VALIDATE_API_URL'),
+                        help='Validate API URL. Default: $VALIDATE_API_URL')
+    parser.add_argument('--host-header', default=os.environ.get('VALIDATE_HOST_HEADER'),
+                        help='Host header for the private API. Default: $VALIDATE_HOST_HEADER')
+    parser.add_argument('--account-id', default=account_from_build_arn(os.environ.get('CODEBUILD_BUILD_ARN', '')),
+                        help='AWS account id to validate against. Default: taken from $CODEBUILD_BUILD_ARN')
+    parser.add_argument('--ignore', action='append', default=[],
+                        help=f'Glob of files/directories to skip, can be repeated. Patterns in <path>/{IGNORE_FILENAME} are also used')
+    parser.add_argument('--max-chunk-bytes', type=int, default=DEFAULT_MAX_CHUNK_BYTES,
+                        help='Maximum (compressed) request body size')
+    parser.add_argument('--no-gzip', action='store_true', help='Send and receive uncompressed bodies')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of requests sent concurrently')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Request timeout in seconds')
+    parser.add_argument('--output', default='results.json', help='File to write the Cucumber JSON results to')
+    parser.add_argument('--cache-dir', default=os.environ.get('VALIDATE_CACHE_DIR', DEFAULT_CACHE_DIR),
+                        help='Directory for cached results of unchanged templates. Default: $VALIDATE_CACHE_DIR or .validate-cache')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help='Seconds a cached result is reused for, so CloudConformity rule changes are picked up. Default: 1 day')
+    parser.add_argument('--no-cache', action='store_true', help='Scan every template, ignoring the cache')
+    parser.add_argument('--max-very-high', type=int, default=0,
+                        help='Exit with a failure if there are more VERY_HIGH failures than this. Default: 0')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    if not args.url:
+        print('No Validate API URL provided, set VALIDATE_API_URL or pass --url', file=sys.stderr)
+        return 2
+
+    templates = discover_templates(args.path, load_ignore_patterns(args.path, args.ignore))
+    for template in templates:
+        print(f'{template.filename} ({template.size} bytes)')
+    if not templates:
+        print(f'No templates found in {args.path}')
+
+    compress = not args.no_gzip
+    client = ValidateClient(args.url, args.host_header, args.account_id, args.workers, args.timeout,
+                            compress, args.max_chunk_bytes)
+    # chunks are built from (uncompressed) template sizes
+    chunkBytes = args.max_chunk_bytes * (GZIP_CHUNK_RATIO if compress else 1)
+    try:
+        if args.no_cache:
+            # with no templates, still send one (empty) request so the account is validated
+            chunks = chunk_templates(templates, chunkBytes) or [[]]
+            print(f'Sending {len(templates)} templates in {len(chunks)} request(s)')
+            merged = client.validate(chunks)
+        else:
+            merged = validate_with_cache(client, templates, ResultCache(args.cache_dir, args.cache_ttl),
+                                         chunkBytes)
+    except ValidateApiError as e:
+        print(f'{e}\nMarking as failure. Ask Cloud Ops team to investigate', file=sys.stderr)
+        return 255
+    except urllib3.exceptions.HTTPError as e:
+        print(f'Connection failed to {args.url}: {e}', file=sys.stderr)
+        return 255
+
+    with open(args.output, 'w') as f:
+        json.dump(merged['results'], f)
+
+    print(f'Failures: {json.dumps(merged["failures"])}')
+    if merged['failures']['VERY_HIGH'] > args.max_very_high:
+        return 255
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
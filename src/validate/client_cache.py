@@ -0,0 +1,122 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Bump when the cached entry format, or how results are produced, changes
+CACHE_FORMAT_VERSION = '2'
+DEFAULT_CACHE_DIR = '.validate-cache'
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+
+# (risk level, cucumber element) pairs for one template
+CachedResults = List[Tuple[str, Dict[str, Any]]]
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file, read in blocks so large templates aren't held in memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(filename: str, templateDigest: str, conformityAccount: str, exceptionsVersion: str) -> str:
+    """
+    Results depend on the template content, the CloudConformity account (its rule configuration),
+    and the approved exceptions for the file (exceptions are keyed on filename, so it is part of the key too)
+    """
+    parts = [CACHE_FORMAT_VERSION, filename, templateDigest, conformityAccount, exceptionsVersion]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def split_results(results: Sequence[Dict[str, Any]], filenames: Sequence[str]) -> Dict[str, CachedResults]:
+    """
+    Splits cucumber results from a validate response into per template results. Elements not
+    belonging to one of filenames (eg. account validation) are left out, and so are templates
+    that couldn't be scanned (an element marked "error"), so they are scanned again next time.
+    """
+    byKeyword: Dict[str, CachedResults] = {f'{filename}: ': [] for filename in filenames}
+    errored = set()
+    for feature in results:
+        for element in feature['elements']:
+            keyword = element['steps'][0]['keyword']
+            entries = byKeyword.get(keyword)
+            if entries is not None:
+                entries.append((feature['name'], element))
+                if element.get('error'):
+                    errored.add(keyword)
+    return {keyword[:-2]: entries for keyword, entries in byKeyword.items() if keyword not in errored}
+
+
+def as_response(cached: Sequence[CachedResults]) -> Dict[str, Any]:
+    """
+    Rebuilds a validate response (cucumber features grouped by risk level) from cached results,
+    so it can be merged with fresh responses
+    """
+    features: Dict[str, Dict[str, Any]] = {}
+    for entries in cached:
+        for riskLevel, element in entries:
+            feature = features.get(riskLevel)
+            if feature is None:
+                feature = features[riskLevel] = {
+                    "id": "cloud-conformity-rules",
+                    "description": "Results from scanning templates through Cloud Conformity",
+                    "name": riskLevel,
+                    "elements": []
+                }
+            feature['elements'].append(element)
+    return {'results': list(features.values())}
+
+
+class ResultCache:
+    """
+    Per template validate results stored as one JSON file per cache key. Point the directory at
+    a CodeBuild cache path so it survives between builds.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_CACHE_TTL) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str) -> Optional[CachedResults]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path) as f:
+                return [(riskLevel, element) for riskLevel, element in json.load(f)]
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, results: CachedResults) -> None:
+        # write then rename, so a cancelled build never leaves a partial entry behind
+        path = self._path(key)
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(results, f)
+        os.replace(tmpPath, path)
+
+    def prune(self) -> int:
+        """
+        Removes expired entries
+        :return: number of entries removed
+        """
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
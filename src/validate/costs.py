@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Predicts how long a template takes to scan, so a request's scans can be started longest first (LPT): a 2 MB
+template started last leaves the whole request waiting on it while the other workers sit idle.
+
+A template never scanned before is predicted from its size, at the average seconds per byte of the scans
+seen so far. Once a file has been scanned its own (moving average) scan time is used instead, scaled by how
+much the template has grown or shrunk since. Scan times are kept per Lambda container (or validate-server
+process), for the SCAN_COST_HISTORY most recently scanned files.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from validate import logs
+
+logger = logs.get_logger("templateScannerCosts")
+
+# Files whose scan times are remembered, 0 predicts from template size alone
+SCAN_COST_HISTORY_ENV = 'SCAN_COST_HISTORY'
+
+DEFAULT_HISTORY = 4096
+# weight of the latest scan in the moving averages
+ALPHA = 0.3
+# until a scan has been timed: ~1s per 100KB, only the ordering matters
+DEFAULT_SECONDS_PER_BYTE = 1e-5
+
+_model: Optional['CostModel'] = None
+_modelLock = threading.Lock()
+
+
+class CostModel:
+    """
+    :param maxFiles: files whose scan times are remembered, least recently scanned are forgotten first
+    """
+
+    def __init__(self, maxFiles: int = DEFAULT_HISTORY) -> None:
+        self.maxFiles = maxFiles
+        self.secondsPerByte = DEFAULT_SECONDS_PER_BYTE
+        # (accountId, filename) -> (seconds, template bytes) of its scans
+        self._files: 'OrderedDict[Tuple[str, str], Tuple[float, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def predict(self, accountId: str, filename: str, size: int) -> float:
+        """
+        :return: predicted scan seconds for a template of size bytes
+        """
+        with self._lock:
+            known = self._files.get((accountId, filename))
+            if known is None:
+                return size * self.secondsPerByte
+            seconds, knownSize = known
+            return seconds * size / knownSize if knownSize else seconds
+
+    def observe(self, accountId: str, filename: str, size: int, seconds: float) -> None:
+        """
+        Records how long a scan of a template of size bytes took
+        """
+        with self._lock:
+            if size:
+                self.secondsPerByte = ALPHA * seconds / size + (1 - ALPHA) * self.secondsPerByte
+            if not self.maxFiles:
+                return
+            key = (accountId, filename)
+            known = self._files.pop(key, None)
+            if known is not None and known[1] and size:
+                # average over the template's scans, at its current size
+                seconds = ALPHA * seconds + (1 - ALPHA) * known[0] * size / known[1]
+            self._files[key] = (seconds, size)
+            while len(self._files) > self.maxFiles:
+                self._files.popitem(last=False)
+
+
+def model() -> CostModel:
+    """Shared cost model, kept between invocations"""
+    global _model
+    with _modelLock:
+        if _model is None:
+            _model = CostModel(int(os.environ.get(SCAN_COST_HISTORY_ENV, DEFAULT_HISTORY)))
+        return _model
+
+
+def reset() -> None:
+    """Forgets all scan times"""
+    global _model
+    with _modelLock:
+        _model = None
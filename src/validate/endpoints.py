@@ -0,0 +1,243 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Routes CloudConformity API calls across one or more regional endpoints. Each endpoint's latency (a moving
+average) and recent errors are tracked, calls go to the fastest healthy endpoint and fail over to the next
+one on connection errors, timeouts, 429s and 5xx responses, and 401 / 403 responses (Conformity API keys are
+region scoped, so another region may accept a key this one rejects). An endpoint that keeps failing is taken
+out of rotation for a cool down period, then tried again.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, List, Optional, Tuple, Union
+
+import requests
+
+from validate import logs, metrics, transport
+
+logger = logs.get_logger("templateScannerEndpoints")
+
+# Base URL of the CloudConformity API, defaults to the endpoint in AWS_REGION. Override to point
+# the validate API at another endpoint (eg. a local stand-in for benchmarks)
+CONFORMITY_API_URL_ENV = 'CONFORMITY_API_URL'
+# Comma separated Conformity regions (eg. us-west-2,us-east-1) and / or base URLs to route between, in order
+# of preference. Takes precedence over CONFORMITY_API_URL
+CONFORMITY_ENDPOINTS_ENV = 'CONFORMITY_ENDPOINTS'
+# Seconds to wait for an endpoint to respond before failing over, default DEFAULT_READ_TIMEOUT
+CONFORMITY_TIMEOUT_ENV = 'CONFORMITY_TIMEOUT'
+# Seconds a failing endpoint is left out of rotation
+CONFORMITY_ENDPOINT_COOLDOWN_ENV = 'CONFORMITY_ENDPOINT_COOLDOWN'
+
+DEFAULT_COOLDOWN = 30.0
+# seconds to wait for a connection, and for a response (long enough for a large template's scan, short enough
+# to fail over within the 30 second Lambda timeout)
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 20.0
+# weight of the latest call in the latency moving average
+LATENCY_ALPHA = 0.3
+# outcomes kept per endpoint for the error rate
+ERROR_WINDOW = 20
+# an endpoint is taken out of rotation after this many failures in a row ...
+MAX_CONSECUTIVE_FAILURES = 3
+# ... or when at least half of the last ERROR_WINDOW calls (and at least MIN_ERROR_SAMPLES) failed
+MAX_ERROR_RATE = 0.5
+MIN_ERROR_SAMPLES = 5
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# the endpoint rejected the API key or account, eg. a key for another region
+REJECTED_STATUS = (401, 403)
+
+_router: Optional['Router'] = None
+_routerLock = threading.Lock()
+
+
+def region_url(region: str) -> str:
+    return f'https://{region}-api.cloudconformity.com'
+
+
+class Endpoint:
+    """
+    Rolling latency and error stats for one Conformity endpoint
+    :param url: base URL, eg. https://us-west-2-api.cloudconformity.com
+    """
+
+    def __init__(self, url: str, cooldown: float = DEFAULT_COOLDOWN) -> None:
+        self.url = url.rstrip('/')
+        self.cooldown = cooldown
+        self.latency: Optional[float] = None
+        self.outcomes: Deque[bool] = deque(maxlen=ERROR_WINDOW)
+        self.consecutiveFailures = 0
+        self.ejectedUntil = 0.0
+        # back from a cool down but not yet succeeded, a single failure takes it out of rotation again
+        self.probation = False
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejectedUntil
+
+    def record_success(self, elapsed: float) -> None:
+        self.latency = elapsed if self.latency is None else LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * self.latency
+        self.outcomes.append(True)
+        self.consecutiveFailures = 0
+        self.probation = False
+
+    def record_failure(self, elapsed: float, now: float) -> bool:
+        """
+        :return: True if the endpoint was taken out of rotation
+        """
+        # a failure is at least as slow as the time it took, so a timing out endpoint also drops down the order
+        if self.latency is None or elapsed > self.latency:
+            self.latency = elapsed if self.latency is None else LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * self.latency
+        self.outcomes.append(False)
+        self.consecutiveFailures += 1
+        if (self.probation or self.consecutiveFailures >= MAX_CONSECUTIVE_FAILURES
+                or (len(self.outcomes) >= MIN_ERROR_SAMPLES and self.error_rate >= MAX_ERROR_RATE)):
+            self.ejectedUntil = now + self.cooldown
+            self.outcomes.clear()
+            self.consecutiveFailures = 0
+            self.probation = True
+            return True
+        return False
+
+    def stats(self) -> Any:
+        return {
+            'url': self.url,
+            'latencyMs': None if self.latency is None else round(self.latency * 1000, 3),
+            'errorRate': round(self.error_rate, 3),
+            'ejected': not self.healthy(time.monotonic())
+        }
+
+
+class Router:
+    """
+    :param urls: endpoint base URLs in order of preference, used to break ties between endpoints
+    :param timeout: seconds to wait for each endpoint, as requests takes it (a number, or (connect, read))
+    """
+
+    def __init__(self, urls: List[str],
+                 timeout: Union[float, Tuple[float, float], None] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 cooldown: float = DEFAULT_COOLDOWN) -> None:
+        if not urls:
+            raise ValueError('At least one Conformity endpoint is required')
+        self.endpoints = [Endpoint(url, cooldown) for url in urls]
+        self.timeout = timeout
+        # the configuration the shared router was built from, see router()
+        self.settings: Tuple[Any, ...] = ()
+        self._lock = threading.Lock()
+
+    def candidates(self) -> List[Endpoint]:
+        """
+        Endpoints in the order they should be tried: healthy ones, those that failed their last calls after those
+        that didn't, fastest first (endpoints not called yet count as fastest, so each is measured), then ones out
+        of rotation, soonest back first, as a last resort
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = list(enumerate(self.endpoints))
+            healthy = sorted((e for e in ranked if e[1].healthy(now)),
+                             key=lambda e: (e[1].consecutiveFailures, e[1].latency or 0.0, e[0]))
+            ejected = sorted((e for e in ranked if not e[1].healthy(now)),
+                             key=lambda e: (e[1].ejectedUntil, e[0]))
+        return [endpoint for _, endpoint in healthy + ejected]
+
+    def _record(self, endpoint: Endpoint, ok: bool, elapsed: float) -> None:
+        with self._lock:
+            if ok:
+                endpoint.record_success(elapsed)
+            elif endpoint.record_failure(elapsed, time.monotonic()):
+                logger.warning('Conformity endpoint %s taken out of rotation for %ss', endpoint.url, endpoint.cooldown)
+                metrics.count('EndpointEjections')
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """
+        Makes the call against each endpoint in turn until one responds without a retryable error, or rejecting
+        the API key
+        :param path: API path, eg. /v1/accounts
+        :param kwargs: passed to requests
+        :return: the first successful response, or the last endpoint's response if all of them failed
+        :raises requests.RequestException: if no endpoint responded
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        lastError: Optional[Exception] = None
+        resp: Optional[requests.Response] = None
+        for attempt, endpoint in enumerate(self.candidates()):
+            if attempt:
+                logger.warning('Failing over to Conformity endpoint %s', endpoint.url)
+                metrics.count('EndpointFailovers')
+            start = time.perf_counter()
+            try:
+                resp = transport.session().request(method, endpoint.url + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, False, time.perf_counter() - start)
+                logger.warning('Conformity endpoint %s failed: %s', endpoint.url, e)
+                lastError = e
+                continue
+
+            ok = resp.status_code not in RETRYABLE_STATUS and resp.status_code not in REJECTED_STATUS
+            self._record(endpoint, ok, time.perf_counter() - start)
+            if ok:
+                return resp
+            logger.warning('Conformity endpoint %s responded %s', endpoint.url, resp.status_code)
+
+        if resp is not None:
+            return resp
+        assert lastError is not None
+        raise lastError
+
+    def stats(self) -> List[Any]:
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+
+def endpoint_urls() -> List[str]:
+    """
+    :return: base URLs from CONFORMITY_ENDPOINTS, else CONFORMITY_API_URL, else the endpoint in AWS_REGION
+    """
+    configured = [entry.strip() for entry in os.environ.get(CONFORMITY_ENDPOINTS_ENV, '').split(',') if entry.strip()]
+    if configured:
+        return [entry if '://' in entry else region_url(entry) for entry in configured]
+    baseUrl = os.environ.get(CONFORMITY_API_URL_ENV)
+    return [baseUrl if baseUrl else region_url(os.environ['AWS_REGION'])]
+
+
+def _settings() -> Tuple[Tuple[str, ...], Tuple[float, float], float]:
+    timeout = os.environ.get(CONFORMITY_TIMEOUT_ENV)
+    return (tuple(endpoint_urls()), (DEFAULT_CONNECT_TIMEOUT, float(timeout) if timeout else DEFAULT_READ_TIMEOUT),
+            float(os.environ.get(CONFORMITY_ENDPOINT_COOLDOWN_ENV, DEFAULT_COOLDOWN)))
+
+
+def router() -> Router:
+    """
+    Router shared by every call, so endpoint stats carry across invocations in a warm container. Rebuilt
+    (losing the stats) if the endpoint settings change
+    """
+    global _router
+    settings = _settings()
+    current = _router
+    if current is None or current.settings != settings:
+        with _routerLock:
+            if _router is None or _router.settings != settings:
+                urls, timeout, cooldown = settings
+                _router = Router(list(urls), timeout, cooldown)
+                _router.settings = settings
+            current = _router
+    return current
+
+
+def request(method: str, path: str, **kwargs: Any) -> requests.Response:
+    """Calls the CloudConformity API through the shared router, see Router.request"""
+    return router().request(method, path, **kwargs)
+
+
+def reset() -> None:
+    """Drops the shared router and its endpoint stats"""
+    global _router
+    with _routerLock:
+        _router = None
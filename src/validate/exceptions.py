@@ -1,15 +1,15 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import hashlib
 import json
 import boto3
 import traceback
-import logging
 import os
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
-from typing import Any, Dict
-logger = logging.getLogger("TemplateScannerExceptions")
-logger.setLevel(logging.DEBUG)
+from typing import Any, Dict, List
+from validate import logs, metrics, serialization
+logger = logs.get_logger("TemplateScannerExceptions")
 
 
 def request(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Dict[str, Any]:
@@ -36,7 +36,8 @@ def request(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Di
     statusCode = 500
     message = ''
     try:
-        logger.info("request(event): " + json.dumps(event, indent=2))
+        logger.info('request(event): %s', logs.Fields(bodyBytes=len(event.get('body') or '')))
+        logger.debug('request(event) payload: %s', logs.payload(event))
 
         if (dynamodb is None):
             dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
@@ -44,7 +45,7 @@ def request(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Di
 
         # loop through list of exception requests, add to table
         with table.batch_writer() as batch:
-            for req in json.loads(event['body']):
+            for req in json.loads(serialization.load_request_body(event)):
                 item = {
                     'partKey': req["awsAccountId"],
                     'sortKey': f'{req["filename"]}#{req["ruleId"]}',
@@ -59,6 +60,10 @@ def request(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Di
         logger.info('Successfully added requests')
         statusCode = 201
 
+    except serialization.RequestTooLargeError as e:
+        logger.error(f'Request too large: {e}')
+        statusCode = 413
+        message = str(e)
     except ClientError as e:
         message = f'Error adding exception to table: {e.response["Error"]["Message"]}'
         logger.error(message)
@@ -92,15 +97,16 @@ def approve(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Di
     statusCode = 500
     message = ''
     try:
-        logger.info("approve(event): " + json.dumps(event, indent=2))
+        logger.info('approve(event): %s', logs.Fields(bodyBytes=len(event.get('body') or '')))
+        logger.debug('approve(event) payload: %s', logs.payload(event))
 
         if (dynamodb is None):
             dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
         table = dynamodb.Table(os.environ.get('EXCEPTIONS_TABLENAME'))
 
-        req = json.loads(event['body'])
+        req = json.loads(serialization.load_request_body(event))
         sortKey = f'{req["filename"]}#{req["ruleId"]}'
-        logger.debug(f'approving item with partKey: {req["awsAccountId"]} sortKey: {sortKey}')
+        logger.debug('approving item with partKey: %s sortKey: %s', req["awsAccountId"], sortKey)
         table.update_item(
             Key={"partKey": req["awsAccountId"], "sortKey": sortKey},
             ConditionExpression=Attr('partKey').eq(req["awsAccountId"]) & Attr('sortKey').eq(sortKey),
@@ -112,12 +118,16 @@ def approve(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Di
             ReturnValues="UPDATED_NEW"
         )
 
-        logger.info('Successfully approved request for {req["awsAccountId"]} sortKey: {sortKey}')
+        logger.info('Successfully approved request for %s sortKey: %s', req["awsAccountId"], sortKey)
         statusCode = 201
 
     except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
         message = 'No matching request found to approve'
         logger.warning(message)
+    except serialization.RequestTooLargeError as e:
+        logger.error(f'Request too large: {e}')
+        statusCode = 413
+        message = str(e)
     except ClientError as e:
         message = f'Error adding exception to table: {e.response["Error"]["Message"]}'
         logger.error(message)
@@ -151,25 +161,30 @@ def delete(event: Dict[str, Any], context: Dict[str, Any], dynamodb=None) -> Dic
     statusCode = 500
     message = ''
     try:
-        logger.info("approve(event): " + json.dumps(event, indent=2))
+        logger.info('delete(event): %s', logs.Fields(bodyBytes=len(event.get('body') or '')))
+        logger.debug('delete(event) payload: %s', logs.payload(event))
 
         if (dynamodb is None):
             dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
         table = dynamodb.Table(os.environ.get('EXCEPTIONS_TABLENAME'))
 
-        req = json.loads(event['body'])
+        req = json.loads(serialization.load_request_body(event))
         sortKey = f'{req["filename"]}#{req["ruleId"]}'
-        logger.debug(f'approving item with partKey: {req["awsAccountId"]} sortKey: {sortKey}')
+        logger.debug('deleting item with partKey: %s sortKey: %s', req["awsAccountId"], sortKey)
         table.delete_item(
             Key={"partKey": req["awsAccountId"], "sortKey": sortKey}
         )
 
-        logger.info('Successfully removed exception for {req["awsAccountId"]} sortKey: {sortKey}')
+        logger.info('Successfully removed exception for %s sortKey: %s', req["awsAccountId"], sortKey)
         statusCode = 200
 
     except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
         message = 'No matching request found to approve'
         logger.warning(message)
+    except serialization.RequestTooLargeError as e:
+        logger.error(f'Request too large: {e}')
+        statusCode = 413
+        message = str(e)
     except ClientError as e:
         message = f'Error adding exception to table: {e.response["Error"]["Message"]}'
         logger.error(message)
@@ -198,33 +213,73 @@ def get_approved_exceptions(awsAccountId: str, dynamodb: Any = None) -> Dict[str
     :param dynamodb: Pass in for unit testing, otherwise None will mean dynamodb resource will be created
     :return: dictionary where key = <filename>#<ruleId> value = <exception entry>
     """
-    exceptionDict = {}
+    return get_approved_exceptions_for_accounts([awsAccountId], dynamodb)[awsAccountId]
+
+
+def get_approved_exceptions_for_accounts(awsAccountIds: List[str], dynamodb: Any = None) -> Dict[str, Dict[str, Any]]:
+    """
+    get_approved_exceptions() for several AWS accounts (eg. a multi-account validate request), each account
+    queried once with the same table
+    :return: AWS account number -> dictionary where key = <filename>#<ruleId> value = <exception entry>
+    """
+    approved: Dict[str, Dict[str, Any]] = {}
+    table = None
     try:
-        logger.info(f'get_approved_exceptions({awsAccountId})')
         if (dynamodb is None):
             dynamodb = boto3.resource('dynamodb', os.environ['AWS_REGION'])
-
         table = dynamodb.Table(os.environ.get('EXCEPTIONS_TABLENAME'))
-        response = table.query(
-            KeyConditionExpression=Key('partKey').eq(awsAccountId)
-        )
+    except Exception:
+        logger.warning("Exception occurred whilst retrieving approved exceptions: " + traceback.format_exc())
 
-        logger.debug(f'Raw table dump for account {awsAccountId}:\n {response["Items"]}')
+    for awsAccountId in dict.fromkeys(awsAccountIds):
+        approved[awsAccountId] = _query_approved(table, awsAccountId) if table is not None else {}
+    return approved
 
-        for ex in response['Items']:
-            # sortKey is in format: <filename>#<ruleId>
-            try:
-                if (ex['approved'] == 'true'):
-                    exceptionDict[ex['sortKey']] = ex
-                    logger.debug(f'approved exception: {ex["sortKey"]}')
-            except TypeError:
-                continue  # the exception request is not approved
 
-        logger.debug(f'exception list for account {awsAccountId}:\n {response["Items"]}')
+def _query_approved(table: Any, awsAccountId: str) -> Dict[str, Any]:
+    exceptionDict = {}
+    try:
+        logger.info(f'get_approved_exceptions({awsAccountId})')
+        query = {
+            'KeyConditionExpression': Key('partKey').eq(awsAccountId),
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+        with metrics.timer('ExceptionsQueryTime'):
+            # a query returns at most 1MB, follow LastEvaluatedKey for accounts with more exceptions than that
+            while True:
+                response = table.query(**query)
+                metrics.count('ExceptionsQueryPages')
+                metrics.count('ExceptionsReadCapacity', float(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)))
+
+                logger.debug('Raw table dump for account %s: %s', awsAccountId, logs.payload(response["Items"]))
+
+                for ex in response['Items']:
+                    # sortKey is in format: <filename>#<ruleId>
+                    # requests that haven't been approved yet have no 'approved' attribute
+                    if (ex.get('approved') == 'true'):
+                        exceptionDict[ex['sortKey']] = ex
+                        logger.debug('approved exception: %s', ex["sortKey"])
+
+                if ('LastEvaluatedKey' not in response):
+                    break
+                query['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
     except Exception:
         logger.warning("Exception occurred whilst retrieving approved exceptions: " + traceback.format_exc())
 
-    logger.info(f'get_approved_exceptions(): Approved exception list for {awsAccountId}: {exceptionDict.keys()}')
+    logger.info('get_approved_exceptions(): %s', logs.Fields(awsAccountId=awsAccountId, approved=len(exceptionDict)))
+    metrics.count('ApprovedExceptions', len(exceptionDict))
 
     return exceptionDict
+
+
+def exceptions_version(exceptionDict: Dict[str, Any], filename: str) -> str:
+    """
+    A short hash of the approved exceptions that apply to filename. Changes whenever an exception
+    for the file is approved or deleted, so clients can tell when cached results are stale.
+    :param exceptionDict: as returned by get_approved_exceptions()
+    :return: hex digest (the same value for every file with no exceptions)
+    """
+    prefix = f'{filename}#'
+    keys = sorted(key for key in exceptionDict if key.startswith(prefix))
+    return hashlib.sha256('\n'.join(keys).encode('utf-8')).hexdigest()[:16]
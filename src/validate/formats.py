@@ -0,0 +1,184 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import io
+import json
+from typing import Any, Callable, Dict, List, TextIO, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from validate.results import CUCUMBER_FEATURE_DESCRIPTION, CUCUMBER_FEATURE_ID, CheckResult, ResultStore
+from validate.serialization import InvalidRequestError
+
+DEFAULT_OUTPUT_FORMAT = 'cucumber'
+
+TOOL_NAME = 'cloud-conformity-template-scanner'
+TOOL_URI = 'https://cloudone.trendmicro.com/docs/conformity/api-reference/tag/Template-scanner'
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+
+# CloudConformity risk level -> SARIF result level
+SARIF_LEVELS = {
+    'VERY_HIGH': 'error',
+    'HIGH': 'error',
+    'MEDIUM': 'warning',
+    'LOW': 'note'
+}
+
+
+def _ordered_groups(store: ResultStore) -> List[str]:
+    # highest sev first, the same order as the Cucumber output
+    return list(reversed(list(store.groups.keys())))
+
+
+def write_cucumber(store: ResultStore, out: TextIO) -> None:
+    """
+    Cucumber JSON (readable by CodeBuild reports). Output is identical to json.dumps(store.cucumber()),
+    but elements are written one at a time rather than building the whole document first.
+    """
+    out.write('[')
+    for i, riskLevel in enumerate(_ordered_groups(store)):
+        if i:
+            out.write(', ')
+        out.write(f'{{"id": {json.dumps(CUCUMBER_FEATURE_ID)}, '
+                  f'"description": {json.dumps(CUCUMBER_FEATURE_DESCRIPTION)}, '
+                  f'"name": {json.dumps(riskLevel)}, "elements": [')
+        for j, result in enumerate(store.groups[riskLevel]):
+            if j:
+                out.write(', ')
+            out.write(json.dumps(result.cucumber()))
+        out.write(']}')
+    out.write(']')
+
+
+def write_junit(store: ResultStore, out: TextIO) -> None:
+    """
+    JUnit XML, one <testsuite> per risk level and one <testcase> per check.
+    Excepted checks are reported as skipped.
+    """
+    groups = _ordered_groups(store)
+    totals = [_junit_counts(store.groups[riskLevel]) for riskLevel in groups]
+
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write(f'<testsuites name={quoteattr(CUCUMBER_FEATURE_ID)} tests="{sum(t[0] for t in totals)}" '
+              f'failures="{sum(t[1] for t in totals)}" errors="{sum(t[2] for t in totals)}" '
+              f'skipped="{sum(t[3] for t in totals)}">\n')
+
+    for riskLevel, (tests, failures, errors, skipped) in zip(groups, totals):
+        out.write(f'  <testsuite name={quoteattr(riskLevel)} tests="{tests}" failures="{failures}" '
+                  f'errors="{errors}" skipped="{skipped}">\n')
+        for result in store.groups[riskLevel]:
+            out.write(f'    <testcase classname={quoteattr(result.filename)} name={quoteattr(result.name)}')
+            if result.status == 'passed':
+                out.write('/>\n')
+                continue
+            out.write('>\n')
+            if result.status == 'failed':
+                out.write(f'      <failure type={quoteattr(riskLevel)} message={quoteattr(result.message)}>'
+                          f'{escape(result.id)}</failure>\n')
+            elif result.status == 'skipped':
+                out.write(f'      <skipped message={quoteattr(result.message)}/>\n')
+            else:
+                out.write(f'      <error type={quoteattr(result.status)} message={quoteattr(result.message)}>'
+                          f'{escape(result.id)}</error>\n')
+            out.write('    </testcase>\n')
+        out.write('  </testsuite>\n')
+
+    out.write('</testsuites>\n')
+
+
+def _junit_counts(results: List[CheckResult]) -> Tuple[int, int, int, int]:
+    failures = errors = skipped = 0
+    for result in results:
+        if result.status == 'failed':
+            failures += 1
+        elif result.status == 'skipped':
+            skipped += 1
+        elif result.status != 'passed':
+            errors += 1
+    return len(results), failures, errors, skipped
+
+
+def write_sarif(store: ResultStore, out: TextIO) -> None:
+    """
+    SARIF 2.1.0. Only failing and excepted checks are reported, excepted checks
+    carry an external suppression so they are not treated as open findings.
+    """
+    groups = _ordered_groups(store)
+
+    # rules have to be declared on the driver before the results that reference them
+    rules: Dict[str, Dict[str, Any]] = {}
+    for riskLevel in groups:
+        for result in store.groups[riskLevel]:
+            if result.status in ('failed', 'skipped'):
+                ruleId = _sarif_rule_id(result)
+                if ruleId not in rules:
+                    rules[ruleId] = {
+                        "id": ruleId,
+                        "name": result.name,
+                        "shortDescription": {"text": result.name},
+                        "properties": {"riskLevel": riskLevel}
+                    }
+
+    out.write(f'{{"$schema": {json.dumps(SARIF_SCHEMA)}, "version": "2.1.0", "runs": [{{"tool": ')
+    out.write(json.dumps({"driver": {"name": TOOL_NAME, "informationUri": TOOL_URI, "rules": list(rules.values())}}))
+    out.write(', "results": [')
+
+    first = True
+    for riskLevel in groups:
+        for result in store.groups[riskLevel]:
+            if result.status not in ('failed', 'skipped'):
+                continue
+            sarifResult: Dict[str, Any] = {
+                "ruleId": _sarif_rule_id(result),
+                "level": SARIF_LEVELS.get(riskLevel, 'warning'),
+                "message": {"text": result.message},
+                "partialFingerprints": {"checkId": result.id}
+            }
+            # checks added by the validate API itself (eg. account validation) aren't tied to a template
+            if result.filename:
+                sarifResult["locations"] = [{"physicalLocation": {"artifactLocation": {"uri": result.filename}}}]
+            if result.status == 'skipped':
+                sarifResult["suppressions"] = [{"kind": "external", "justification": "Approved exception"}]
+            if not first:
+                out.write(', ')
+            out.write(json.dumps(sarifResult))
+            first = False
+
+    out.write(']}]}')
+
+
+def _sarif_rule_id(result: CheckResult) -> str:
+    return result.rule or result.id
+
+
+# Output format name -> (writer, is the output JSON)
+OUTPUT_FORMATS: Dict[str, Tuple[Callable[[ResultStore, TextIO], None], bool]] = {
+    'cucumber': (write_cucumber, True),
+    'junit': (write_junit, False),
+    'sarif': (write_sarif, True)
+}
+
+
+def output_format(body: Dict[str, Any]) -> str:
+    """
+    Returns the output format requested via 'outputFormat' in the request body (cucumber by default)
+    :raises InvalidRequestError: if the format is not supported
+    """
+    requested = body.get('outputFormat', DEFAULT_OUTPUT_FORMAT)
+    fmt = str(requested).lower()
+    if fmt not in OUTPUT_FORMATS:
+        raise InvalidRequestError(f'Unsupported output format {requested}, expected one of {list(OUTPUT_FORMATS)}')
+    return fmt
+
+
+def is_json(fmt: str) -> bool:
+    return OUTPUT_FORMATS[fmt][1]
+
+
+def render(store: ResultStore, fmt: str) -> str:
+    """
+    Renders the results in the given output format
+    :return: rendered document as a string
+    """
+    writer = OUTPUT_FORMATS[fmt][0]
+    out = io.StringIO()
+    writer(store, out)
+    return out.getvalue()
@@ -0,0 +1,174 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Scan history, so pipelines can tell new failures from existing ones.
+
+When a validate request sets "ref" (eg. a commit id or branch name), the failed checks of each template are
+stored under (account, ref, filename) in the scan state table: one item per template, with the checks as
+gzip compressed JSON. A request setting "baseline" to an earlier ref gets back only the failures that are
+new since that ref, along with the checks that have been fixed. The baseline is read with a single query on
+the (account, ref) partition, rather than by scanning the baseline templates again.
+"""
+import gzip
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from validate import logs, metrics, serialization
+from validate.results import CheckResult, ResultStore
+
+logger = logs.get_logger("templateScannerHistory")
+
+# History is kept in the scan state table, see scheduler.py
+SCAN_STATE_TABLENAME_ENV = 'SCAN_STATE_TABLENAME'
+# Days a ref's scan results are kept after it was last scanned
+HISTORY_TTL_DAYS_ENV = 'HISTORY_TTL_DAYS'
+DEFAULT_HISTORY_TTL_DAYS = 90
+
+MAX_REF_LENGTH = 256
+
+# one stored failed check: [check id, risk level, rule id, rule title, message]
+Record = List[str]
+
+
+def request_refs(body: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    :return: ("ref" to store results under, "baseline" ref to compare to), empty if not set
+    :raises serialization.InvalidRequestError: if either is not a short string, or history isn't configured
+    """
+    refs = []
+    for name in ('ref', 'baseline'):
+        value = body.get(name, '')
+        if not isinstance(value, str) or len(value) > MAX_REF_LENGTH:
+            raise serialization.InvalidRequestError(f'"{name}" must be a string of at most {MAX_REF_LENGTH} characters')
+        refs.append(value)
+
+    if any(refs) and not os.environ.get(SCAN_STATE_TABLENAME_ENV):
+        raise serialization.InvalidRequestError('Scan history is not enabled, SCAN_STATE_TABLENAME is not set')
+    return refs[0], refs[1]
+
+
+def _table(dynamodb: Any) -> Any:
+    if dynamodb is None:
+        dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
+    return dynamodb.Table(os.environ[SCAN_STATE_TABLENAME_ENV])
+
+
+def _partition(accountId: str, ref: str) -> str:
+    return f'history#{accountId}#{ref}'
+
+
+def encode(records: List[Record]) -> bytes:
+    return gzip.compress(serialization.dumps(records).encode('utf-8'))
+
+
+def decode(data: Any) -> List[Record]:
+    # boto3 returns Binary attributes wrapped in a Binary object
+    return json.loads(gzip.decompress(getattr(data, 'value', data)))
+
+
+def errored_files(store: ResultStore) -> Set[str]:
+    """
+    Templates whose scan failed, or that weren't scanned by Conformity (their results are incomplete, so aren't
+    stored or compared)
+    """
+    return {result.filename for results in store.groups.values() for result in results if result.error} \
+        | store.incomplete
+
+
+def failed_records(store: ResultStore) -> Dict[str, List[Record]]:
+    """
+    :return: filename -> failed Conformity checks (checks added by the validate API itself aren't included)
+    """
+    records: Dict[str, List[Record]] = {}
+    for riskLevel, results in store.groups.items():
+        for result in results:
+            if result.rule and result.status == 'failed':
+                records.setdefault(result.filename, []).append(
+                    [result.id, riskLevel, result.rule, result.name, result.message])
+    return records
+
+
+def save(accountId: str, ref: str, store: ResultStore, filenames: Iterable[str], dynamodb: Any = None) -> None:
+    """
+    Stores the failed checks of each template under ref, replacing anything stored for the template before
+    """
+    table = _table(dynamodb)
+    records = failed_records(store)
+    skipped = errored_files(store)
+    now = int(time.time())
+    expiresAt = now + int(os.environ.get(HISTORY_TTL_DAYS_ENV, DEFAULT_HISTORY_TTL_DAYS)) * 86400
+    with metrics.timer('HistorySaveTime'), table.batch_writer(overwrite_by_pkeys=['partKey', 'sortKey']) as batch:
+        for filename in set(filenames) - skipped:
+            failed = records.get(filename, [])
+            batch.put_item(Item={
+                'partKey': _partition(accountId, ref),
+                'sortKey': filename,
+                'failed': encode(failed),
+                'failures': len(failed),
+                'scannedAt': now,
+                'expiresAt': expiresAt
+            })
+    logger.info('Saved scan history: %s', logs.Fields(accountId=accountId, ref=ref, files=len(set(filenames) - skipped)))
+
+
+def load(accountId: str, ref: str, filenames: Iterable[str], dynamodb: Any = None) -> Optional[Dict[str, List[Record]]]:
+    """
+    :return: filename -> failed checks stored under ref, for the given files that were scanned under ref.
+             None if nothing at all has been stored under ref
+    """
+    table = _table(dynamodb)
+    wanted = set(filenames)
+    found = False
+    baseline: Dict[str, List[Record]] = {}
+    query = {'KeyConditionExpression': Key('partKey').eq(_partition(accountId, ref))}
+    with metrics.timer('HistoryLoadTime'):
+        while True:
+            response = table.query(**query)
+            for item in response['Items']:
+                found = True
+                if item['sortKey'] in wanted:
+                    baseline[item['sortKey']] = decode(item['failed'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return baseline if found else None
+
+
+def compare(store: ResultStore, baseline: Optional[Dict[str, List[Record]]], countedLevels: Iterable[str]
+            ) -> Tuple[ResultStore, Dict[str, Dict[str, int]]]:
+    """
+    :param baseline: as returned by load()
+    :return: (results with only the failures that aren't in the baseline, the checks that failed in the baseline
+              but passed now (as 'passed') and the checks added by the validate API itself,
+              {"new": {<risk level>: count}, "fixed": {<risk level>: count}})
+    """
+    baseline = baseline or {}
+    skipped = errored_files(store)
+    known = {(filename, record[0]) for filename, records in baseline.items() for record in records}
+    current = {(filename, record[0]) for filename, records in failed_records(store).items() for record in records}
+
+    compared = ResultStore(countedLevels)
+    fixed: Dict[str, int] = dict.fromkeys(compared.failures, 0)
+    for riskLevel, results in store.groups.items():
+        for result in results:
+            if not result.rule:
+                compared.add(riskLevel, result)
+            elif result.status == 'failed' and (result.filename, result.id) not in known:
+                compared.add(riskLevel, result)
+
+    for filename, records in baseline.items():
+        if filename in skipped:
+            continue
+        for checkId, riskLevel, rule, name, message in records:
+            if (filename, checkId) not in current:
+                compared.add(riskLevel, CheckResult(checkId, name, message, filename, 'passed', rule))
+                fixed[riskLevel] = fixed.get(riskLevel, 0) + 1
+
+    metrics.count('NewFailures', sum(compared.failures.values()))
+    metrics.count('FixedChecks', sum(fixed.values()))
+    return compared, {'new': dict(compared.failures), 'fixed': fixed}
@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import hashlib
+import json
+import logging
+import os
+import random
+from typing import Any
+
+# Log level for all validate loggers, eg. DEBUG / INFO / WARNING
+LOG_LEVEL_ENV = 'LOG_LEVEL'
+DEFAULT_LOG_LEVEL = 'INFO'
+
+# Fraction (0.0 - 1.0) of payloads that are logged in full, the rest are logged as a size/hash summary
+LOG_SAMPLE_RATE_ENV = 'LOG_SAMPLE_RATE'
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns the named logger with its level set from the LOG_LEVEL env var (INFO if unset or invalid)
+    """
+    logger = logging.getLogger(name)
+    level = os.environ.get(LOG_LEVEL_ENV, DEFAULT_LOG_LEVEL).upper()
+    try:
+        logger.setLevel(level)
+    except ValueError:
+        logger.setLevel(DEFAULT_LOG_LEVEL)
+        logger.warning(f'Invalid {LOG_LEVEL_ENV} "{level}", defaulting to {DEFAULT_LOG_LEVEL}')
+    return logger
+
+
+def _as_bytes(obj: Any) -> bytes:
+    if isinstance(obj, bytes):
+        return obj
+    if isinstance(obj, str):
+        return obj.encode('utf-8')
+    return json.dumps(obj, default=str).encode('utf-8')
+
+
+class Summary:
+    """
+    Renders a payload as its size and a short sha256, eg. '<5120 bytes sha256:1f2e3d4c5b6a>'.
+    Nothing is computed unless the log record is actually emitted.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj: Any) -> None:
+        self.obj = obj
+
+    def __str__(self) -> str:
+        data = _as_bytes(self.obj)
+        return f'<{len(data)} bytes sha256:{hashlib.sha256(data).hexdigest()[:12]}>'
+
+
+class Dump:
+    """
+    Renders a payload in full (pretty printed JSON for objects). Only serialised when emitted.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj: Any) -> None:
+        self.obj = obj
+
+    def __str__(self) -> str:
+        if isinstance(self.obj, (str, bytes)):
+            return self.obj if isinstance(self.obj, str) else self.obj.decode('utf-8', 'replace')
+        return json.dumps(self.obj, indent=2, default=str)
+
+
+class Fields:
+    """
+    Structured key/value log fields, rendered as a single line of JSON when emitted.
+    Values may themselves be lazy (Summary / Dump).
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, **fields: Any) -> None:
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return json.dumps({key: value if isinstance(value, (int, float, bool)) or value is None else str(value)
+                           for key, value in self.fields.items()})
+
+
+def payload(obj: Any) -> Any:
+    """
+    Wraps a (potentially large) payload for logging. A sample of payloads, controlled by
+    LOG_SAMPLE_RATE, are logged in full, otherwise only a size and hash summary is logged.
+    Use with %-style logging so that nothing is serialised when the level is disabled, eg.
+        logger.debug('response: %s', logs.payload(resp.text))
+    """
+    if random.random() < sample_rate():
+        return Dump(obj)
+    return Summary(obj)
+
+
+def sample_rate() -> float:
+    try:
+        return float(os.environ.get(LOG_SAMPLE_RATE_ENV, 0))
+    except ValueError:
+        return 0.0
@@ -0,0 +1,154 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+# CloudWatch namespace the Embedded Metric Format (EMF) log lines are published to
+METRICS_NAMESPACE_ENV = 'METRICS_NAMESPACE'
+DEFAULT_METRICS_NAMESPACE = 'TemplateValidator'
+
+# Set to false to stop emitting EMF log lines (timings can still be returned in the response)
+METRICS_ENABLED_ENV = 'METRICS_ENABLED'
+
+# EMF accepts at most 100 values per metric in a single log line
+MAX_VALUES_PER_METRIC = 100
+
+# Metrics for the invocation currently being handled, see invocation()
+_current: 'contextvars.ContextVar[Optional[Metrics]]' = contextvars.ContextVar('metrics', default=None)
+
+
+class Metrics:
+    """
+    Timers and counters collected over one invocation. Each timer sample is kept (so the
+    distribution of eg. per template scan times is published, not just the total).
+    Safe to record into from several threads.
+    """
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self.timers: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.properties: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            self.timers.setdefault(name, []).append(milliseconds)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timings(self) -> Dict[str, Dict[str, float]]:
+        """
+        Summary of the timers, eg. for returning in a response
+        :return: { "<timer>": { "count": 2, "totalMs": 12.3, "maxMs": 10.1 }, ..., "counters": {...} }
+        """
+        with self._lock:
+            summary: Dict[str, Any] = {
+                name: {'count': len(samples), 'totalMs': round(sum(samples), 3), 'maxMs': round(max(samples), 3)}
+                for name, samples in self.timers.items()
+            }
+            summary['counters'] = dict(self.counters)
+        return summary
+
+    def emf(self, namespace: str, dimensions: Dict[str, str]) -> Dict[str, Any]:
+        """
+        :return: the metrics as a CloudWatch Embedded Metric Format document
+        """
+        with self._lock:
+            definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in self.timers]
+            definitions += [{'Name': name, 'Unit': _counter_unit(name)} for name in self.counters]
+            document: Dict[str, Any] = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [list(dimensions)],
+                        'Metrics': definitions
+                    }]
+                }
+            }
+            document.update(dimensions)
+            document.update(self.properties)
+            for name, samples in self.timers.items():
+                values = [round(sample, 3) for sample in samples[:MAX_VALUES_PER_METRIC]]
+                document[name] = values[0] if len(values) == 1 else values
+            document.update(self.counters)
+        return document
+
+
+def _counter_unit(name: str) -> str:
+    return 'Bytes' if name.endswith('Bytes') else 'Count'
+
+
+def current() -> Optional[Metrics]:
+    return _current.get()
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    """
+    Times the block into the current invocation's metrics (a no-op outside of invocation())
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, (time.perf_counter() - start) * 1000)
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Adds to a counter in the current invocation's metrics (a no-op outside of invocation())
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def enabled() -> bool:
+    return os.environ.get(METRICS_ENABLED_ENV, 'true').lower() not in ('false', '0', 'no')
+
+
+@contextmanager
+def invocation(operation: str, context: Any = None, out: Optional[TextIO] = None) -> Iterator[Metrics]:
+    """
+    Collects metrics for one invocation, and on exit writes them to stdout as a single EMF
+    log line (picked up by CloudWatch Logs, so no API calls are made from the function)
+    :param operation: published as the 'Operation' dimension, eg. Validate
+    :param context: Lambda context, its aws_request_id is added as a (non dimension) property
+    """
+    metrics = Metrics(operation)
+    requestId = getattr(context, 'aws_request_id', None)
+    if requestId:
+        metrics.properties['requestId'] = requestId
+
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add_time('InvocationTime', (time.perf_counter() - start) * 1000)
+        _current.reset(token)
+        if enabled():
+            emit(metrics, out)
+
+
+def emit(metrics: Metrics, out: Optional[TextIO] = None) -> None:
+    dimensions = {'Stage': os.environ.get('STAGE', 'unknown'), 'Operation': metrics.operation}
+    namespace = os.environ.get(METRICS_NAMESPACE_ENV, DEFAULT_METRICS_NAMESPACE)
+    # written straight to stdout rather than through logging, EMF lines must be pure JSON
+    stream = out or sys.stdout
+    stream.write(json.dumps(metrics.emf(namespace, dimensions)) + '\n')
+    stream.flush()
@@ -0,0 +1,159 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Resolves nested stacks between the templates of a validate request. AWS::CloudFormation::Stack resources are
+matched to submitted templates by their TemplateURL (a path relative to the parent, as used with
+`aws cloudformation package`, or an S3 / HTTPS URL ending in the template's path). Each unique template is
+then scanned once, and a child's results are reported under every parent that uses it, as
+"<parent> > <child>".
+"""
+import hashlib
+import posixpath
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from validate import cfn, logs
+
+logger = logs.get_logger("templateScannerNested")
+
+STACK_TYPE = 'AWS::CloudFormation::Stack'
+PATH_SEPARATOR = ' > '
+
+
+def digest(body: str) -> str:
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def template_urls(template: Dict[str, Any]) -> List[str]:
+    """
+    :return: TemplateURLs of the nested stacks in a parsed template, where they are plain strings
+             (or a !Sub without variables)
+    """
+    urls = []
+    resources = template.get('Resources')
+    if not isinstance(resources, dict):
+        return urls
+    for resource in resources.values():
+        if not isinstance(resource, dict) or resource.get('Type') != STACK_TYPE:
+            continue
+        url = (resource.get('Properties') or {}).get('TemplateURL')
+        if isinstance(url, dict) and isinstance(url.get('Fn::Sub'), str) and '${' not in url['Fn::Sub']:
+            url = url['Fn::Sub']
+        if isinstance(url, str) and url:
+            urls.append(url)
+    return urls
+
+
+def _parts(path: str) -> List[str]:
+    return [part for part in posixpath.normpath(path.replace('\\', '/')).split('/') if part not in ('', '.')]
+
+
+def match(url: str, parent: str, filenames: Sequence[str]) -> Optional[str]:
+    """
+    Finds the submitted template a TemplateURL refers to
+    :param parent: filename of the template the URL is in, relative URLs are resolved against its directory
+    :return: the matching filename, or None if there is no (unambiguous) match
+    """
+    parsed = urlsplit(url)
+    if not parsed.scheme:
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(parent), parsed.path))
+        for filename in filenames:
+            if _parts(filename) == _parts(resolved):
+                return filename
+        wanted = _parts(resolved)
+    else:
+        # s3://bucket/prefix/child.yaml or https://bucket.s3.amazonaws.com/prefix/child.yaml - only the key is
+        # useful, and only its trailing part is likely to match the repository path
+        wanted = _parts(parsed.path)
+
+    best: List[str] = []
+    bestLength = 0
+    for filename in filenames:
+        parts = _parts(filename)
+        length = 0
+        while length < min(len(parts), len(wanted)) and parts[-1 - length] == wanted[-1 - length]:
+            length += 1
+        if length > bestLength:
+            best, bestLength = [filename], length
+        elif length and length == bestLength:
+            best.append(filename)
+    if len(best) == 1:
+        return best[0]
+    if best:
+        logger.warning('TemplateURL %s in %s matches several templates: %s', url, parent, best)
+    return None
+
+
+class StackGraph:
+    """
+    Parent / child relationships between the templates of a request
+    :param filenames: template filenames, in request order
+    :param bodies: template bodies, in the same order
+    """
+
+    def __init__(self, filenames: Sequence[str], bodies: Sequence[str]) -> None:
+        self.filenames = list(filenames)
+        self.bodies = dict(zip(filenames, bodies))
+        self.children: Dict[str, List[str]] = {filename: [] for filename in filenames}
+        self.parents: Dict[str, List[str]] = {filename: [] for filename in filenames}
+
+    def add(self, parent: str, child: str) -> None:
+        if child not in self.children[parent]:
+            self.children[parent].append(child)
+            self.parents[child].append(parent)
+
+    def reported(self) -> List[Tuple[str, str]]:
+        """
+        :return: (reported name, filename) for each place a template's results are reported: templates that
+                 aren't nested under another template by their own filename, children under each of their
+                 parents' reported names
+        """
+        reported: List[Tuple[str, str]] = []
+        seen = set()
+        roots = [filename for filename in self.filenames if not self.parents[filename]]
+        for root in roots:
+            for name, filename in self._walk(root, root, (root,)):
+                reported.append((name, filename))
+                seen.add(filename)
+        # templates only reachable through a cycle of nested stacks
+        for filename in self.filenames:
+            if filename not in seen:
+                for name, descendant in self._walk(filename, filename, (filename,)):
+                    if descendant not in seen:
+                        reported.append((name, descendant))
+                        seen.add(descendant)
+        return reported
+
+    def _walk(self, name: str, filename: str, path: Tuple[str, ...]) -> Iterator[Tuple[str, str]]:
+        yield name, filename
+        for child in self.children[filename]:
+            if child in path:
+                logger.warning('Nested stack cycle: %s', PATH_SEPARATOR.join(path + (child,)))
+                continue
+            yield from self._walk(name + PATH_SEPARATOR + child, child, path + (child,))
+
+
+def resolve(filenames: Sequence[str], bodies: Sequence[str]) -> StackGraph:
+    """
+    Builds the nested stack graph of a request's templates. Templates that can't be parsed are left as
+    they are (Conformity reports what is wrong with them)
+    """
+    graph = StackGraph(filenames, bodies)
+    unique = list(dict.fromkeys(filenames))
+    for filename in unique:
+        body = graph.bodies[filename]
+        # parsing large templates isn't free, skip the ones that can't have nested stacks
+        if STACK_TYPE not in body:
+            continue
+        try:
+            template = cfn.parse(body)
+        except cfn.TemplateParseError as e:
+            logger.debug('Not resolving nested stacks in %s: %s', filename, e)
+            continue
+        for url in template_urls(template):
+            child = match(url, filename, [name for name in unique if name != filename])
+            if child is None:
+                logger.info('Nested stack %s in %s is not in the request', url, filename)
+            else:
+                graph.add(filename, child)
+    return graph
@@ -0,0 +1,166 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Local checks run on a template before it is sent to Conformity, for problems that don't need Conformity to
+find: templates that aren't valid JSON / YAML, and obviously insecure resources such as public S3 buckets.
+
+Each template is parsed once (see cfn.py), then every rule in RULES is run on the parsed template. A rule is
+a function taking the template and returning Findings, registered with @rule. PRESCAN_RULES limits which
+rules run.
+"""
+import os
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from validate import cfn, logs, metrics
+
+logger = logs.get_logger("templateScannerPrescan")
+
+# Comma separated ids of the rules to run, default all of RULES
+PRESCAN_RULES_ENV = 'PRESCAN_RULES'
+
+PARSE_RULE_ID = 'PRE-001'
+
+OPEN_CIDRS = ('0.0.0.0/0', '::/0')
+# remote access ports that should never be open to the internet
+REMOTE_ACCESS_PORTS = (22, 3389)
+
+
+class Finding(NamedTuple):
+    ruleId: str
+    title: str
+    riskLevel: str
+    message: str
+    # logical id of the resource, empty for template level findings
+    resource: str = ''
+
+    @property
+    def id(self) -> str:
+        """check id for the Cucumber output, unique within a template"""
+        return f'prescan-{self.ruleId}' + (f'-{self.resource}' if self.resource else '')
+
+
+class Rule(NamedTuple):
+    ruleId: str
+    title: str
+    riskLevel: str
+    check: Callable[[Dict[str, Any]], Iterator[Any]]
+
+
+RULES: List[Rule] = []
+
+
+def rule(ruleId: str, title: str, riskLevel: str) -> Callable[[Callable[[Dict[str, Any]], Iterator[Any]]], Any]:
+    """
+    Registers a check. The check is called with the parsed template and yields (resource, message) for each
+    problem found
+    """
+    def register(check: Callable[[Dict[str, Any]], Iterator[Any]]) -> Callable[[Dict[str, Any]], Iterator[Any]]:
+        RULES.append(Rule(ruleId, title, riskLevel, check))
+        return check
+    return register
+
+
+def _resources(template: Dict[str, Any], *types: str) -> Iterator[Any]:
+    resources = template.get('Resources')
+    if not isinstance(resources, dict):
+        return
+    for logicalId, resource in resources.items():
+        if isinstance(resource, dict) and resource.get('Type') in types:
+            properties = resource.get('Properties')
+            yield logicalId, properties if isinstance(properties, dict) else {}
+
+
+@rule('PRE-002', 'Template declares resources', 'HIGH')
+def check_resources(template: Dict[str, Any]) -> Iterator[Any]:
+    resources = template.get('Resources')
+    if not isinstance(resources, dict) or not resources:
+        yield '', 'Template has no Resources section, CloudFormation will reject it'
+
+
+@rule('PRE-003', 'S3 bucket is not publicly accessible', 'VERY_HIGH')
+def check_public_bucket(template: Dict[str, Any]) -> Iterator[Any]:
+    for logicalId, properties in _resources(template, 'AWS::S3::Bucket'):
+        acl = properties.get('AccessControl')
+        if acl in ('PublicRead', 'PublicReadWrite'):
+            yield logicalId, f'Bucket {logicalId} grants {acl} access to everyone'
+
+
+@rule('PRE-004', 'S3 bucket policy does not allow anonymous access', 'VERY_HIGH')
+def check_public_bucket_policy(template: Dict[str, Any]) -> Iterator[Any]:
+    for logicalId, properties in _resources(template, 'AWS::S3::BucketPolicy'):
+        document = properties.get('PolicyDocument')
+        statements = document.get('Statement', []) if isinstance(document, dict) else []
+        for statement in statements if isinstance(statements, list) else [statements]:
+            if not isinstance(statement, dict) or statement.get('Effect') != 'Allow' or 'Condition' in statement:
+                continue
+            principal = statement.get('Principal')
+            if principal == '*' or (isinstance(principal, dict) and principal.get('AWS') in ('*', ['*'])):
+                yield logicalId, f'Bucket policy {logicalId} allows anyone to {statement.get("Action")}'
+                break
+
+
+def _open_to_world(ingress: Dict[str, Any]) -> Optional[str]:
+    """:return: the open CIDR if an ingress rule allows remote access from anywhere"""
+    cidr = ingress.get('CidrIp', ingress.get('CidrIpv6'))
+    if cidr not in OPEN_CIDRS:
+        return None
+    if str(ingress.get('IpProtocol')) == '-1':
+        return cidr
+    try:
+        fromPort, toPort = int(ingress.get('FromPort')), int(ingress.get('ToPort'))
+    except (TypeError, ValueError):
+        # ports given by parameter etc.
+        return None
+    if any(fromPort <= port <= toPort for port in REMOTE_ACCESS_PORTS):
+        return cidr
+    return None
+
+
+@rule('PRE-005', 'Security group does not allow remote access from anywhere', 'HIGH')
+def check_open_ingress(template: Dict[str, Any]) -> Iterator[Any]:
+    for logicalId, properties in _resources(template, 'AWS::EC2::SecurityGroup'):
+        ingress = properties.get('SecurityGroupIngress')
+        for entry in ingress if isinstance(ingress, list) else []:
+            cidr = isinstance(entry, dict) and _open_to_world(entry)
+            if cidr:
+                yield logicalId, f'Security group {logicalId} allows SSH / RDP from {cidr}'
+                break
+    for logicalId, properties in _resources(template, 'AWS::EC2::SecurityGroupIngress'):
+        cidr = _open_to_world(properties)
+        if cidr:
+            yield logicalId, f'Security group ingress {logicalId} allows SSH / RDP from {cidr}'
+
+
+def rules() -> List[Rule]:
+    """:return: the rules PRESCAN_RULES selects"""
+    selected = [ruleId.strip() for ruleId in os.environ.get(PRESCAN_RULES_ENV, '').split(',') if ruleId.strip()]
+    return [r for r in RULES if not selected or r.ruleId in selected]
+
+
+def scan(body: str) -> List[Finding]:
+    """
+    Runs the local checks on a template
+    :return: the problems found. A template that can't be parsed has a single VERY_HIGH finding, one that can't
+             be parsed here (YAML without PyYAML installed) has none
+    """
+    with metrics.timer('PrescanTime'):
+        try:
+            template = cfn.parse(body)
+        except cfn.ParserUnavailableError as e:
+            # the deployment's problem, not the template's: leave the template to Conformity
+            logger.warning('Not running the local checks: %s', e)
+            metrics.count('PrescanSkipped')
+            findings = []
+        except cfn.TemplateParseError as e:
+            findings = [Finding(PARSE_RULE_ID, 'Template is valid JSON or YAML', 'VERY_HIGH', str(e))]
+        else:
+            findings = []
+            for r in rules():
+                try:
+                    findings.extend(Finding(r.ruleId, r.title, r.riskLevel, message, resource)
+                                    for resource, message in r.check(template))
+                except Exception:
+                    # a broken rule shouldn't fail the request, Conformity still scans the template
+                    logger.exception('Prescan rule %s failed', r.ruleId)
+    metrics.count('PrescanFindings', len(findings))
+    return findings
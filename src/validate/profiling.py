@@ -0,0 +1,223 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from validate import logs, serialization
+
+logger = logs.get_logger("templateScannerProfiling")
+
+# Comma separated stages (eg. "dev,uat") in which requests may be profiled. Empty (the default) disables profiling
+PROFILE_STAGES_ENV = 'PROFILE_STAGES'
+
+# Set to true to profile every request, rather than only those sending the X-Profile header
+PROFILE_REQUESTS_ENV = 'PROFILE_REQUESTS'
+
+# Number of functions / allocation sites in the summary
+PROFILE_TOP_N_ENV = 'PROFILE_TOP_N'
+DEFAULT_TOP_N = 15
+
+# X-Profile: log      - profile the request, summary is logged
+# X-Profile: response - as well as logging, return the summary in the response body as "profile"
+PROFILE_HEADER = 'X-Profile'
+PROFILE_MODES = ('log', 'response')
+
+# the profiled request's Profile, seen by its scans on the worker threads (they run in a copy of its context)
+_current: 'contextvars.ContextVar[Optional[Profile]]' = contextvars.ContextVar('profile', default=None)
+# set on a thread while a worker() profiler is running on it
+_local = threading.local()
+# the request being profiled. tracemalloc is process wide (and from python 3.12 so is cProfile), so concurrent
+# requests (eg. in validate-server) are profiled one at a time
+_active: Optional['Profile'] = None
+_activeLock = threading.Lock()
+
+
+def requested_mode(event: Dict[str, Any]) -> Optional[str]:
+    """
+    :return: 'log' / 'response' if this request should be profiled, otherwise None
+    """
+    stages = os.environ.get(PROFILE_STAGES_ENV, '')
+    if not stages or os.environ.get('STAGE', '') not in [stage.strip() for stage in stages.split(',')]:
+        return None
+
+    mode = (serialization.get_header(event, PROFILE_HEADER) or '').strip().lower()
+    if mode in PROFILE_MODES:
+        return mode
+    if mode in ('1', 'true'):
+        return 'log'
+    if os.environ.get(PROFILE_REQUESTS_ENV, '').lower() == 'true':
+        return 'log'
+    return None
+
+
+class Profile:
+    """
+    cProfile and tracemalloc over one request. Only created for profiled requests,
+    so nothing is imported or traced otherwise. cProfile only sees the thread it is enabled on, the request's
+    scans on the worker threads are profiled by worker() and added to the summary
+    """
+
+    def __init__(self, mode: str, topN: int) -> None:
+        import cProfile
+        import tracemalloc
+        self.mode = mode
+        self.topN = topN
+        self._tracemalloc = tracemalloc
+        # leave tracing alone if something else (eg. a benchmark) already started it
+        self._ownsTracing = not tracemalloc.is_tracing()
+        self._profiler = cProfile.Profile()
+        self._workers: List[Any] = []
+        self._workersLock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._start = 0.0
+        self.summary: Dict[str, Any] = {}
+
+    def start(self) -> None:
+        """:raises ValueError: if another profiler is already running (python 3.12+)"""
+        self._thread = threading.current_thread()
+        self._profiler.enable()
+        if self._ownsTracing:
+            self._tracemalloc.start()
+        elif hasattr(self._tracemalloc, 'reset_peak'):
+            # python 3.9+
+            self._tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+
+    def stop(self) -> Dict[str, Any]:
+        self._profiler.disable()
+        wallMs = (time.perf_counter() - self._start) * 1000
+        _, peak = self._tracemalloc.get_traced_memory()
+        snapshot = self._tracemalloc.take_snapshot()
+        if self._ownsTracing:
+            self._tracemalloc.stop()
+
+        self.summary = {
+            'wallMs': round(wallMs, 3),
+            'cpu': self._cpu_top(),
+            'memory': {'peakBytes': peak, 'top': self._memory_top(snapshot)}
+        }
+        return self.summary
+
+    def add(self, profiler: Any) -> None:
+        """Adds a (disabled) worker thread profiler to the summary"""
+        with self._workersLock:
+            self._workers.append(profiler)
+
+    def _cpu_top(self) -> List[Dict[str, Any]]:
+        import pstats
+        merged = pstats.Stats(self._profiler)
+        with self._workersLock:
+            for profiler in self._workers:
+                merged.add(profiler)
+        stats = merged.stats  # type: ignore[attr-defined]
+        # (file, line, function) -> (primitive calls, total calls, own time, cumulative time, callers)
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+        return [{
+            'function': f'{os.path.basename(filename)}:{line}({function})',
+            'calls': calls,
+            'ownMs': round(ownTime * 1000, 3),
+            'cumMs': round(cumTime * 1000, 3)
+        } for (filename, line, function), (_, calls, ownTime, cumTime, _) in rows[:self.topN]]
+
+    def _memory_top(self, snapshot: Any) -> List[Dict[str, Any]]:
+        snapshot = snapshot.filter_traces([
+            self._tracemalloc.Filter(False, self._tracemalloc.__file__),
+            self._tracemalloc.Filter(False, __file__)
+        ])
+        return [{
+            'line': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+            'bytes': stat.size,
+            'count': stat.count
+        } for stat in snapshot.statistics('lineno')[:self.topN]]
+
+    def attach(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Adds the summary to a (not yet encoded) JSON response body as "profile", if it was requested
+        """
+        if self.mode != 'response' or response.get('statusCode') != 200:
+            return response
+        try:
+            body = json.loads(response['body'])
+        except (TypeError, ValueError):
+            return response
+        if isinstance(body, dict):
+            body['profile'] = self.summary
+            response = dict(response, body=json.dumps(body))
+        return response
+
+
+def start(event: Dict[str, Any]) -> Optional[Profile]:
+    """
+    Starts profiling the request if it is enabled for this stage and requested
+    :return: the running Profile, or None (the usual case) if the request isn't profiled. A request is not
+             profiled while another one is, or while something else is running a profiler
+    """
+    global _active
+    mode = requested_mode(event)
+    if mode is None:
+        return None
+    try:
+        topN = int(os.environ.get(PROFILE_TOP_N_ENV, DEFAULT_TOP_N))
+    except ValueError:
+        topN = DEFAULT_TOP_N
+    with _activeLock:
+        if _active is not None:
+            logger.warning('Not profiling the request, another request is being profiled')
+            return None
+        profile = Profile(mode, topN)
+        try:
+            profile.start()
+        except ValueError as e:
+            logger.warning('Not profiling the request: %s', e)
+            return None
+        _active = profile
+    _current.set(profile)
+    return profile
+
+
+@contextlib.contextmanager
+def worker() -> Iterator[None]:
+    """
+    Profiles work on a worker thread (eg. a scan) for the request it was submitted by, if that request is
+    profiled. Does nothing otherwise, on the request's own thread, or inside another worker() on this thread
+    """
+    profile = _current.get()
+    if profile is None or threading.current_thread() is profile._thread or getattr(_local, 'active', False):
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # python 3.12+ profiles every thread from the request's profiler, and allows one profiler at a time
+        yield
+        return
+    _local.active = True
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.active = False
+        profile.add(profiler)
+
+
+def finish(profile: Profile, operation: str) -> Dict[str, Any]:
+    """
+    Stops profiling and logs the summary (one compact JSON line)
+    """
+    global _active
+    try:
+        summary = profile.stop()
+    finally:
+        _current.set(None)
+        with _activeLock:
+            if _active is profile:
+                _active = None
+    logger.info('profile %s: %s', operation, json.dumps(summary))
+    return summary
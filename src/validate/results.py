@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from typing import Any, Dict, Iterable, List, Set
+
+CUCUMBER_FEATURE_ID = "cloud-conformity-rules"
+CUCUMBER_FEATURE_DESCRIPTION = "Results from scanning templates through Cloud Conformity"
+
+
+class CheckResult:
+    """
+    A single check outcome. Kept deliberately flat (no nested dicts) so that
+    large scans only allocate one small object per check. The Cucumber
+    structure is only built when the results are rendered.
+    """
+    __slots__ = ('id', 'name', 'message', 'filename', 'status', 'rule', 'error')
+
+    def __init__(self, id: str, name: str, message: str, filename: str, status: str, rule: str = '',
+                 error: bool = False) -> None:
+        self.id = id
+        self.name = name
+        self.message = message
+        self.filename = filename
+        self.status = status
+        # CloudConformity rule id (eg. S3-001), empty for checks added by the validate API itself
+        self.rule = rule
+        # the template couldn't be scanned (or downloaded), so its other results are incomplete
+        self.error = error
+
+    def cucumber(self) -> Dict[str, Any]:
+        element: Dict[str, Any] = {
+            "id": self.id,
+            "name": self.name,
+            "steps": [
+                {
+                    "result": {
+                        "status": self.status
+                    },
+                    "name": self.message,
+                    "keyword": f'{self.filename}: '
+                }
+            ]
+        }
+        if self.error:
+            # so clients don't cache the template's results, see client_cache.split_results()
+            element["error"] = True
+        return element
+
+
+class ResultStore:
+    """
+    Check results grouped by risk level, in the order each risk level was first seen.
+    Failures are counted as results are added, so no second pass is needed to build
+    the 'failures' summary.
+    """
+    __slots__ = ('groups', 'failures', 'incomplete')
+
+    def __init__(self, countedLevels: Iterable[str]) -> None:
+        self.groups: Dict[str, List[CheckResult]] = {}
+        self.failures: Dict[str, int] = dict.fromkeys(countedLevels, 0)
+        # templates that weren't fully scanned without a scan error (eg. the Conformity scan was skipped)
+        self.incomplete: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def add(self, riskLevel: str, result: CheckResult) -> None:
+        group = self.groups.get(riskLevel)
+        if group is None:
+            group = self.groups[riskLevel] = []
+        group.append(result)
+
+        if result.status == 'failed' and riskLevel in self.failures:
+            self.failures[riskLevel] += 1
+
+    def merge(self, other: 'ResultStore') -> None:
+        """
+        Appends other's results (eg. from a template scanned in parallel), as if they had been added here
+        """
+        for riskLevel, results in other.groups.items():
+            group = self.groups.get(riskLevel)
+            if group is None:
+                group = self.groups[riskLevel] = []
+            group.extend(results)
+        for riskLevel, count in other.failures.items():
+            if riskLevel in self.failures:
+                self.failures[riskLevel] += count
+        self.incomplete |= other.incomplete
+
+    def renamed(self, filename: str) -> 'ResultStore':
+        """
+        :return: a copy of the results, reported against filename (eg. a nested stack under one of its parents)
+        """
+        store = ResultStore(())
+        store.failures = dict(self.failures)
+        store.incomplete = {filename} if self.incomplete else set()
+        store.groups = {
+            riskLevel: [CheckResult(r.id, r.name, r.message, filename, r.status, r.rule, r.error) for r in results]
+            for riskLevel, results in self.groups.items()
+        }
+        return store
+
+    def cucumber(self) -> List[Dict[str, Any]]:
+        """
+        Renders the results as Cucumber JSON features, one per risk level (highest sev first)
+        :return: list of Cucumber feature dicts, ready for json.dumps
+        """
+        return [
+            {
+                "id": CUCUMBER_FEATURE_ID,
+                "description": CUCUMBER_FEATURE_DESCRIPTION,
+                "name": riskLevel,
+                "elements": [result.cucumber() for result in self.groups[riskLevel]]
+            }
+            for riskLevel in reversed(list(self.groups.keys()))
+        ]
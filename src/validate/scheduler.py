@@ -0,0 +1,402 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Runs template scans on a process wide pool of workers, shared fairly between accounts, with per account
+concurrency and rate quotas.
+
+Queued scans are dispatched in weighted fair queuing (start time fair queuing) order: each account's scans
+are tagged with a virtual finish time that grows by scan cost (template bytes) / account weight, so an
+account submitting 200 templates can't hold up an account submitting 2 behind it.
+
+The quotas are shared by every invocation through a DynamoDB table (SCAN_STATE_TABLENAME), or kept in
+memory (per process) when no table is configured. A scan that can't get a quota slot within SCAN_QUOTA_WAIT
+seconds fails with ThrottledError, which the validate API returns as a 429 with a Retry-After header.
+"""
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from validate import logs, metrics, profiling
+
+logger = logs.get_logger("templateScannerScheduler")
+
+# Scans run in parallel per process (Lambda container or validate-server process)
+SCAN_CONCURRENCY_ENV = 'SCAN_CONCURRENCY'
+# Per account quotas, shared by every invocation. 0 (the default) is unlimited
+SCAN_QUOTA_CONCURRENCY_ENV = 'SCAN_QUOTA_CONCURRENCY'
+SCAN_QUOTA_RATE_ENV = 'SCAN_QUOTA_RATE'
+# Scans an account can make in a burst above SCAN_QUOTA_RATE, defaults to a minute's worth
+SCAN_QUOTA_BURST_ENV = 'SCAN_QUOTA_BURST'
+# Seconds a scan waits for its account's quota before the request is throttled
+SCAN_QUOTA_WAIT_ENV = 'SCAN_QUOTA_WAIT'
+# Comma separated <accountId>=<weight>, eg. 111122223333=2 gives that account twice the share of workers
+SCAN_WEIGHTS_ENV = 'SCAN_WEIGHTS'
+# DynamoDB table the quotas are kept in, in memory (per process) if unset
+SCAN_STATE_TABLENAME_ENV = 'SCAN_STATE_TABLENAME'
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_QUOTA_WAIT = 5.0
+# a slot held by an invocation that crashed is freed after this many seconds
+LEASE_TTL = 300.0
+# how often a scan waiting on its account's concurrency quota checks for a free slot
+CONCURRENCY_POLL = 1.0
+# attempts at the conditional write when other invocations update the same account's quota at once
+MAX_WRITE_CONFLICTS = 5
+
+_scheduler: Optional['Scheduler'] = None
+_schedulerLock = threading.Lock()
+
+
+class ThrottledError(Exception):
+    """An account is over its scan quota"""
+
+    def __init__(self, accountId: str, retryAfter: float) -> None:
+        super().__init__(f'Account {accountId} is over its scan quota, retry after {math.ceil(retryAfter)} seconds')
+        self.accountId = accountId
+        self.retryAfter = retryAfter
+
+
+class Quota:
+    """
+    :param concurrency: scans an account may have in flight at once, 0 for unlimited
+    :param rate: scans per minute per account, 0 for unlimited
+    :param burst: scans an account can make at once before being held to rate, defaults to a minute's worth
+    """
+
+    def __init__(self, concurrency: int = 0, rate: float = 0.0, burst: float = 0.0, leaseTtl: float = LEASE_TTL) -> None:
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst or rate
+        self.leaseTtl = leaseTtl
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.concurrency and not self.rate
+
+
+def take(quota: Quota, state: Optional[Dict[str, Any]], now: float) -> Tuple[Optional[Dict[str, Any]], str, float]:
+    """
+    Takes a slot (and a rate token) from an account's quota state
+    :param state: { "leases": { "<leaseId>": <expiry>, ... }, "tokens": <float>, "updatedAt": <epoch seconds> }
+    :return: (new state, lease id, 0) if granted, else (None, '', seconds until it is worth asking again)
+    """
+    leases = {leaseId: float(expiry) for leaseId, expiry in ((state or {}).get('leases') or {}).items()
+              if float(expiry) > now}
+    tokens = quota.burst
+    if state is not None and quota.rate:
+        elapsed = max(0.0, now - float(state.get('updatedAt', now)))
+        tokens = min(quota.burst, float(state.get('tokens', quota.burst)) + elapsed * quota.rate / 60)
+
+    if quota.concurrency and len(leases) >= quota.concurrency:
+        return None, '', CONCURRENCY_POLL
+    if quota.rate:
+        if tokens < 1:
+            return None, '', (1 - tokens) * 60 / quota.rate
+        tokens -= 1
+
+    leaseId = uuid.uuid4().hex
+    leases[leaseId] = now + quota.leaseTtl
+    return {'leases': leases, 'tokens': tokens, 'updatedAt': now}, leaseId, 0.0
+
+
+class LocalQuotaStore:
+    """Quota state in memory, shared by the scans in this process only"""
+
+    def __init__(self) -> None:
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, accountId: str, quota: Quota, now: float) -> Tuple[str, float]:
+        """
+        :return: (lease id, 0) if granted, else ('', seconds until it is worth asking again)
+        """
+        with self._lock:
+            state, leaseId, retryAfter = take(quota, self._states.get(accountId), now)
+            if state is not None:
+                self._states[accountId] = state
+        return leaseId, retryAfter
+
+    def release(self, accountId: str, leaseId: str) -> None:
+        with self._lock:
+            self._states.get(accountId, {}).get('leases', {}).pop(leaseId, None)
+
+
+class DynamoQuotaStore:
+    """
+    Quota state in DynamoDB, one item per account, shared by every invocation. Updates are conditional
+    on the item's version, so concurrent invocations can't both take the last slot.
+    """
+
+    def __init__(self, tableName: str) -> None:
+        self.tableName = tableName
+        # boto3 resources aren't thread safe, each scan worker gets its own
+        self._local = threading.local()
+
+    def _table(self) -> Any:
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
+            table = self._local.table = dynamodb.Table(self.tableName)
+        return table
+
+    @staticmethod
+    def _key(accountId: str) -> Dict[str, str]:
+        return {'partKey': f'quota#{accountId}', 'sortKey': 'quota'}
+
+    def acquire(self, accountId: str, quota: Quota, now: float) -> Tuple[str, float]:
+        """
+        :return: (lease id, 0) if granted, else ('', seconds until it is worth asking again)
+        """
+        table = self._table()
+        for _ in range(MAX_WRITE_CONFLICTS):
+            item = table.get_item(Key=self._key(accountId), ConsistentRead=True).get('Item')
+            state, leaseId, retryAfter = take(quota, item, now)
+            if state is None:
+                return '', retryAfter
+
+            version = int(item['version']) if item else 0
+            try:
+                table.put_item(
+                    Item=dict(self._key(accountId),
+                              leases={lease: _decimal(expiry) for lease, expiry in state['leases'].items()},
+                              tokens=_decimal(state['tokens']), updatedAt=_decimal(now), version=version + 1,
+                              expiresAt=int(now + quota.leaseTtl + (quota.burst * 60 / quota.rate if quota.rate else 0))),
+                    ConditionExpression=Attr('version').eq(version) if item else Attr('partKey').not_exists()
+                )
+                return leaseId, 0.0
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                metrics.count('QuotaWriteConflicts')
+        return '', CONCURRENCY_POLL
+
+    def release(self, accountId: str, leaseId: str) -> None:
+        try:
+            self._table().update_item(
+                Key=self._key(accountId),
+                UpdateExpression='REMOVE leases.#lease SET version = version + :one',
+                ConditionExpression=Attr('partKey').exists(),
+                ExpressionAttributeNames={'#lease': leaseId},
+                ExpressionAttributeValues={':one': 1}
+            )
+        except ClientError:
+            # the lease expires by itself after LEASE_TTL
+            logger.warning('Failed to release scan quota lease for account %s', accountId)
+
+
+def _decimal(value: float) -> Decimal:
+    return Decimal(str(round(value, 3)))
+
+
+class ScanTask:
+    __slots__ = ('accountId', 'start', 'fn', 'args', 'future', 'context')
+
+    def __init__(self, accountId: str, start: float, fn: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        self.accountId = accountId
+        self.start = start
+        self.fn = fn
+        self.args = args
+        self.future: 'Future[Any]' = Future()
+        # scans record into the submitting invocation's metrics
+        self.context = contextvars.copy_context()
+
+
+class Scheduler:
+    """
+    :param workers: scans run at once in this process
+    :param store: LocalQuotaStore or DynamoQuotaStore
+    :param weights: accountId -> share of the workers relative to other accounts (default 1)
+    :param wait: seconds a scan waits for its account's quota before failing with ThrottledError
+    """
+
+    def __init__(self, workers: int = DEFAULT_CONCURRENCY, quota: Optional[Quota] = None, store: Any = None,
+                 weights: Optional[Dict[str, float]] = None, wait: float = DEFAULT_QUOTA_WAIT) -> None:
+        self.workers = max(1, workers)
+        self.quota = quota or Quota()
+        self.store = store or LocalQuotaStore()
+        self.weights = weights or {}
+        self.wait = wait
+        # the configuration the shared scheduler was built from, see scheduler()
+        self.settings: Tuple[Any, ...] = ()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='scan')
+        self._queue: List[Tuple[float, int, ScanTask]] = []
+        self._sequence = itertools.count()
+        self._virtualTime = 0.0
+        self._lastFinish: Dict[str, float] = {}
+        self._running = 0
+        self._runningByAccount: Counter = Counter()
+        self._lock = threading.Lock()
+        # set by shutdown(), the executor is shut down once the queued scans have run
+        self._closing = False
+        self._drained = threading.Event()
+
+    def submit(self, accountId: str, cost: float, fn: Callable[..., Any], *args: Any) -> 'Future[Any]':
+        """
+        Queues fn(*args) as a scan for accountId
+        :param cost: relative cost of the scan, eg. template bytes
+        :return: future for fn's result. Cancelling it before the scan starts drops the scan
+        """
+        with self._lock:
+            start = max(self._virtualTime, self._lastFinish.get(accountId, 0.0))
+            finish = start + max(cost, 1.0) / self.weights.get(accountId, 1.0)
+            self._lastFinish[accountId] = finish
+            task = ScanTask(accountId, start, fn, args)
+            heapq.heappush(self._queue, (finish, next(self._sequence), task))
+        self._dispatch()
+        return task.future
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            held = []
+            while self._running < self.workers and self._queue:
+                entry = heapq.heappop(self._queue)
+                task = entry[2]
+                if task.future.cancelled():
+                    continue
+                # no point taking a worker for a scan that would only wait on its account's quota
+                if self.quota.concurrency and self._runningByAccount[task.accountId] >= self.quota.concurrency:
+                    held.append(entry)
+                    continue
+                self._virtualTime = task.start
+                self._running += 1
+                self._runningByAccount[task.accountId] += 1
+                try:
+                    self._executor.submit(self._run, task)
+                except RuntimeError as e:
+                    # submitted after the scheduler was shut down and drained
+                    self._running -= 1
+                    self._runningByAccount[task.accountId] -= 1
+                    task.future.set_exception(e)
+            for entry in held:
+                heapq.heappush(self._queue, entry)
+            drained = self._closing and self._running == 0 and \
+                all(entry[2].future.cancelled() for entry in self._queue)
+        if (drained and not self._drained.is_set()):
+            self._drained.set()
+            self._executor.shutdown(wait=False)
+
+    def _run(self, task: ScanTask) -> None:
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    result = task.context.run(self._scan, task)
+                except BaseException as e:
+                    task.future.set_exception(e)
+                else:
+                    task.future.set_result(result)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._runningByAccount[task.accountId] -= 1
+            self._dispatch()
+
+    def _scan(self, task: ScanTask) -> Any:
+        leaseId = self._acquire(task.accountId)
+        try:
+            with profiling.worker():
+                return task.fn(*task.args)
+        finally:
+            if leaseId:
+                self.store.release(task.accountId, leaseId)
+
+    def _acquire(self, accountId: str) -> str:
+        """
+        Waits up to self.wait for a slot in the account's quota
+        :return: lease id to release once the scan is done, empty if there is no quota
+        :raises ThrottledError: if no slot came free in time
+        """
+        if self.quota.unlimited:
+            return ''
+        deadline = time.monotonic() + self.wait
+        with metrics.timer('QuotaWaitTime'):
+            while True:
+                leaseId, retryAfter = self.store.acquire(accountId, self.quota, time.time())
+                if leaseId:
+                    return leaseId
+                remaining = deadline - time.monotonic()
+                if retryAfter > remaining:
+                    logger.warning('Account %s is over its scan quota, retry after %.1fs', accountId, retryAfter)
+                    metrics.count('ScansThrottled')
+                    raise ThrottledError(accountId, retryAfter)
+                time.sleep(retryAfter)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """
+        Stops the scheduler once the scans already submitted have run, so their futures still complete
+        :param wait: wait for them to finish
+        """
+        with self._lock:
+            self._closing = True
+        self._dispatch()
+        if wait:
+            self._drained.wait()
+            self._executor.shutdown(wait=True)
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """
+    :param value: eg. "111122223333=2,444455556666=0.5"
+    """
+    weights = {}
+    for entry in value.split(','):
+        if '=' in entry:
+            accountId, weight = entry.split('=', 1)
+            weights[accountId.strip()] = float(weight)
+    return weights
+
+
+def _settings() -> Tuple[Any, ...]:
+    env = os.environ
+    return (int(env.get(SCAN_CONCURRENCY_ENV, DEFAULT_CONCURRENCY)),
+            int(env.get(SCAN_QUOTA_CONCURRENCY_ENV, 0)),
+            float(env.get(SCAN_QUOTA_RATE_ENV, 0)),
+            float(env.get(SCAN_QUOTA_BURST_ENV, 0)),
+            float(env.get(SCAN_QUOTA_WAIT_ENV, DEFAULT_QUOTA_WAIT)),
+            env.get(SCAN_WEIGHTS_ENV, ''),
+            env.get(SCAN_STATE_TABLENAME_ENV, ''))
+
+
+def scheduler() -> Scheduler:
+    """
+    Scheduler shared by every invocation in this process. Rebuilt if the SCAN_* settings change
+    """
+    global _scheduler
+    settings = _settings()
+    current = _scheduler
+    if current is None or current.settings != settings:
+        with _schedulerLock:
+            if _scheduler is None or _scheduler.settings != settings:
+                workers, concurrency, rate, burst, wait, weights, tableName = settings
+                if _scheduler is not None:
+                    # the old scheduler's queued scans still run, on its own workers
+                    _scheduler.shutdown()
+                store = DynamoQuotaStore(tableName) if tableName else LocalQuotaStore()
+                _scheduler = Scheduler(workers, Quota(concurrency, rate, burst), store, parse_weights(weights), wait)
+                _scheduler.settings = settings
+            current = _scheduler
+    return current
+
+
+def reset(wait: bool = False) -> None:
+    """
+    Drops the shared scheduler, along with its in memory quota state
+    :param wait: wait for the submitted scans to finish
+    """
+    global _scheduler
+    with _schedulerLock:
+        if _scheduler is not None:
+            _scheduler.shutdown(wait)
+        _scheduler = None
@@ -0,0 +1,194 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import base64
+import gzip
+import json
+import os
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+# orjson is optional - it is noticeably faster for large result sets, but the stdlib
+# encoder is used when it isn't installed. The Lambda deployment package includes it
+# (src/requirements.txt), pip installs only add it with the "orjson" extra
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment package
+    orjson = None
+
+# v1: 'results' is a JSON string embedded in the JSON body (default, kept for existing pipelines)
+# v2: 'results' is nested natively, so the body is only encoded once
+RESPONSE_VERSIONS = (1, 2)
+DEFAULT_RESPONSE_VERSION = 1
+RESPONSE_VERSION_HEADER = 'X-Response-Version'
+
+# Responses smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+# Largest request body accepted once decompressed, in bytes. Caps what a small gzip body can expand to
+MAX_REQUEST_BYTES_ENV = 'MAX_REQUEST_BYTES'
+# Lambda accepts 6MB payloads, and templates typically compress 5-10x
+DEFAULT_MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# (MAX_REQUEST_BYTES as set, parsed), so the variable is only parsed again when it changes
+_maxRequestBytes: Tuple[Optional[str], int] = (None, DEFAULT_MAX_REQUEST_BYTES)
+
+
+class InvalidRequestError(ValueError):
+    """Raised when a request option is not supported. Returned to the caller as a 400."""
+
+
+class RequestTooLargeError(InvalidRequestError):
+    """Raised when a compressed request body expands past MAX_REQUEST_BYTES. Returned to the caller as a 413."""
+
+
+def dumps(obj: Any) -> str:
+    """
+    Serialises obj to a compact JSON string, using orjson when available
+    :param obj: JSON serialisable object
+    :return: JSON string
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """
+    Case insensitive lookup of a request header from an API Gateway proxy event
+    :return: header value, or None if not present
+    """
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def response_version(event: Dict[str, Any], body: Dict[str, Any]) -> int:
+    """
+    Works out which response format the caller wants. 'responseVersion' in the request body
+    takes precedence over the X-Response-Version header. Defaults to v1.
+    :raises InvalidRequestError: if an unsupported version is requested
+    """
+    requested = body.get('responseVersion', get_header(event, RESPONSE_VERSION_HEADER))
+    if requested is None:
+        return DEFAULT_RESPONSE_VERSION
+
+    try:
+        version = int(requested)
+    except (TypeError, ValueError):
+        version = None
+
+    if version not in RESPONSE_VERSIONS:
+        raise InvalidRequestError(f'Unsupported response version {requested}, expected one of {list(RESPONSE_VERSIONS)}')
+
+    return version
+
+
+def load_request_body(event: Dict[str, Any]) -> Any:
+    """
+    Returns the request body from an API Gateway proxy event as text. Handles base64 encoded bodies
+    (binary media types) and gzip compressed bodies (Content-Encoding: gzip).
+    :raises InvalidRequestError: if the body can't be decoded
+    """
+    body = event['body']
+    if body is None:
+        return body
+    # outside the try: a bad MAX_REQUEST_BYTES is the deployment's problem, not the caller's
+    maxBytes = max_request_bytes()
+
+    try:
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+
+        if (get_header(event, 'Content-Encoding') or '').strip().lower() == 'gzip':
+            body = decompress(body if isinstance(body, bytes) else body.encode('latin-1'), maxBytes)
+
+        return body.decode('utf-8') if isinstance(body, bytes) else body
+
+    except RequestTooLargeError:
+        raise
+    except (ValueError, OSError, EOFError, zlib.error) as e:
+        raise InvalidRequestError(f'Could not decode request body: {e}')
+
+
+def max_request_bytes() -> int:
+    """
+    :return: MAX_REQUEST_BYTES, DEFAULT_MAX_REQUEST_BYTES if it isn't set
+    :raises ValueError: if MAX_REQUEST_BYTES isn't a positive number of bytes
+    """
+    global _maxRequestBytes
+    value = os.environ.get(MAX_REQUEST_BYTES_ENV)
+    if value != _maxRequestBytes[0]:
+        try:
+            parsed = int(value) if value is not None else DEFAULT_MAX_REQUEST_BYTES
+        except ValueError:
+            parsed = 0
+        if parsed <= 0:
+            raise ValueError(f'{MAX_REQUEST_BYTES_ENV} must be a positive number of bytes, not {value!r}')
+        _maxRequestBytes = (value, parsed)
+    return _maxRequestBytes[1]
+
+
+def decompress(data: bytes, maxBytes: int) -> bytes:
+    """
+    Decompresses a gzip body, without ever holding more than maxBytes of output
+    :raises RequestTooLargeError: if it decompresses to more than maxBytes
+    :raises EOFError: if the gzip stream is truncated
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    body = decompressor.decompress(data, maxBytes + 1)
+    if len(body) > maxBytes or decompressor.unconsumed_tail:
+        raise RequestTooLargeError(f'Request body is larger than {maxBytes} bytes once decompressed')
+    if not decompressor.eof:
+        raise EOFError('Compressed request body is truncated')
+    return body
+
+
+def accepts_gzip(event: Dict[str, Any]) -> bool:
+    """
+    True if the Accept-Encoding request header allows gzip: listed without q=0, or not listed and "*" is (without
+    q=0)
+    """
+    weights: Dict[str, float] = {}
+    for coding in (get_header(event, 'Accept-Encoding') or '').split(','):
+        name, *params = [part.strip().lower() for part in coding.split(';')]
+        if name in ('gzip', '*'):
+            weights[name] = _quality(params)
+    weight = weights.get('gzip', weights.get('*', 0.0))
+    return weight > 0
+
+
+def _quality(params: List[str]) -> float:
+    for param in params:
+        if param.startswith('q='):
+            try:
+                return float(param[2:])
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def encode_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Gzip compresses the response body (base64 encoded, as required by API Gateway) if the
+    caller accepts gzip and the body is big enough to benefit
+    :return: response, modified in place
+    """
+    body = response.get('body')
+    if not isinstance(body, str) or len(body) < GZIP_MIN_BYTES or not accepts_gzip(event):
+        return response
+
+    compressed = gzip.compress(body.encode('utf-8'), compresslevel=GZIP_LEVEL)
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    headers = response.setdefault('headers', {})
+    headers['Content-Encoding'] = 'gzip'
+    headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+# a bad MAX_REQUEST_BYTES fails the Lambda init (or validate-server's start), rather than each request as a 400
+max_request_bytes()
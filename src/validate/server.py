@@ -0,0 +1,300 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Standalone HTTP server for the validate and exceptions APIs, for teams that can't use the API Gateway / Lambda
+deployment in template.yml. Requests are run by the same handlers, in a fixed pool of worker threads (or processes),
+so warm caches (API key, Conformity accounts, DynamoDB resources) and pooled connections are shared across requests.
+
+    validate-server --port 8080 --workers 8 --max-queue 32
+
+The server has no authentication of its own (the Lambda deployment relies on API Gateway for that), so it listens
+on the loopback interface unless --allow-remote is given. Only bind it elsewhere behind something that
+authenticates callers, eg. a reverse proxy or a private network with security groups limiting who can reach it.
+"""
+import argparse
+import base64
+import ipaddress
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import boto3
+
+from validate import app, exceptions, logs
+
+logger = logs.get_logger("templateScannerServer")
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_SHUTDOWN_TIMEOUT = 30.0
+
+# Optional, the Conformity API key. If unset it is read from Secrets Manager as in the Lambda deployment
+CONFORMITY_API_KEY_ENV = 'CONFORMITY_API_KEY'
+
+# (method, path) -> handler name, the same routes as the API in template.yml
+ROUTES: Dict[Tuple[str, str], str] = {
+    ('POST', '/validate'): 'validate',
+    ('POST', '/exceptions'): 'exceptions.request',
+    ('PUT', '/exceptions'): 'exceptions.approve',
+    ('DELETE', '/exceptions'): 'exceptions.delete'
+}
+
+HANDLERS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    'validate': app.lambda_handler,
+    'exceptions.request': exceptions.request,
+    'exceptions.approve': exceptions.approve,
+    'exceptions.delete': exceptions.delete
+}
+
+# one DynamoDB resource per worker thread (boto3 resources aren't thread safe), reused across requests
+_local = threading.local()
+
+
+def _dynamodb() -> Any:
+    resource = getattr(_local, 'dynamodb', None)
+    if resource is None:
+        resource = _local.dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
+    return resource
+
+
+def invoke(handlerName: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs a handler in a worker. Module level (rather than a closure) so it can be sent to worker processes.
+    """
+    return HANDLERS[handlerName](event, {}, _dynamodb())
+
+
+def _init_worker(apiKey: Optional[str]) -> None:
+    if apiKey:
+        app.API_KEY = apiKey
+
+
+class WorkerPool:
+    """
+    Runs handlers on a fixed number of workers, with at most maxQueue requests waiting for a free worker.
+    Requests beyond that are rejected straight away rather than queueing without bound.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, maxQueue: int = DEFAULT_MAX_QUEUE, processes: bool = False,
+                 apiKey: Optional[str] = None) -> None:
+        self.workers = workers
+        self.maxQueue = maxQueue
+        self._slots = threading.BoundedSemaphore(workers + maxQueue)
+        self._lock = threading.Lock()
+        self.inFlight = 0
+        self.draining = False
+        if processes:
+            self._executor: Executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(apiKey,))
+        else:
+            _init_worker(apiKey)
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='validate-worker')
+
+    def submit(self, handlerName: str, event: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        :return: the handler's response, or None if the pool is full or shutting down
+        """
+        if self.draining or not self._slots.acquire(blocking=False):
+            return None
+        with self._lock:
+            self.inFlight += 1
+        try:
+            future = self._executor.submit(invoke, handlerName, event)
+        except Exception:
+            self._done(None)
+            raise
+        # the slot is only freed once the handler finishes, even if the caller stops waiting (timeout)
+        future.add_done_callback(self._done)
+        return future.result(timeout)
+
+    def _done(self, future: Any) -> None:
+        with self._lock:
+            self.inFlight -= 1
+        self._slots.release()
+
+    def shutdown(self, timeout: float = DEFAULT_SHUTDOWN_TIMEOUT) -> bool:
+        """
+        Stops taking new requests and waits for in-flight requests to finish
+        :return: True if everything finished within timeout
+        """
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while self.inFlight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        drained = self.inFlight == 0
+        self._executor.shutdown(wait=drained)
+        return drained
+
+
+def to_event(method: str, path: str, headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """API Gateway proxy style event for the handlers"""
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': headers,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def from_response(response: Dict[str, Any]) -> Tuple[int, Dict[str, str], bytes]:
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        data = base64.b64decode(body)
+    else:
+        data = body.encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    headers.update(response.get('headers') or {})
+    return int(response.get('statusCode', 500)), headers, data
+
+
+class ValidateServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], pool: WorkerPool, requestTimeout: Optional[float] = None) -> None:
+        super().__init__(address, RequestHandler)
+        self.pool = pool
+        self.requestTimeout = requestTimeout
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: ValidateServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+    def _send(self, status: int, headers: Dict[str, str], body: bytes) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(status, dict({'Content-Type': 'application/json'}, **(headers or {})), json.dumps(body).encode('utf-8'))
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            pool = self.server.pool
+            self._send_json(503 if pool.draining else 200,
+                            {'status': 'draining' if pool.draining else 'ok', 'inFlight': pool.inFlight,
+                             'workers': pool.workers})
+            return
+        self._send_json(404, {'message': 'Not Found'})
+
+    def do_POST(self) -> None:
+        self._dispatch()
+
+    def do_PUT(self) -> None:
+        self._dispatch()
+
+    def do_DELETE(self) -> None:
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        handlerName = ROUTES.get((self.command, self.path.split('?')[0]))
+        if handlerName is None:
+            self._send_json(404, {'message': 'Not Found'})
+            return
+
+        event = to_event(self.command, self.path, dict(self.headers), body)
+        try:
+            response = self.server.pool.submit(handlerName, event, self.server.requestTimeout)
+        except FutureTimeoutError:
+            logger.error('Timed out handling %s %s', self.command, self.path)
+            self._send_json(504, {'message': 'Timed out waiting for the request to be handled'})
+            return
+        except Exception as e:
+            logger.error('Worker failed handling %s %s: %s', self.command, self.path, e)
+            self._send_json(500, {'message': f'Worker failed: {e}'})
+            return
+
+        if response is None:
+            self._send_json(503, {'message': 'Server busy, retry later'}, {'Retry-After': '1'})
+            return
+        self._send(*from_response(response))
+
+
+def serve(host: str, port: int, pool: WorkerPool, requestTimeout: Optional[float] = None,
+          shutdownTimeout: float = DEFAULT_SHUTDOWN_TIMEOUT) -> None:
+    """
+    Serves until SIGTERM / SIGINT, then drains in-flight requests before returning
+    """
+    server = ValidateServer((host, port), pool, requestTimeout)
+
+    def stop(signum: int, frame: Any) -> None:
+        logger.info('Received signal %s, shutting down', signum)
+        pool.draining = True
+        # shutdown() blocks until serve_forever returns, so it can't be called from the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info('Listening on %s:%s with %s workers', host, server.server_port, pool.workers)
+    try:
+        server.serve_forever()
+    finally:
+        drained = pool.shutdown(shutdownTimeout)
+        server.server_close()
+        logger.info('Shut down%s', '' if drained else f', {pool.inFlight} requests still in flight')
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='validate-server', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='Address to listen on, a non loopback address also needs --allow-remote')
+    parser.add_argument('--allow-remote', action='store_true',
+                        help='Allow listening on a non loopback address. Requests are not authenticated, put the '
+                             'server behind something that does')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', DEFAULT_PORT)))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Requests handled concurrently')
+    parser.add_argument('--processes', action='store_true',
+                        help='Use worker processes rather than threads (caches are then per process)')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help='Requests waiting for a worker before new ones are rejected with 503')
+    parser.add_argument('--request-timeout', type=float, help='Seconds to wait for a worker to finish a request')
+    parser.add_argument('--shutdown-timeout', type=float, default=DEFAULT_SHUTDOWN_TIMEOUT,
+                        help='Seconds to wait for in-flight requests on shutdown')
+    return parser.parse_args(argv)
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    if not is_loopback(args.host) and not args.allow_remote:
+        print(f'Refusing to listen on {args.host} without --allow-remote, the server does not authenticate '
+              'requests', file=sys.stderr)
+        return 2
+    for name in ('AWS_REGION', 'STAGE', 'EXCEPTIONS_TABLENAME'):
+        if not os.environ.get(name):
+            print(f'{name} must be set', file=sys.stderr)
+            return 2
+
+    pool = WorkerPool(args.workers, args.max_queue, args.processes, os.environ.get(CONFORMITY_API_KEY_ENV))
+    serve(args.host, args.port, pool, args.request_timeout, args.shutdown_timeout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
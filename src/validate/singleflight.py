@@ -0,0 +1,189 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Deduplicates identical Template Scanner calls made at around the same time by different invocations (eg.
+dozens of pipelines validating a shared template that just changed).
+
+The first invocation to scan a payload claims it with a conditional write to the scan state table, scans,
+and stores the response for SINGLEFLIGHT_TTL seconds. Invocations scanning the same payload in the meantime
+wait for (up to SINGLEFLIGHT_WAIT seconds) and use the stored response instead of calling Conformity. A claim
+is only honoured for SINGLEFLIGHT_LOCK_TTL seconds, so an invocation that crashes mid scan doesn't block
+anyone for long, and a waiter that runs out of time scans for itself.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional
+
+import boto3
+import requests
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from validate import logs, metrics
+
+logger = logs.get_logger("templateScannerSingleFlight")
+
+# Seconds a scan response is shared with identical scans, 0 (the default) disables deduplication
+SINGLEFLIGHT_TTL_ENV = 'SINGLEFLIGHT_TTL'
+# Seconds to wait for another invocation's scan of the same payload before scanning anyway
+SINGLEFLIGHT_WAIT_ENV = 'SINGLEFLIGHT_WAIT'
+# Seconds a claim on a payload is honoured, after which the scan is assumed to have crashed
+SINGLEFLIGHT_LOCK_TTL_ENV = 'SINGLEFLIGHT_LOCK_TTL'
+# Claims and responses are kept in the scan state table, see scheduler.py
+SCAN_STATE_TABLENAME_ENV = 'SCAN_STATE_TABLENAME'
+
+DEFAULT_WAIT = 10.0
+DEFAULT_LOCK_TTL = 30.0
+# how often a waiting invocation checks for the response
+POLL_INTERVAL = 0.25
+
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return bool(os.environ.get(SCAN_STATE_TABLENAME_ENV)) and float(os.environ.get(SINGLEFLIGHT_TTL_ENV, 0)) > 0
+
+
+def payload_key(payload: Dict[str, Any]) -> str:
+    """sha256 of the scan payload, which includes the Conformity account as well as the template"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def _table() -> Any:
+    # scans run on several threads (see scheduler.py), boto3 resources aren't thread safe
+    tableName = os.environ[SCAN_STATE_TABLENAME_ENV]
+    table = getattr(_local, 'table', None)
+    if table is None or table.name != tableName:
+        dynamodb = boto3.resource('dynamodb', region_name=os.environ['AWS_REGION'])
+        table = _local.table = dynamodb.Table(tableName)
+    return table
+
+
+def _response(item: Dict[str, Any]) -> requests.Response:
+    response = requests.Response()
+    response.status_code = int(item['status'])
+    response._content = gzip.decompress(getattr(item['result'], 'value', item['result']))
+    response.encoding = 'utf-8'
+    response.headers['Content-Type'] = 'application/vnd.api+json'
+    response.reason = 'Shared'
+    return response
+
+
+class SingleFlight:
+    """
+    :param ttl: seconds a response is shared
+    :param wait: seconds to wait for another invocation's scan
+    :param lockTtl: seconds a claim is honoured
+    """
+
+    def __init__(self, table: Any, ttl: float, wait: float = DEFAULT_WAIT, lockTtl: float = DEFAULT_LOCK_TTL) -> None:
+        self.table = table
+        self.ttl = ttl
+        self.wait = wait
+        self.lockTtl = lockTtl
+
+    @staticmethod
+    def _key(key: str) -> Dict[str, str]:
+        return {'partKey': f'scan#{key}', 'sortKey': 'scan'}
+
+    def _get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        item = self.table.get_item(Key=self._key(key), ConsistentRead=True).get('Item')
+        # expired items linger until DynamoDB's TTL deletes them
+        if item is not None and 'result' in item and float(item['freshUntil']) < now:
+            return None
+        return item
+
+    def _claim(self, key: str, owner: str, now: float) -> bool:
+        try:
+            self.table.put_item(
+                Item=dict(self._key(key), owner=owner, lockedUntil=Decimal(str(round(now + self.lockTtl, 3))),
+                          expiresAt=int(now + self.lockTtl + self.ttl)),
+                ConditionExpression=(Attr('partKey').not_exists()
+                                     | (Attr('result').not_exists() & Attr('lockedUntil').lt(Decimal(str(now))))
+                                     | Attr('freshUntil').lt(Decimal(str(now))))
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+
+    def _store(self, key: str, owner: str, response: requests.Response) -> None:
+        now = time.time()
+        try:
+            self.table.put_item(
+                Item=dict(self._key(key), owner=owner, status=response.status_code,
+                          result=gzip.compress(response.content), freshUntil=Decimal(str(round(now + self.ttl, 3))),
+                          expiresAt=int(now + self.ttl) + 1),
+                ConditionExpression=Attr('owner').eq(owner)
+            )
+        except ClientError as e:
+            # lost the claim (we took longer than lockTtl), or the response is too big to store
+            logger.warning('Could not share scan result %s: %s', key[:12], e.response['Error']['Code'])
+            self._release(key, owner)
+
+    def _release(self, key: str, owner: str) -> None:
+        try:
+            self.table.delete_item(Key=self._key(key), ConditionExpression=Attr('owner').eq(owner)
+                                   & Attr('result').not_exists())
+        except ClientError:
+            pass
+
+    def run(self, key: str, scan: Callable[[], requests.Response]) -> requests.Response:
+        """
+        :param key: eg. payload_key(payload)
+        :param scan: makes the Conformity call, only called if no identical scan is running or recently finished
+        :return: the response, either from scan() or shared by another invocation
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait
+        waited = False
+        while True:
+            now = time.time()
+            item = self._get(key, now)
+            if item is not None and 'result' in item:
+                metrics.count('SingleFlightShared')
+                logger.info('Using shared scan result %s', key[:12])
+                return _response(item)
+
+            if (item is None or float(item['lockedUntil']) < now) and self._claim(key, owner, now):
+                break
+
+            if time.monotonic() >= deadline:
+                logger.warning('Timed out waiting for shared scan result %s, scanning', key[:12])
+                metrics.count('SingleFlightTimeouts')
+                return scan()
+            if not waited:
+                waited = True
+                metrics.count('SingleFlightWaits')
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = scan()
+        except BaseException:
+            self._release(key, owner)
+            raise
+        if response.status_code == 200:
+            self._store(key, owner, response)
+        else:
+            # errors aren't shared, waiters take over the claim and scan for themselves
+            self._release(key, owner)
+        return response
+
+
+def run(payload: Dict[str, Any], scan: Callable[[], requests.Response]) -> requests.Response:
+    """
+    Calls scan(), or shares the response of an identical scan made by another invocation, see SingleFlight
+    """
+    if not enabled():
+        return scan()
+    flight = SingleFlight(_table(), float(os.environ[SINGLEFLIGHT_TTL_ENV]),
+                          float(os.environ.get(SINGLEFLIGHT_WAIT_ENV, DEFAULT_WAIT)),
+                          float(os.environ.get(SINGLEFLIGHT_LOCK_TTL_ENV, DEFAULT_LOCK_TTL)))
+    return flight.run(payload_key(payload), scan)
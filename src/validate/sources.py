@@ -0,0 +1,233 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Templates referenced by S3 location rather than sent inline, so large templates don't run into API Gateway's
+payload limit. A validate request template entry may carry
+    { "filename": "<optional, defaults to the key>", "s3": { "bucket": "...", "key": "...", "version": "<optional>" } }
+instead of "template". The objects are downloaded in parallel (TEMPLATE_DOWNLOAD_CONCURRENCY at a time),
+streamed in chunks so an oversized object is abandoned early, and kept in a per container cache: a versioned
+object is never downloaded twice, an unversioned one is only downloaded again if its ETag changed.
+"""
+import contextvars
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from validate import logs, metrics, serialization
+
+logger = logs.get_logger("templateScannerSources")
+
+# Comma separated buckets templates may be fetched from, empty (the default) rejects S3 references
+TEMPLATE_BUCKETS_ENV = 'TEMPLATE_BUCKETS'
+# Templates downloaded in parallel per request
+TEMPLATE_DOWNLOAD_CONCURRENCY_ENV = 'TEMPLATE_DOWNLOAD_CONCURRENCY'
+# Largest template downloaded, in bytes
+TEMPLATE_MAX_BYTES_ENV = 'TEMPLATE_MAX_BYTES'
+# Bytes of downloaded templates cached between invocations
+TEMPLATE_CACHE_BYTES_ENV = 'TEMPLATE_CACHE_BYTES'
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_client: Any = None
+_clientSettings: Tuple[Any, ...] = ()
+_clientLock = threading.Lock()
+
+
+class S3Ref(NamedTuple):
+    bucket: str
+    key: str
+    # empty for the latest version
+    version: str = ''
+
+    def __str__(self) -> str:
+        return f's3://{self.bucket}/{self.key}' + (f'?versionId={self.version}' if self.version else '')
+
+
+class TemplateDownloadError(Exception):
+    """The object could not be downloaded, or is not a usable template"""
+
+
+def allowed_buckets() -> List[str]:
+    return [bucket.strip() for bucket in os.environ.get(TEMPLATE_BUCKETS_ENV, '').split(',') if bucket.strip()]
+
+
+def s3_ref(entry: Dict[str, Any]) -> Optional[S3Ref]:
+    """
+    :return: the S3 location of a request template entry, None for inline templates
+    :raises serialization.InvalidRequestError: if the location is malformed or its bucket isn't allowed
+    """
+    location = entry.get('s3')
+    if location is None:
+        return None
+    if (not isinstance(location, dict) or not location.get('bucket') or not location.get('key')
+            or not all(isinstance(location.get(name, ''), str) for name in ('bucket', 'key', 'version'))):
+        raise serialization.InvalidRequestError(
+            '"s3" must be an object with a "bucket", a "key" and optionally a "version"')
+    if location['bucket'] not in allowed_buckets():
+        raise serialization.InvalidRequestError(
+            f'Templates can not be fetched from bucket {location["bucket"]}, see {TEMPLATE_BUCKETS_ENV}')
+    return S3Ref(location['bucket'], location['key'], location.get('version', ''))
+
+
+class TemplateCache:
+    """
+    Least recently used downloaded templates, up to maxBytes of template text. Keyed by S3Ref, with the
+    object's ETag to revalidate unversioned objects
+    """
+
+    def __init__(self, maxBytes: int) -> None:
+        self.maxBytes = maxBytes
+        self.size = 0
+        self._entries: 'OrderedDict[S3Ref, Tuple[str, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ref: S3Ref) -> Optional[Tuple[str, str]]:
+        """:return: (etag, template) if cached"""
+        with self._lock:
+            cached = self._entries.get(ref)
+            if cached is not None:
+                self._entries.move_to_end(ref)
+            return cached
+
+    def put(self, ref: S3Ref, etag: str, template: str) -> None:
+        if len(template) > self.maxBytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(ref, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self._entries[ref] = (etag, template)
+            self.size += len(template)
+            while self.size > self.maxBytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+_cache = TemplateCache(int(os.environ.get(TEMPLATE_CACHE_BYTES_ENV, DEFAULT_CACHE_BYTES)))
+
+
+def client() -> Any:
+    """
+    Shared S3 client (boto3 clients, unlike resources, are thread safe), rebuilt if the region or download
+    concurrency changes. Its connection pool is sized for the parallel downloads
+    """
+    global _client, _clientSettings
+    settings = (os.environ['AWS_REGION'], _concurrency())
+    with _clientLock:
+        if _client is None or _clientSettings != settings:
+            _client = boto3.client('s3', region_name=settings[0], config=Config(max_pool_connections=settings[1]))
+            _clientSettings = settings
+        return _client
+
+
+def _concurrency() -> int:
+    return max(1, int(os.environ.get(TEMPLATE_DOWNLOAD_CONCURRENCY_ENV, DEFAULT_CONCURRENCY)))
+
+
+def download(s3: Any, ref: S3Ref, cache: TemplateCache, maxBytes: int) -> str:
+    """
+    :return: the template text, from the cache if the object hasn't changed
+    :raises TemplateDownloadError: if the object can't be read, is larger than maxBytes or isn't UTF-8
+    """
+    cached = cache.get(ref)
+    if cached is not None and ref.version:
+        # object versions never change
+        metrics.count('TemplateCacheHits')
+        return cached[1]
+
+    request: Dict[str, Any] = {'Bucket': ref.bucket, 'Key': ref.key}
+    if ref.version:
+        request['VersionId'] = ref.version
+    if cached is not None:
+        request['IfNoneMatch'] = cached[0]
+    try:
+        with metrics.timer('TemplateDownloadTime'):
+            try:
+                response = s3.get_object(**request)
+            except ClientError as e:
+                if cached is not None and e.response['Error']['Code'] in ('304', 'NotModified'):
+                    metrics.count('TemplateCacheHits')
+                    return cached[1]
+                raise
+            if response.get('ContentLength', 0) > maxBytes:
+                response['Body'].close()
+                raise TemplateDownloadError(f'{ref} is larger than {maxBytes} bytes')
+            chunks = []
+            size = 0
+            for chunk in response['Body'].iter_chunks(CHUNK_SIZE):
+                size += len(chunk)
+                if size > maxBytes:
+                    response['Body'].close()
+                    raise TemplateDownloadError(f'{ref} is larger than {maxBytes} bytes')
+                chunks.append(chunk)
+    except (ClientError, BotoCoreError) as e:
+        logger.warning('Could not download %s: %s', ref, e)
+        raise TemplateDownloadError(f'Could not download {ref}: {e}')
+
+    metrics.count('TemplateDownloads')
+    metrics.count('TemplateDownloadBytes', size)
+    try:
+        template = b''.join(chunks).decode('utf-8')
+    except UnicodeDecodeError:
+        raise TemplateDownloadError(f'{ref} is not a UTF-8 text file')
+    cache.put(ref, response.get('ETag', ''), template)
+    return template
+
+
+def fetch_templates(templates: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """
+    Downloads the templates referenced by S3 location
+    :param templates: request template entries, inline or with "s3"
+    :return: (entries with every template inline, in request order, without the ones that failed to download,
+              [(filename, reason)] for the ones that failed)
+    :raises serialization.InvalidRequestError: if a location is malformed or not allowed
+    """
+    refs = [s3_ref(entry) for entry in templates]
+    if not any(refs):
+        return templates, []
+
+    s3 = client()
+    maxBytes = int(os.environ.get(TEMPLATE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+
+    def fetch(ref: S3Ref) -> Any:
+        try:
+            return download(s3, ref, _cache, maxBytes)
+        except TemplateDownloadError as e:
+            return e
+
+    unique = list(dict.fromkeys(ref for ref in refs if ref is not None))
+    with ThreadPoolExecutor(max_workers=min(_concurrency(), len(unique))) as executor:
+        # downloads record into this invocation's metrics
+        futures = {ref: executor.submit(contextvars.copy_context().run, fetch, ref) for ref in unique}
+        downloaded = {ref: future.result() for ref, future in futures.items()}
+
+    fetched: List[Dict[str, Any]] = []
+    failed: List[Tuple[str, str]] = []
+    for entry, ref in zip(templates, refs):
+        if ref is None:
+            fetched.append(entry)
+            continue
+        filename = entry.get('filename') or ref.key
+        result = downloaded[ref]
+        if isinstance(result, TemplateDownloadError):
+            failed.append((filename, str(result)))
+        else:
+            fetched.append({'filename': filename, 'template': result})
+    return fetched, failed
+
+
+def reset() -> None:
+    """Drops the shared S3 client and the template cache"""
+    global _client, _cache
+    with _clientLock:
+        _client = None
+    _cache = TemplateCache(int(os.environ.get(TEMPLATE_CACHE_BYTES_ENV, DEFAULT_CACHE_BYTES)))
@@ -0,0 +1,214 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, IO, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+from validate import logs
+
+logger = logs.get_logger("templateScannerTransport")
+
+# How calls to CloudConformity are made:
+#   live   (default) - straight to the API
+#   record - to the API, with every request / response appended to CONFORMITY_CASSETTE
+#   replay - answered from CONFORMITY_CASSETTE, no network access
+CONFORMITY_TRANSPORT_ENV = 'CONFORMITY_TRANSPORT'
+CONFORMITY_CASSETTE_ENV = 'CONFORMITY_CASSETTE'
+# Replayed responses are delayed by their recorded time x this, 0 replays as fast as possible
+CONFORMITY_REPLAY_SPEED_ENV = 'CONFORMITY_REPLAY_SPEED'
+
+TRANSPORT_MODES = ('live', 'record', 'replay')
+
+# Response headers worth keeping in a cassette, the rest are dropped to keep cassettes small
+RECORDED_HEADERS = ('Content-Type', 'Retry-After')
+REDACTED = 'REDACTED'
+
+_session: Optional[requests.Session] = None
+_sessionLock = threading.Lock()
+
+
+def body_digest(body: Any) -> str:
+    if body is None:
+        body = b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()
+
+
+def _request_key(method: str, url: str) -> Tuple[str, str]:
+    # host is left out so cassettes recorded against one region replay against any other
+    parts = urlsplit(url)
+    return method.upper(), parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')  # type: ignore[return-value]
+    return open(path, mode, encoding='utf-8')
+
+
+class Cassette:
+    """
+    Recorded interactions, stored as one compact JSON object per line (gzip compressed if the
+    file name ends in .gz). Request bodies are only kept as a sha256 and size, and credentials
+    never reach the file, only the response is stored in full.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, interaction: Dict[str, Any]) -> None:
+        line = json.dumps(interaction, separators=(',', ':')) + '\n'
+        with self._lock, _open(self.path, 'a') as f:
+            f.write(line)
+
+    def load(self) -> List[Dict[str, Any]]:
+        with _open(self.path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def redact_headers(headers: Any) -> Dict[str, str]:
+    return {name: (REDACTED if name.lower() in ('authorization', 'x-api-key') else value)
+            for name, value in headers.items()}
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Sends requests as normal, appending each request / response pair to the cassette"""
+
+    def __init__(self, cassette: Cassette, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:  # type: ignore[override]
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        content = response.content  # reads the body, so elapsed includes the transfer
+        elapsed = time.perf_counter() - start
+
+        method, path = _request_key(request.method or 'GET', request.url or '')
+        self.cassette.append({
+            'method': method,
+            'path': path,
+            'requestHeaders': redact_headers(request.headers),
+            'requestSha256': body_digest(request.body),
+            'requestBytes': len(request.body or b''),
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            'body': content.decode(response.encoding or 'utf-8', 'replace'),
+            'elapsed': round(elapsed, 6)
+        })
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from a cassette. A request is matched to a recorded interaction with the same
+    method, path and body; failing that to the next recorded interaction for the method and path (in
+    recorded order, wrapping around), so other templates can be replayed with recorded timing.
+    """
+
+    def __init__(self, interactions: List[Dict[str, Any]], speed: float = 1.0) -> None:
+        super().__init__()
+        self.speed = speed
+        self._exact: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+        self._byPath: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._next: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+        for interaction in interactions:
+            self._exact.setdefault((interaction['method'], interaction['path'], interaction['requestSha256']),
+                                   []).append(interaction)
+            self._byPath.setdefault((interaction['method'], interaction['path']), []).append(interaction)
+
+    def _take(self, key: Any, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            index = self._next.get(key, 0)
+            self._next[key] = index + 1
+        return candidates[index % len(candidates)]
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:  # type: ignore[override]
+        method, path = _request_key(request.method or 'GET', request.url or '')
+        exactKey = (method, path, body_digest(request.body))
+        if exactKey in self._exact:
+            interaction = self._take(exactKey, self._exact[exactKey])
+        elif (method, path) in self._byPath:
+            interaction = self._take((method, path), self._byPath[(method, path)])
+        else:
+            raise requests.ConnectionError(f'No recorded interaction for {method} {path}', request=request)
+
+        if self.speed > 0:
+            time.sleep(interaction['elapsed'] * self.speed)
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.headers.update(interaction['headers'])
+        response._content = interaction['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url or ''
+        response.request = request
+        response.reason = 'Replayed'
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def transport_mode() -> str:
+    mode = os.environ.get(CONFORMITY_TRANSPORT_ENV, 'live').lower() or 'live'
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f'Unsupported {CONFORMITY_TRANSPORT_ENV} {mode}, expected one of {list(TRANSPORT_MODES)}')
+    return mode
+
+
+def new_session(mode: Optional[str] = None) -> requests.Session:
+    """
+    A session for calling CloudConformity in the given transport mode (defaults to CONFORMITY_TRANSPORT)
+    """
+    mode = mode or transport_mode()
+    session = requests.Session()
+    if mode == 'live':
+        return session
+
+    cassettePath = os.environ.get(CONFORMITY_CASSETTE_ENV)
+    if not cassettePath:
+        raise ValueError(f'{CONFORMITY_CASSETTE_ENV} must be set when {CONFORMITY_TRANSPORT_ENV} is {mode}')
+
+    if mode == 'record':
+        adapter: BaseAdapter = RecordingAdapter(Cassette(cassettePath))
+    else:
+        speed = float(os.environ.get(CONFORMITY_REPLAY_SPEED_ENV, 1.0))
+        adapter = ReplayAdapter(Cassette(cassettePath).load(), speed)
+    logger.info('CloudConformity transport: %s (cassette %s)', mode, cassettePath)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def session() -> requests.Session:
+    """
+    Session shared by every call to CloudConformity, so connections are pooled across calls (and across
+    invocations in a warm container)
+    """
+    global _session
+    if _session is None:
+        with _sessionLock:
+            if _session is None:
+                _session = new_session()
+    return _session
+
+
+def reset() -> None:
+    """Closes the shared session, the next call to session() picks up the current CONFORMITY_* settings"""
+    global _session
+    with _sessionLock:
+        if _session is not None:
+            _session.close()
+        _session = None
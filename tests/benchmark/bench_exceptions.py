@@ -0,0 +1,229 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Load test for the exceptions API (request / approve / delete handlers, and get_approved_exceptions as used
+by validate). Seeds an exceptions table with realistic volumes, then reports latency percentiles, consumed
+read capacity and query pagination per operation, so table schema and index changes can be compared.
+
+Runs against moto by default, or DynamoDB Local (or a real table) with --endpoint-url. Run from the repo root:
+
+    python -m tests.benchmark.bench_exceptions --accounts 100 --exceptions 5000
+    python -m tests.benchmark.bench_exceptions --endpoint-url http://localhost:8000 --accounts 100 --exceptions 5000
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+from unittest import mock
+
+import boto3
+from moto import mock_dynamodb2
+
+from tests.benchmark.bench_validate import percentile
+from validate import exceptions, metrics
+
+TABLE_NAME = 'BENCH_EXCEPTIONS_TABLE'
+REGION = 'ap-southeast-2'
+
+# typical CloudConformity rule ids, exceptions are spread over these
+RULE_PREFIXES = ['S3', 'EC2', 'IAM', 'RDS', 'Lambda', 'KMS', 'CloudTrail', 'VPC', 'ELB', 'SNS']
+
+
+def account_id(index: int) -> str:
+    return f'{100000000000 + index:012d}'
+
+
+def exception_item(accountId: str, index: int, approved: bool) -> Dict[str, Any]:
+    filename = f'stacks/service{index // 20:04d}/template.yml'
+    ruleId = f'{RULE_PREFIXES[index % len(RULE_PREFIXES)]}-{index % 97:03d}'
+    item = {
+        'partKey': accountId,
+        'sortKey': f'{filename}#{ruleId}',
+        'awsAccountId': accountId,
+        'filename': filename,
+        'ruleId': ruleId,
+        'requestReason': 'Accepted risk, compensating control in place (see ticket SEC-1234)',
+        'requestedBy': 'J Doe'
+    }
+    if approved:
+        item['approved'] = 'true'
+        item['approvedBy'] = 'H Simpson'
+    return item
+
+
+def create_table(dynamodb: Any) -> Any:
+    # Note this must reflect the table defined in template.yml
+    table = dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'partKey', 'KeyType': 'HASH'},
+                   {'AttributeName': 'sortKey', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'partKey', 'AttributeType': 'S'},
+                              {'AttributeName': 'sortKey', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST')
+    table.meta.client.get_waiter('table_exists').wait(TableName=TABLE_NAME)
+    return table
+
+
+def seed(table: Any, accounts: int, perAccount: int, approvedRatio: float, rand: random.Random) -> int:
+    """
+    Writes accounts x perAccount exception items, approvedRatio of them approved
+    :return: number of items written
+    """
+    written = 0
+    with table.batch_writer() as batch:
+        for a in range(accounts):
+            for i in range(perAccount):
+                batch.put_item(Item=exception_item(account_id(a), i, rand.random() < approvedRatio))
+                written += 1
+    return written
+
+
+@contextlib.contextmanager
+def collecting() -> Iterator[metrics.Metrics]:
+    # the handlers record into the invocation metrics, the EMF line itself isn't wanted here
+    with mock.patch.dict(os.environ, {metrics.METRICS_ENABLED_ENV: 'false'}):
+        with metrics.invocation('BenchExceptions') as collected:
+            yield collected
+
+
+class OperationStats:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.items = 0
+        self.pages = 0
+        self.readCapacity = 0.0
+
+    def record(self, seconds: float, status: Optional[int] = None) -> None:
+        self.latencies.append(seconds)
+        if status is not None:
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def report(self) -> Dict[str, Any]:
+        calls = len(self.latencies)
+        stats: Dict[str, Any] = {
+            'calls': calls,
+            'p50Ms': percentile(self.latencies, 50) * 1000,
+            'p95Ms': percentile(self.latencies, 95) * 1000,
+            'p99Ms': percentile(self.latencies, 99) * 1000,
+            'maxMs': max(self.latencies, default=0.0) * 1000
+        }
+        if self.statuses:
+            stats['statusCodes'] = self.statuses
+        if self.pages:
+            stats['itemsPerCall'] = self.items / calls
+            stats['pagesPerCall'] = self.pages / calls
+            stats['readCapacityPerCall'] = self.readCapacity / calls
+        return stats
+
+
+def timed_handler(stats: OperationStats, handler: Callable[..., Dict[str, Any]], body: Any, dynamodb: Any) -> None:
+    start = time.perf_counter()
+    response = handler({'body': json.dumps(body)}, {}, dynamodb)
+    stats.record(time.perf_counter() - start, response['statusCode'])
+
+
+def run(dynamodb: Any, accounts: int, perAccount: int, approvedRatio: float, queries: int, writes: int,
+        seedValue: int = 0) -> Dict[str, Any]:
+    rand = random.Random(seedValue)
+    table = create_table(dynamodb)
+
+    start = time.perf_counter()
+    seeded = seed(table, accounts, perAccount, approvedRatio, rand)
+    seedSeconds = time.perf_counter() - start
+
+    query = OperationStats('get_approved_exceptions')
+    for _ in range(queries):
+        with collecting() as collected:
+            start = time.perf_counter()
+            approved = exceptions.get_approved_exceptions(account_id(rand.randrange(accounts)), dynamodb)
+            query.record(time.perf_counter() - start)
+        query.items += len(approved)
+        query.pages += int(collected.counters.get('ExceptionsQueryPages', 0))
+        query.readCapacity += collected.counters.get('ExceptionsReadCapacity', 0)
+
+    # request -> approve -> delete new exceptions, on top of the seeded volume
+    requestStats, approveStats, deleteStats = (OperationStats(name) for name in ('request', 'approve', 'delete'))
+    for i in range(writes):
+        accountId = account_id(rand.randrange(accounts))
+        item = exception_item(accountId, perAccount + i, False)
+        timed_handler(requestStats, exceptions.request, [{
+            'awsAccountId': accountId, 'filename': item['filename'], 'ruleId': item['ruleId'],
+            'requestReason': item['requestReason'], 'requestedBy': item['requestedBy']}], dynamodb)
+        key = {'awsAccountId': accountId, 'filename': item['filename'], 'ruleId': item['ruleId']}
+        timed_handler(approveStats, exceptions.approve, dict(key, approvedBy='H Simpson'), dynamodb)
+        timed_handler(deleteStats, exceptions.delete, key, dynamodb)
+
+    table.delete()
+    return {
+        'seed': {'items': seeded, 'seconds': seedSeconds,
+                 'itemsPerSecond': seeded / seedSeconds if seedSeconds else 0.0},
+        'operations': {stats.name: stats.report() for stats in (query, requestStats, approveStats, deleteStats)}
+    }
+
+
+def benchmark(accounts: int, perAccount: int, approvedRatio: float = 0.5, queries: int = 50, writes: int = 20,
+              endpointUrl: Optional[str] = None, seedValue: int = 0) -> Dict[str, Any]:
+    """
+    Runs the load test against moto, or the DynamoDB endpoint if given
+    """
+    env = mock.patch.dict(os.environ, {'EXCEPTIONS_TABLENAME': TABLE_NAME, 'AWS_REGION': REGION})
+    if endpointUrl:
+        with env:
+            dynamodb = boto3.resource('dynamodb', region_name=REGION, endpoint_url=endpointUrl)
+            return run(dynamodb, accounts, perAccount, approvedRatio, queries, writes, seedValue)
+
+    with env, mock_dynamodb2():
+        dynamodb = boto3.resource('dynamodb', region_name=REGION)
+        return run(dynamodb, accounts, perAccount, approvedRatio, queries, writes, seedValue)
+
+
+def format_report(stats: Dict[str, Any]) -> str:
+    seeded = stats['seed']
+    lines = [f"seeded:      {seeded['items']} items in {seeded['seconds']:.1f}s ({seeded['itemsPerSecond']:.0f}/s)"]
+    for name, op in stats['operations'].items():
+        line = (f"{name + ':':<25}{op['calls']} calls  p50 {op['p50Ms']:.1f}ms  p95 {op['p95Ms']:.1f}ms  "
+                f"p99 {op['p99Ms']:.1f}ms  max {op['maxMs']:.1f}ms")
+        if 'pagesPerCall' in op:
+            line += (f"  {op['itemsPerCall']:.0f} approved/call  {op['pagesPerCall']:.2f} pages/call  "
+                     f"{op['readCapacityPerCall']:.1f} RCU/call")
+        if 'statusCodes' in op:
+            line += f"  status codes {op['statusCodes']}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='bench_exceptions', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=100, help='AWS accounts seeded')
+    parser.add_argument('--exceptions', type=int, default=5000, help='Exceptions seeded per account')
+    parser.add_argument('--approved-ratio', type=float, default=0.5, help='Fraction of seeded exceptions approved')
+    parser.add_argument('--queries', type=int, default=50, help='get_approved_exceptions calls (random accounts)')
+    parser.add_argument('--writes', type=int, default=20, help='request / approve / delete cycles')
+    parser.add_argument('--endpoint-url', help='DynamoDB endpoint, eg. http://localhost:8000 for DynamoDB Local')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='Print the stats as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    exceptions.logger.setLevel(os.environ['LOG_LEVEL'])
+
+    stats = benchmark(args.accounts, args.exceptions, args.approved_ratio, args.queries, args.writes,
+                      args.endpoint_url, args.seed)
+
+    print(json.dumps(stats, indent=2) if args.json else format_report(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Benchmarks the validate path (lambda_handler -> Template Scanner -> Cucumber results) against a local
+CloudConformity stand-in, reporting latency percentiles, throughput and peak memory. Run from the repo root:
+
+    python -m tests.benchmark.bench_validate --templates 20 --sizes 1k,32k,256k --latency 0.2 --jitter 0.05
+
+Templates come from the synthetic generator (tests/benchmark/synthetic.py), and the stand-in answers
+each with its matching scanner response.
+"""
+import argparse
+import contextlib
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from unittest import mock
+
+import boto3
+from moto import mock_dynamodb2
+
+from tests.benchmark import synthetic
+from tests.benchmark.conformity_stub import ConformityStub, StubConfig
+from validate import app, transport
+
+TABLE_NAME = 'BENCH_EXCEPTIONS_TABLE'
+REGION = 'ap-southeast-2'
+
+# rule ids the synthetic scanner responses use, approved exceptions are seeded for these
+RULE_IDS = [ruleId for _, rules in synthetic.RESOURCE_TYPES.values() for ruleId, _, _ in rules]
+
+
+def parse_size(size: str) -> int:
+    """'512' / '32k' / '2m' -> bytes"""
+    size = size.strip().lower()
+    multiplier = {'k': 1024, 'm': 1024 * 1024}.get(size[-1:], 1)
+    return int(float(size.rstrip('km')) * multiplier)
+
+
+def make_templates(templates: int, specs: Sequence[synthetic.TemplateSpec]) -> List[synthetic.SyntheticTemplate]:
+    """
+    'templates' synthetic templates, cycling through 'specs'. Each time round the seeds are moved on, so every
+    template has its own body and is scanned even when identical templates in a request are scanned once
+    """
+    generated = []
+    for i in range(templates):
+        spec = copy.copy(specs[i % len(specs)])
+        spec.seed += i // len(specs) * len(specs)
+        generated.append(synthetic.generate(spec))
+    return generated
+
+
+def make_event(accountId: str, templates: Sequence[synthetic.SyntheticTemplate], version: int = 1) -> Dict[str, Any]:
+    return {
+        'body': json.dumps({
+            'accountId': accountId,
+            'responseVersion': version,
+            'templates': [{'filename': f'template{i}.yml', 'template': template.body}
+                          for i, template in enumerate(templates)]
+        })
+    }
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Nearest rank percentile"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def create_table(dynamodb: Any, accountId: str, exceptions: int) -> None:
+    table = dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'partKey', 'KeyType': 'HASH'},
+                   {'AttributeName': 'sortKey', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'partKey', 'AttributeType': 'S'},
+                              {'AttributeName': 'sortKey', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST')
+    with table.batch_writer() as batch:
+        for i in range(exceptions):
+            batch.put_item(Item={'partKey': accountId, 'sortKey': f'template{i}.yml#{RULE_IDS[i % len(RULE_IDS)]}',
+                                 'approved': 'true'})
+
+
+def run(event: Dict[str, Any], iterations: int, warmup: int, dynamodb: Any) -> Dict[str, Any]:
+    """
+    Invokes lambda_handler 'warmup' + 'iterations' times, then once more under tracemalloc
+    (kept out of the timed runs, as tracing slows allocation heavy code down several times)
+    :return: latency / throughput / memory stats
+    """
+    templates = len(json.loads(event['body'])['templates'])
+    statuses: Dict[str, int] = {}
+
+    for _ in range(warmup):
+        app.lambda_handler(event, {}, dynamodb)
+
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = app.lambda_handler(event, {}, dynamodb)
+        latencies.append(time.perf_counter() - start)
+        statuses[str(response['statusCode'])] = statuses.get(str(response['statusCode']), 0) + 1
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    app.lambda_handler(event, {}, dynamodb)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'templatesPerRequest': templates,
+        'requestBytes': len(event['body']),
+        'statusCodes': statuses,
+        'latency': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else 0.0
+        },
+        'throughput': {
+            'requestsPerSecond': iterations / elapsed if elapsed else 0.0,
+            'templatesPerSecond': iterations * templates / elapsed if elapsed else 0.0
+        },
+        'peakMemoryBytes': peak
+    }
+
+
+@contextlib.contextmanager
+def mocked_handler(env: Dict[str, str]) -> Iterator[Any]:
+    """
+    moto DynamoDB, a fixed API key and a fresh Conformity session / accounts cache for the handler
+    :return: DynamoDB resource
+    """
+    with mock_dynamodb2(), \
+            mock.patch.dict(os.environ, dict(env, EXCEPTIONS_TABLENAME=TABLE_NAME, AWS_REGION=REGION, STAGE='bench')), \
+            mock.patch.object(app, 'API_KEY', 'bench-api-key'), \
+            mock.patch.object(app, 'ACCOUNTS_LIST', []):
+        transport.reset()
+        try:
+            yield boto3.resource('dynamodb', region_name=REGION)
+        finally:
+            transport.reset()
+
+
+def benchmark(templates: int, specs: Sequence[synthetic.TemplateSpec], iterations: int = 10, warmup: int = 1,
+              config: Optional[StubConfig] = None, exceptions: int = 10, version: int = 1) -> Dict[str, Any]:
+    """
+    Runs lambda_handler against the stand-in, with DynamoDB mocked by moto
+    :param specs: synthetic template specs, cycled through the templates in each request (see make_templates)
+    """
+    config = config or StubConfig()
+    generated = make_templates(templates, specs)
+    for template in generated:
+        config.responses[template.digest] = template.response
+    awsAccount = config.accounts[0][1] if config.accounts else '111122223333'
+
+    with ConformityStub(config) as stub, mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+        create_table(dynamodb, awsAccount, exceptions)
+
+        stats = run(make_event(awsAccount, generated, version), iterations, warmup, dynamodb)
+        stats['conformityCalls'] = dict(stub.counts)
+        return stats
+
+
+def replay_benchmark(templates: int, specs: Sequence[synthetic.TemplateSpec], cassette: str, speed: float = 1.0,
+                     iterations: int = 10, warmup: int = 1, awsAccount: str = '111122223333', exceptions: int = 10,
+                     version: int = 1) -> Dict[str, Any]:
+    """
+    Runs lambda_handler with Conformity calls replayed from a recorded cassette (see validate.transport),
+    with the recorded response times scaled by 'speed'. No network access is needed.
+    """
+    env = {transport.CONFORMITY_TRANSPORT_ENV: 'replay', transport.CONFORMITY_CASSETTE_ENV: cassette,
+           transport.CONFORMITY_REPLAY_SPEED_ENV: str(speed)}
+    with mocked_handler(env) as dynamodb:
+        create_table(dynamodb, awsAccount, exceptions)
+        return run(make_event(awsAccount, make_templates(templates, specs), version), iterations, warmup, dynamodb)
+
+
+def format_report(stats: Dict[str, Any]) -> str:
+    latency = stats['latency']
+    throughput = stats['throughput']
+    return '\n'.join([
+        f"requests:    {stats['iterations']} x {stats['templatesPerRequest']} templates "
+        f"({stats['requestBytes']} bytes), status codes {stats['statusCodes']}",
+        f"latency:     p50 {latency['p50'] * 1000:.1f}ms  p95 {latency['p95'] * 1000:.1f}ms  "
+        f"p99 {latency['p99'] * 1000:.1f}ms  max {latency['max'] * 1000:.1f}ms",
+        f"throughput:  {throughput['requestsPerSecond']:.2f} requests/s  "
+        f"{throughput['templatesPerSecond']:.2f} templates/s",
+        f"peak memory: {stats['peakMemoryBytes'] / (1024 * 1024):.2f} MB (tracemalloc)",
+    ] + ([f"conformity:  {stats['conformityCalls']}"] if 'conformityCalls' in stats else []))
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='bench_validate', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--templates', type=int, default=10, help='Templates per validate request')
+    parser.add_argument('--sizes', default='1k,32k,256k',
+                        help='Comma separated template sizes (eg. 512,32k,2m), cycled through the templates')
+    parser.add_argument('--resources', help='Comma separated resource counts per template (eg. 50,500), '
+                                            'instead of --sizes')
+    parser.add_argument('--nesting', type=int, default=0, help='Depth of nested Metadata on each resource')
+    parser.add_argument('--duplication', type=float, default=0.0, help='Fraction of copy-pasted resources')
+    parser.add_argument('--format', choices=['yaml', 'json'], default='yaml', help='Template format')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed lambda_handler invocations')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed invocations before measuring')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean Conformity response time (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- seconds of uniform jitter')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of scans answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of scans answered with 429')
+    parser.add_argument('--exceptions', type=int, default=10, help='Approved exceptions seeded for the account')
+    parser.add_argument('--response-version', type=int, default=1, choices=[1, 2])
+    parser.add_argument('--replay', metavar='CASSETTE',
+                        help='Replay Conformity responses from a recorded cassette instead of the local stand-in')
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help='Scale recorded response times when replaying, eg. 0.5 for twice as fast, 0 for no delay')
+    parser.add_argument('--account-id', default='111122223333', help='AWS account id sent when replaying')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='Print the stats as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    # the handler logs every request at INFO, keep that out of the measurements (and the report)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    app.logger.setLevel(os.environ['LOG_LEVEL'])
+    # EMF metric lines would be interleaved with the report
+    os.environ.setdefault('METRICS_ENABLED', 'false')
+
+    config = StubConfig(latency=args.latency, jitter=args.jitter, errorRate=args.error_rate,
+                        throttleRate=args.throttle_rate, seed=args.seed)
+    if args.resources:
+        specs = [synthetic.TemplateSpec(resources=int(count), nesting=args.nesting, duplication=args.duplication,
+                                        format=args.format, seed=args.seed + i)
+                 for i, count in enumerate(args.resources.split(','))]
+    else:
+        specs = [synthetic.TemplateSpec(targetBytes=parse_size(size), nesting=args.nesting,
+                                        duplication=args.duplication, format=args.format, seed=args.seed + i)
+                 for i, size in enumerate(args.sizes.split(','))]
+    if args.replay:
+        stats = replay_benchmark(args.templates, specs, args.replay, args.replay_speed, args.iterations, args.warmup,
+                                 args.account_id, args.exceptions, args.response_version)
+    else:
+        stats = benchmark(args.templates, specs, args.iterations, args.warmup, config, args.exceptions,
+                          args.response_version)
+
+    print(json.dumps(stats, indent=2) if args.json else format_report(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Local stand-in for the CloudConformity API, used by the benchmarks. Serves
+    POST /v1/template-scanner/scan
+    GET  /v1/accounts
+with configurable latency, jitter and error / throttling (429) rates, so the validate
+path can be measured without network access or Conformity quota.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+SCAN_PATH = '/v1/template-scanner/scan'
+ACCOUNTS_PATH = '/v1/accounts'
+
+# risk levels handed out to synthetic checks, roughly the mix seen from real scans
+RISK_LEVELS = ['VERY_HIGH', 'HIGH', 'MEDIUM', 'MEDIUM', 'LOW', 'LOW', 'LOW']
+
+
+class StubConfig:
+    """
+    :param latency: mean response time in seconds
+    :param jitter: +/- seconds added uniformly to latency
+    :param errorRate: fraction (0.0 - 1.0) of scans answered with a 500
+    :param throttleRate: fraction (0.0 - 1.0) of scans answered with a 429
+    :param bytesPerCheck: one check is returned per this many template bytes (at least one per scan)
+    :param failureRate: fraction of returned checks with status FAILURE
+    :param accounts: (Conformity account id, AWS account id) pairs returned from /v1/accounts
+    :param responses: sha256 of template contents -> scan response, eg. from synthetic.generate(),
+                      templates not in here get checks generated from their size
+    :param seed: seeds the random latency / errors / check outcomes, so runs are repeatable
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, errorRate: float = 0.0,
+                 throttleRate: float = 0.0, bytesPerCheck: int = 512, failureRate: float = 0.3,
+                 accounts: Optional[List[List[str]]] = None, responses: Optional[Dict[str, Dict[str, Any]]] = None,
+                 seed: int = 0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.throttleRate = throttleRate
+        self.bytesPerCheck = bytesPerCheck
+        self.failureRate = failureRate
+        self.accounts = accounts if accounts is not None else [['BenchAcc01', '111122223333']]
+        self.responses = responses if responses is not None else {}
+        self.seed = seed
+
+
+def scan_response(contents: str, config: StubConfig, rand: random.Random) -> Dict[str, Any]:
+    """
+    Synthetic Template Scanner response, with a check count proportional to the template size
+    """
+    checks = []
+    for i in range(max(1, len(contents) // config.bytesPerCheck)):
+        ruleId = f'BENCH-{i % 100:03d}'
+        status = 'FAILURE' if rand.random() < config.failureRate else 'SUCCESS'
+        checks.append({
+            "type": "checks",
+            "id": f'ccc:BenchAcc01:{ruleId}:Bench:us-east-1:Resource{i}',
+            "attributes": {
+                "region": "us-east-1",
+                "status": status,
+                "risk-level": RISK_LEVELS[i % len(RISK_LEVELS)],
+                "message": f'Resource{i} checked against {ruleId}',
+                "resource": f'Resource{i}',
+                "rule-title": f'Benchmark rule {ruleId}'
+            },
+            "relationships": {
+                "rule": {"data": {"type": "rules", "id": ruleId}}
+            }
+        })
+    return {"data": checks}
+
+
+def accounts_response(config: StubConfig) -> Dict[str, Any]:
+    return {"data": [{"type": "accounts", "id": ccAccount, "attributes": {"awsaccount-id": awsAccount}}
+                     for ccAccount, awsAccount in config.accounts]}
+
+
+class ConformityStub:
+    """
+    Runs the stand-in on a background thread. Use as a context manager:
+        with ConformityStub(StubConfig(latency=0.2)) as stub:
+            os.environ['CONFORMITY_API_URL'] = stub.url
+    """
+
+    def __init__(self, config: StubConfig, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.config = config
+        self.counts: Dict[str, int] = {'scan': 0, 'accounts': 0, 'errors': 0, 'throttled': 0}
+        self._rand = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'ConformityStub':
+        # a short poll interval, so stop() doesn't wait out the default half second
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'ConformityStub':
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _draw(self) -> float:
+        with self._lock:
+            return self._rand.random()
+
+    def _delay(self) -> None:
+        config = self.config
+        if config.latency or config.jitter:
+            with self._lock:
+                delay = config.latency + self._rand.uniform(-config.jitter, config.jitter)
+            time.sleep(max(0.0, delay))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _reply(self, status: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/vnd.api+json')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 429:
+                    self.send_header('Retry-After', '1')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path != ACCOUNTS_PATH:
+                    self._reply(404, {"errors": [{"status": 404, "detail": "Not Found"}]})
+                    return
+                stub._count('accounts')
+                stub._delay()
+                self._reply(200, accounts_response(stub.config))
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path != SCAN_PATH:
+                    self._reply(404, {"errors": [{"status": 404, "detail": "Not Found"}]})
+                    return
+                stub._count('scan')
+                stub._delay()
+
+                draw = stub._draw()
+                if draw < stub.config.throttleRate:
+                    stub._count('throttled')
+                    self._reply(429, {"errors": [{"status": 429, "detail": "Too Many Requests"}]})
+                    return
+                if draw < stub.config.throttleRate + stub.config.errorRate:
+                    stub._count('errors')
+                    self._reply(500, {"errors": [{"status": 500, "detail": "Internal Server Error"}]})
+                    return
+
+                contents = json.loads(body)['data']['attributes']['contents']
+                response = stub.config.responses.get(hashlib.sha256(contents.encode('utf-8')).hexdigest())
+                if response is None:
+                    with stub._lock:
+                        response = scan_response(contents, stub.config, stub._rand)
+                self._reply(200, response)
+
+        return Handler
@@ -0,0 +1,438 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Deterministic synthetic CloudFormation templates, with matching Template Scanner responses, for scale tests.
+The same spec (and seed) always produces byte identical output. Templates use intrinsic functions
+(!Ref / !GetAtt / !Sub) in YAML, or their long form in JSON, the same as real stacks.
+
+    python -m tests.benchmark.synthetic --resources 500 --count 3 --out build/synthetic
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+REGION = 'us-east-1'
+ACCOUNT = 'SyntheticAcc'
+
+RISK_TITLES = {'VERY_HIGH': 'Very High', 'HIGH': 'High', 'MEDIUM': 'Medium', 'LOW': 'Low'}
+
+
+class Intrinsic:
+    """A CloudFormation intrinsic function, eg. Intrinsic('Ref', 'MyBucket')"""
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name: str, value: Any) -> None:
+        self.name = name
+        self.value = value
+
+    def long_form(self) -> Dict[str, Any]:
+        key = 'Ref' if self.name == 'Ref' else f'Fn::{self.name}'
+        return {key: self.value}
+
+
+def ref(logicalId: str) -> Intrinsic:
+    return Intrinsic('Ref', logicalId)
+
+
+def get_att(logicalId: str, attribute: str) -> Intrinsic:
+    return Intrinsic('GetAtt', [logicalId, attribute])
+
+
+def sub(value: str) -> Intrinsic:
+    return Intrinsic('Sub', value)
+
+
+# Resource properties: (rand, logical id, earlier logical ids by type) -> Properties
+PropertiesFactory = Callable[[random.Random, str, Dict[str, List[str]]], Dict[str, Any]]
+
+
+def _bucket(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    properties: Dict[str, Any] = {
+        'BucketName': sub(f'${{AWS::StackName}}-{name.lower()}'),
+        'VersioningConfiguration': {'Status': rand.choice(['Enabled', 'Suspended'])},
+        'BucketEncryption': {'ServerSideEncryptionConfiguration': [
+            {'ServerSideEncryptionByDefault': {'SSEAlgorithm': rand.choice(['AES256', 'aws:kms'])}}]}
+    }
+    if rand.random() < 0.2:
+        properties['AccessControl'] = 'PublicRead'
+    return properties
+
+
+def _security_group(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    return {
+        'GroupDescription': f'{name} security group',
+        'VpcId': ref('VpcId'),
+        'SecurityGroupIngress': [
+            {'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port,
+             'CidrIp': rand.choice(['0.0.0.0/0', '10.0.0.0/8', '172.16.0.0/12'])}
+            for port in rand.sample([22, 80, 443, 3306, 5432, 6379, 8080], rand.randint(1, 4))
+        ]
+    }
+
+
+def _role(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    return {
+        'AssumeRolePolicyDocument': {
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': {'Service': 'lambda.amazonaws.com'},
+                           'Action': 'sts:AssumeRole'}]
+        },
+        'Policies': [{
+            'PolicyName': f'{name}Policy',
+            'PolicyDocument': {
+                'Version': '2012-10-17',
+                'Statement': [{'Effect': 'Allow',
+                               'Action': rand.sample(['s3:GetObject', 's3:PutObject', 'sqs:SendMessage',
+                                                      'dynamodb:Query', 'kms:Decrypt', '*'], 2),
+                               'Resource': rand.choice(['*', sub('arn:aws:s3:::${AWS::StackName}-*')])}]
+            }
+        }]
+    }
+
+
+def _function(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    properties: Dict[str, Any] = {
+        'Runtime': rand.choice(['python3.8', 'python3.9', 'nodejs14.x']),
+        'Handler': 'app.handler',
+        'MemorySize': rand.choice([128, 256, 512, 1024]),
+        'Timeout': rand.choice([3, 30, 300]),
+        'Code': {'ZipFile': 'def handler(event, context):\n    return event\n'},
+        'Environment': {'Variables': {'STAGE': ref('Stage'), 'LOG_LEVEL': 'INFO'}}
+    }
+    if existing.get('AWS::IAM::Role'):
+        properties['Role'] = get_att(rand.choice(existing['AWS::IAM::Role']), 'Arn')
+    return properties
+
+
+def _table(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    return {
+        'BillingMode': rand.choice(['PAY_PER_REQUEST', 'PROVISIONED']),
+        'KeySchema': [{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        'AttributeDefinitions': [{'AttributeName': 'pk', 'AttributeType': 'S'},
+                                 {'AttributeName': 'sk', 'AttributeType': 'S'}],
+        'PointInTimeRecoverySpecification': {'PointInTimeRecoveryEnabled': rand.random() < 0.5}
+    }
+
+
+def _queue(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    properties: Dict[str, Any] = {'VisibilityTimeout': rand.choice([30, 60, 900]),
+                                  'MessageRetentionPeriod': 345600}
+    if rand.random() < 0.5:
+        properties['KmsMasterKeyId'] = 'alias/aws/sqs'
+    return properties
+
+
+def _topic(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    properties: Dict[str, Any] = {'TopicName': sub(f'${{AWS::StackName}}-{name.lower()}')}
+    if existing.get('AWS::SQS::Queue'):
+        properties['Subscription'] = [{'Protocol': 'sqs',
+                                       'Endpoint': get_att(rand.choice(existing['AWS::SQS::Queue']), 'Arn')}]
+    return properties
+
+
+def _key(rand: random.Random, name: str, existing: Dict[str, List[str]]) -> Dict[str, Any]:
+    return {
+        'Description': f'{name} key',
+        'EnableKeyRotation': rand.random() < 0.5,
+        'KeyPolicy': {'Version': '2012-10-17',
+                      'Statement': [{'Effect': 'Allow', 'Principal': {'AWS': sub('arn:aws:iam::${AWS::AccountId}:root')},
+                                     'Action': 'kms:*', 'Resource': '*'}]}
+    }
+
+
+# Resource type -> (properties factory, [(rule id, rule title, risk level)] the scanner checks it against)
+RESOURCE_TYPES: Dict[str, Tuple[PropertiesFactory, List[Tuple[str, str, str]]]] = {
+    'AWS::S3::Bucket': (_bucket, [
+        ('S3-001', "S3 Bucket Public 'READ' Access", 'VERY_HIGH'),
+        ('S3-013', 'S3 Bucket MFA Delete Enabled', 'LOW'),
+        ('S3-014', 'S3 Bucket Public Access Via Policy', 'VERY_HIGH'),
+        ('S3-016', 'Server Side Encryption', 'HIGH'),
+        ('S3-023', 'S3 Object Lock', 'LOW')]),
+    'AWS::EC2::SecurityGroup': (_security_group, [
+        ('EC2-001', 'Default Security Group Unrestricted', 'HIGH'),
+        ('EC2-004', 'Unrestricted SSH Access', 'HIGH'),
+        ('EC2-033', 'Unrestricted Security Group Ingress', 'MEDIUM')]),
+    'AWS::IAM::Role': (_role, [
+        ('IAM-045', 'IAM Role Policy Too Permissive', 'VERY_HIGH'),
+        ('IAM-049', 'Cross-Account Access Lacks External ID and MFA', 'MEDIUM')]),
+    'AWS::Lambda::Function': (_function, [
+        ('Lambda-001', 'Using An IAM Role For More Than One Lambda Function', 'MEDIUM'),
+        ('Lambda-003', 'Enable Encryption at Rest for Environment Variables using Customer Master Keys', 'MEDIUM'),
+        ('Lambda-007', 'Lambda Functions Should Use Supported Runtimes', 'HIGH'),
+        ('Lambda-009', 'Tracing Enabled', 'LOW')]),
+    'AWS::DynamoDB::Table': (_table, [
+        ('DynamoDB-002', 'DynamoDB Continuous Backups', 'MEDIUM'),
+        ('DynamoDB-004', 'Enable Encryption at Rest with Amazon KMS Keys', 'HIGH')]),
+    'AWS::SQS::Queue': (_queue, [
+        ('SQS-003', 'Queue Server Side Encryption', 'HIGH'),
+        ('SQS-004', 'SQS Encrypted With KMS Customer Master Keys', 'HIGH')]),
+    'AWS::SNS::Topic': (_topic, [
+        ('SNS-001', 'SNS Topic Accessible For Publishing', 'VERY_HIGH'),
+        ('SNS-005', 'Server Side Encryption', 'HIGH')]),
+    'AWS::KMS::Key': (_key, [
+        ('KMS-003', 'Key Rotation Enabled', 'MEDIUM'),
+        ('KMS-006', 'KMS Key Exposed', 'VERY_HIGH')])
+}
+
+
+class TemplateSpec:
+    """
+    :param resources: number of resources (ignored if targetBytes is set)
+    :param targetBytes: add resources until the template is at least this big
+    :param mix: resource type -> relative weight, defaults to an even mix of RESOURCE_TYPES
+    :param nesting: depth of the nested Metadata added to every resource (deeply nested documents stress parsers)
+    :param duplication: fraction (0.0 - 1.0) of resources that are copies of an earlier resource of the same type
+    :param failureRate: fraction of checks in the scanner response with status FAILURE
+    :param format: 'yaml' or 'json'
+    :param seed: all randomness is drawn from this seed
+    """
+
+    def __init__(self, resources: int = 50, targetBytes: Optional[int] = None, mix: Optional[Dict[str, float]] = None,
+                 nesting: int = 0, duplication: float = 0.0, failureRate: float = 0.3, format: str = 'yaml',
+                 seed: int = 0) -> None:
+        if format not in ('yaml', 'json'):
+            raise ValueError(f'Unsupported template format {format}')
+        unknown = set(mix or {}) - set(RESOURCE_TYPES)
+        if unknown:
+            raise ValueError(f'Unsupported resource types {sorted(unknown)}, expected {list(RESOURCE_TYPES)}')
+        self.resources = resources
+        self.targetBytes = targetBytes
+        self.mix = mix or dict.fromkeys(RESOURCE_TYPES, 1.0)
+        self.nesting = nesting
+        self.duplication = duplication
+        self.failureRate = failureRate
+        self.format = format
+        self.seed = seed
+
+
+class SyntheticTemplate:
+    """A generated template, and the Template Scanner response it should get"""
+    __slots__ = ('body', 'resources', 'response')
+
+    def __init__(self, body: str, resources: List[Tuple[str, str]], response: Dict[str, Any]) -> None:
+        self.body = body
+        # (logical id, resource type) in template order
+        self.resources = resources
+        self.response = response
+
+    @property
+    def digest(self) -> str:
+        return content_digest(self.body)
+
+    def failures(self) -> Dict[str, int]:
+        """Failed checks per risk level in the response"""
+        counts: Dict[str, int] = dict.fromkeys(RISK_TITLES, 0)
+        for check in self.response['data']:
+            if check['attributes']['status'] == 'FAILURE':
+                counts[check['attributes']['risk-level']] += 1
+        return counts
+
+
+def content_digest(body: str) -> str:
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _metadata(rand: random.Random, depth: int) -> Dict[str, Any]:
+    node: Dict[str, Any] = {'Owner': rand.choice(['platform', 'payments', 'search', 'data']),
+                            'Tier': rand.randint(1, 3)}
+    if depth > 1:
+        node['Nested'] = _metadata(rand, depth - 1)
+    return node
+
+
+def generate(spec: TemplateSpec) -> SyntheticTemplate:
+    rand = random.Random(spec.seed)
+    types = list(spec.mix)
+    weights = [spec.mix[resourceType] for resourceType in types]
+    existing: Dict[str, List[str]] = {}
+    resources: Dict[str, Dict[str, Any]] = {}
+    order: List[Tuple[str, str]] = []
+    size = 0
+
+    while (size < spec.targetBytes) if spec.targetBytes else (len(order) < spec.resources):
+        resourceType = rand.choices(types, weights)[0]
+        index = len(order)
+        logicalId = f'{resourceType.split("::")[-1]}{index:04d}'
+        earlier = existing.get(resourceType)
+        if earlier and rand.random() < spec.duplication:
+            # copy-pasted resource: identical properties, different logical id
+            resource = json.loads(json.dumps(resources[rand.choice(earlier)], default=_long_form),
+                                  object_hook=_short_form)
+        else:
+            resource = {'Type': resourceType, 'Properties': RESOURCE_TYPES[resourceType][0](rand, logicalId, existing)}
+            if spec.nesting:
+                resource['Metadata'] = _metadata(rand, spec.nesting)
+        resources[logicalId] = resource
+        existing.setdefault(resourceType, []).append(logicalId)
+        order.append((logicalId, resourceType))
+        if spec.targetBytes:
+            # YAML size, JSON templates come out somewhat bigger
+            size += len(_render_yaml({logicalId: resource}, 1))
+
+    template: Dict[str, Any] = {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Description': f'Synthetic template, {len(order)} resources (seed {spec.seed})',
+        'Parameters': {'Stage': {'Type': 'String', 'Default': 'dev'},
+                       'VpcId': {'Type': 'AWS::EC2::VPC::Id'}},
+        'Resources': resources
+    }
+    if spec.format == 'json':
+        body = json.dumps(template, indent=2, default=_long_form)
+    else:
+        body = _render_yaml(template, 0)
+
+    return SyntheticTemplate(body, order, scan_response(order, spec.failureRate, rand))
+
+
+def scan_response(resources: Sequence[Tuple[str, str]], failureRate: float, rand: random.Random) -> Dict[str, Any]:
+    """
+    Template Scanner response for the resources, in the same shape as tests/payloads/templatescanner_response.json
+    """
+    checks = []
+    for logicalId, resourceType in resources:
+        service = resourceType.split('::')[1]
+        for ruleId, title, riskLevel in RESOURCE_TYPES[resourceType][1]:
+            failed = rand.random() < failureRate
+            checks.append({
+                "type": "checks",
+                "id": f'ccc:{ACCOUNT}:{ruleId}:{service}:{REGION}:{logicalId}',
+                "attributes": {
+                    "region": REGION,
+                    "status": 'FAILURE' if failed else 'SUCCESS',
+                    "risk-level": riskLevel,
+                    "pretty-risk-level": RISK_TITLES[riskLevel],
+                    "message": f'{logicalId} {"fails" if failed else "passes"} {title}',
+                    "resource": logicalId,
+                    "descriptorType": resourceType.split('::')[-1].lower(),
+                    "categories": ["security"],
+                    "compliances": ["AWAF"],
+                    "last-updated-date": None,
+                    "tags": [],
+                    "cost": 0,
+                    "waste": 0,
+                    "not-scored": False,
+                    "ignored": False,
+                    "rule-title": title,
+                    "provider": "aws",
+                    "resolution-page-url": f'https://www.cloudconformity.com/knowledge-base/aws/{service}/'
+                },
+                "relationships": {
+                    "rule": {"data": {"type": "rules", "id": ruleId}},
+                    "account": {"data": {"type": "accounts", "id": ACCOUNT}}
+                }
+            })
+    return {"data": checks}
+
+
+def _long_form(value: Any) -> Any:
+    if isinstance(value, Intrinsic):
+        return value.long_form()
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def _short_form(node: Dict[str, Any]) -> Any:
+    # inverse of _long_form, so copied resources keep the short (!Tag) form in YAML
+    if len(node) == 1:
+        key, value = next(iter(node.items()))
+        if key == 'Ref':
+            return Intrinsic('Ref', value)
+        if key.startswith('Fn::'):
+            return Intrinsic(key[4:], value)
+    return node
+
+
+def _scalar(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if value is None:
+        return 'null'
+    text = str(value)
+    if '\n' in text:
+        return json.dumps(text)
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _intrinsic(value: Intrinsic) -> str:
+    if isinstance(value.value, list):
+        if value.name == 'GetAtt':
+            return f'!GetAtt {".".join(value.value)}'
+        return f'!{value.name} [{", ".join(_scalar(item) for item in value.value)}]'
+    return f'!{value.name} {value.value if value.name == "Ref" else _scalar(value.value)}'
+
+
+def _render_yaml(node: Any, indent: int) -> str:
+    """Block style YAML for dicts / lists of scalars and intrinsics (all a CloudFormation template needs)"""
+    pad = '  ' * indent
+    lines: List[str] = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if isinstance(value, Intrinsic):
+                lines.append(f'{pad}{key}: {_intrinsic(value)}\n')
+            elif isinstance(value, (dict, list)) and value:
+                lines.append(f'{pad}{key}:\n{_render_yaml(value, indent + 1)}')
+            else:
+                lines.append(f'{pad}{key}: {_scalar(value) if not isinstance(value, (dict, list)) else json.dumps(value)}\n')
+    else:
+        for item in node:
+            if isinstance(item, Intrinsic):
+                lines.append(f'{pad}- {_intrinsic(item)}\n')
+            elif isinstance(item, (dict, list)) and item:
+                rendered = _render_yaml(item, indent + 1)
+                # first key on the same line as the dash
+                lines.append(f'{pad}- {rendered[len(pad) + 2:]}')
+            else:
+                lines.append(f'{pad}- {_scalar(item)}\n')
+    return ''.join(lines)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """'AWS::S3::Bucket=3,AWS::IAM::Role=1' -> weights"""
+    weights = {}
+    for part in mix.split(','):
+        resourceType, _, weight = part.partition('=')
+        weights[resourceType.strip()] = float(weight or 1)
+    return weights
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='synthetic', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resources', type=int, default=50, help='Resources per template')
+    parser.add_argument('--target-bytes', type=int, help='Grow templates to this size instead of --resources')
+    parser.add_argument('--mix', help=f'Resource type weights, eg. AWS::S3::Bucket=3,AWS::IAM::Role=1. '
+                                      f'Types: {", ".join(RESOURCE_TYPES)}')
+    parser.add_argument('--nesting', type=int, default=0, help='Depth of nested Metadata on each resource')
+    parser.add_argument('--duplication', type=float, default=0.0, help='Fraction of copy-pasted resources')
+    parser.add_argument('--failure-rate', type=float, default=0.3, help='Fraction of failed checks in responses')
+    parser.add_argument('--format', choices=['yaml', 'json'], default='yaml')
+    parser.add_argument('--count', type=int, default=1, help='Number of templates (seeds seed .. seed + count - 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='synthetic', help='Directory for the templates and *.response.json files')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    os.makedirs(args.out, exist_ok=True)
+    for i in range(args.count):
+        spec = TemplateSpec(args.resources, args.target_bytes, parse_mix(args.mix) if args.mix else None,
+                            args.nesting, args.duplication, args.failure_rate, args.format, args.seed + i)
+        template = generate(spec)
+        name = os.path.join(args.out, f'synthetic{args.seed + i:04d}')
+        with open(f'{name}.{args.format}', 'w') as f:
+            f.write(template.body)
+        with open(f'{name}.response.json', 'w') as f:
+            json.dump(template.response, f, indent=2)
+        print(f'{name}.{args.format}: {len(template.resources)} resources, {len(template.body)} bytes, '
+              f'failures {template.failures()}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,13 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import hashlib
+import json
+import os
+import threading
+
 import boto3
+import requests_mock
+
 
 # Note this must reflect the table defined in template.yml
 def createExceptionsTable(tableName, dynamodb=None):
@@ -40,3 +47,83 @@ def createExceptionsTable(tableName, dynamodb=None):
     assert table.table_status == 'ACTIVE'
 
     return table
+
+
+# the fake Conformity API's base URL, see FakeConformity
+CONFORMITY_API_URL = 'https://conformity.unit.test'
+SCAN_PATH = '/v1/template-scanner/scan'
+ACCOUNTS_PATH = '/v1/accounts'
+SCAN_RESPONSE = os.path.join(os.path.dirname(__file__), '..', 'payloads', 'templatescanner_response.json')
+
+
+class FakeConformity:
+    """
+    In-process stand-in for the CloudConformity API at CONFORMITY_API_URL, for the handler tests (the
+    benchmarks use the HTTP stub in tests/benchmark/conformity_stub.py). Use as a context manager:
+        with FakeConformity(responses) as fake:
+            os.environ['CONFORMITY_API_URL'] = fake.url
+    :param responses: sha256 of template contents -> scan response, templates not in here are answered with
+                      tests/payloads/templatescanner_response.json
+    :param accounts: (Conformity account id, AWS account id) pairs returned from /v1/accounts
+    :param hold: if given, scans after the first wait until it is set (or the fake is closed), so they are
+                 still running while the first scan's result is handled
+    """
+
+    def __init__(self, responses=None, accounts=None, hold=None):
+        self.url = CONFORMITY_API_URL
+        self.responses = responses if responses is not None else {}
+        self.accounts = accounts if accounts is not None else [['UnitAcc01', '111122223333']]
+        self.hold = hold
+        # answered calls, as the stub's counts
+        self.counts = {'scan': 0, 'accounts': 0}
+        self._requests = 0
+        self._inFlight = 0
+        self._idle = threading.Condition()
+        self._mocker = requests_mock.Mocker(real_http=True)
+        self._mocker.post(CONFORMITY_API_URL + SCAN_PATH, json=self._scan)
+        self._mocker.get(CONFORMITY_API_URL + ACCOUNTS_PATH, json=self._accounts)
+
+    def start(self):
+        self._mocker.start()
+        return self
+
+    def stop(self):
+        # let held scans finish before their requests stop being mocked
+        if self.hold is not None:
+            self.hold.set()
+        with self._idle:
+            self._idle.wait_for(lambda: self._inFlight == 0, timeout=5)
+        self._mocker.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _scan(self, request, context):
+        with self._idle:
+            self._requests += 1
+            self._inFlight += 1
+            first = self._requests == 1
+        try:
+            if self.hold is not None and not first:
+                self.hold.wait(5)
+            contents = request.json()['data']['attributes']['contents']
+            response = self.responses.get(hashlib.sha256(contents.encode('utf-8')).hexdigest())
+            if response is None:
+                with open(SCAN_RESPONSE) as f:
+                    response = json.load(f)
+            with self._idle:
+                self.counts['scan'] += 1
+            return response
+        finally:
+            with self._idle:
+                self._inFlight -= 1
+                self._idle.notify_all()
+
+    def _accounts(self, request, context):
+        with self._idle:
+            self.counts['accounts'] += 1
+        return {"data": [{"type": "accounts", "id": ccAccount, "attributes": {"awsaccount-id": awsAccount}}
+                         for ccAccount, awsAccount in self.accounts]}
@@ -0,0 +1,160 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+import threading
+from pathlib import Path
+from unittest import TestCase, mock
+
+from validate import app, backends, serialization
+from validate.results import CheckResult, ResultStore
+from tests.benchmark import bench_validate
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+OPEN_BUCKET = (Path(__file__).parent.parent / 'payloads' / 'openS3bucket.yaml').read_text()
+CONTEXT = backends.ScanContext(AWS_ACCOUNT, '', ['t.yml'])
+
+
+class FakeBackend(backends.Backend):
+    name = 'fake'
+    title = 'Fake'
+
+    def __init__(self, checks=(), barrier=None, error=None):
+        self.checks = list(checks)
+        self.barrier = barrier
+        self.error = error
+
+    def scan(self, template, context):
+        if self.barrier is not None:
+            self.barrier.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.checks
+
+
+def store_of(*results):
+    store = ResultStore(app.FAILURE_FILTER)
+    for riskLevel, result in results:
+        store.add(riskLevel, result)
+    return store
+
+
+class TestBackends(TestCase):
+
+    def tearDown(self):
+        backends.reset()
+
+    def test_risk_level(self):
+        self.assertEqual(backends.risk_level('error'), 'HIGH')
+        self.assertEqual(backends.risk_level('Warning'), 'MEDIUM')
+        self.assertEqual(backends.risk_level('very-high'), 'VERY_HIGH')
+        self.assertEqual(backends.risk_level('informational'), 'LOW')
+        self.assertEqual(backends.risk_level('whatever'), 'LOW')
+
+    def test_run_concurrently(self):
+        # both scans must be running at once to get past the barrier
+        barrier = threading.Barrier(2)
+        first = FakeBackend(barrier=barrier)
+        second = FakeBackend([backends.Check('x', 'X-1', 'X', 'LOW', 'x')], barrier)
+        self.assertEqual(backends.run([first, second], '{}', CONTEXT), [[], second.checks])
+
+    def test_failed_backend(self):
+        backend = FakeBackend(error=RuntimeError('boom'))
+        result, = backends.run([backend], '{}', CONTEXT)
+        store = ResultStore(app.FAILURE_FILTER)
+        backends.report(backend, result, 't.yml', store, {})
+        self.assertEqual(store.failures['VERY_HIGH'], 1)
+        self.assertEqual(store.groups['VERY_HIGH'][0].message, 'Fake could not scan the template: boom')
+
+    def test_report_exceptions(self):
+        backend = FakeBackend()
+        checks = [backends.Check('fake-1', 'F-1', 'One', 'HIGH', 'one'),
+                  backends.Check('fake-2', 'F-2', 'Two', 'LOW', 'two')]
+        store = ResultStore(app.FAILURE_FILTER)
+        backend.report(checks, 't.yml', store, {'t.yml#F-2': {}})
+        self.assertEqual([(r.id, r.status, r.message) for r in store.groups['HIGH'] + store.groups['LOW']],
+                         [('fake-1', 'failed', 'F-1: one'), ('fake-2', 'skipped', 'F-2: two')])
+        self.assertEqual(store.failures, {'VERY_HIGH': 0, 'HIGH': 1, 'MEDIUM': 0, 'LOW': 0})
+
+    def test_merge(self):
+        conformity = store_of(('HIGH', CheckResult('c1', 'Bucket', 'S3-001: open', 't.yml', 'failed', 'S3-001')),
+                              ('LOW', CheckResult('c2', 'Tags', 'RG-001: tags', 't.yml', 'passed', 'RG-001')))
+        local = store_of(('VERY_HIGH', CheckResult('l1', 'Bucket', 'PRE-001: open', 't.yml', 'failed', 'PRE-001')),
+                         ('HIGH', CheckResult('l2', 'Port', 'PRE-002: ssh', 't.yml', 'failed', 'PRE-002')))
+        merged = ResultStore(app.FAILURE_FILTER)
+        backends.merge([conformity, local], merged)
+        # in backend order, the same problem found by both engines is reported by each
+        self.assertEqual({level: [r.id for r in results] for level, results in merged.groups.items()},
+                         {'HIGH': ['c1', 'l2'], 'LOW': ['c2'], 'VERY_HIGH': ['l1']})
+        self.assertEqual(merged.failures, {'VERY_HIGH': 1, 'HIGH': 2, 'MEDIUM': 0, 'LOW': 0})
+
+    def test_merge_duplicate_ids(self):
+        repeated = CheckResult('cfnlint-E3012-4', 'Type', 'E3012: wrong type (line 4)', 't.yml', 'failed', 'E3012')
+        lint = store_of(('HIGH', repeated), ('HIGH', repeated))
+        other = store_of(('HIGH', repeated), ('LOW', CheckResult('l1', 'Tags', 'PRE-009: tags', 't.yml', 'failed')))
+        merged = ResultStore(app.FAILURE_FILTER)
+        backends.merge([lint, other], merged)
+        self.assertEqual({level: [r.id for r in results] for level, results in merged.groups.items()},
+                         {'HIGH': ['cfnlint-E3012-4'], 'LOW': ['l1']})
+        self.assertEqual(merged.failures, {'VERY_HIGH': 0, 'HIGH': 1, 'MEDIUM': 0, 'LOW': 1})
+
+    def test_backend_is_abstract(self):
+        self.assertRaises(TypeError, backends.Backend)
+
+    def test_merge_nothing_found(self):
+        merged = ResultStore(app.FAILURE_FILTER)
+        backends.merge([ResultStore(app.FAILURE_FILTER), ResultStore(app.FAILURE_FILTER)], merged)
+        self.assertEqual(len(merged), 0)
+
+    def test_options(self):
+        self.assertEqual(app.scanner_options({}, []), (['conformity'], []))
+        self.assertEqual(app.scanner_options({'prescan': 'skipRemote', 'scanners': ['conformity', 'conformity']}, []),
+                         (['prescan', 'conformity'], ['VERY_HIGH']))
+        with mock.patch.dict(os.environ, {backends.SCANNER_BACKENDS_ENV: 'prescan, conformity'}):
+            self.assertEqual(app.scanner_options({}, []), (['prescan', 'conformity'], []))
+        for scanners in ([], 'conformity', ['nope']):
+            self.assertRaises(serialization.InvalidRequestError, app.scanner_options, {'scanners': scanners}, [])
+        with mock.patch.object(backends.CfnLintBackend, 'available', return_value=False):
+            self.assertRaises(serialization.InvalidRequestError, app.scanner_options, {'scanners': ['cfnlint']}, [])
+
+
+class TestBackendRequests(TestCase):
+
+    def tearDown(self):
+        backends.reset()
+
+    def validate(self, env=None, **options):
+        event = {'body': json.dumps(dict({'accountId': AWS_ACCOUNT, 'responseVersion': 2, 'templates': [
+            {'filename': 'bucket.yaml', 'template': OPEN_BUCKET}]}, **options))}
+        fake = FakeBackend([backends.Check('fake-F-1', 'F-1', 'Fake rule', backends.risk_level('error'), 'found')])
+        with helpers.FakeConformity() as stub, \
+                mock.patch.dict(backends.BACKENDS, {'fake': fake}), \
+                bench_validate.mocked_handler(dict({'CONFORMITY_API_URL': stub.url}, **(env or {}))) as dynamodb:
+            bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+            response = app.lambda_handler(event, {}, dynamodb)
+            scans = stub.counts['scan']
+        body = json.loads(response['body'])
+        checks = {element['id']: (feature['name'], element['steps'][0]['result']['status'])
+                  for feature in body.get('results', []) for element in feature['elements']}
+        return response['statusCode'], body, checks, scans
+
+    def test_several_backends(self):
+        status, body, checks, scans = self.validate(scanners=['conformity', 'fake'])
+        self.assertEqual(status, 200)
+        self.assertEqual(scans, 1)
+        self.assertEqual(checks['fake-F-1'], ('HIGH', 'failed'))
+        self.assertGreater(len(checks), 1)
+        _, conformityOnly, _, _ = self.validate()
+        self.assertEqual(body['failures']['HIGH'], conformityOnly['failures']['HIGH'] + 1)
+
+    def test_default_backends(self):
+        status, _, checks, scans = self.validate({backends.SCANNER_BACKENDS_ENV: 'fake'})
+        self.assertEqual(status, 200)
+        self.assertEqual(scans, 0)
+        self.assertEqual(checks, {'fake-F-1': ('HIGH', 'failed')})
+
+    def test_unknown_backend(self):
+        status, body, _, _ = self.validate(scanners=['conformity', 'nope'])
+        self.assertEqual(status, 400)
+        self.assertIn('Unknown scanner nope', body['message'])
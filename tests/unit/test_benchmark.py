@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+from unittest import TestCase
+
+import requests
+
+from tests.benchmark import bench_exceptions, bench_validate
+from tests.benchmark.synthetic import TemplateSpec
+from tests.benchmark.conformity_stub import ConformityStub, StubConfig, SCAN_PATH, ACCOUNTS_PATH
+
+
+def scan(url, contents):
+    return requests.post(url + SCAN_PATH, data=json.dumps({'data': {'attributes': {'contents': contents}}}))
+
+
+class TestConformityStub(TestCase):
+
+    def test_scan_response_size(self):
+        with ConformityStub(StubConfig(bytesPerCheck=100)) as stub:
+            resp = scan(stub.url, 'x' * 1000)
+            self.assertEqual(resp.status_code, 200)
+            checks = resp.json()['data']
+            self.assertEqual(len(checks), 10)
+            self.assertEqual(checks[0]['relationships']['rule']['data']['id'], 'BENCH-000')
+            self.assertEqual(stub.counts['scan'], 1)
+
+    def test_throttle_and_errors(self):
+        with ConformityStub(StubConfig(throttleRate=1.0)) as stub:
+            resp = scan(stub.url, 'x')
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(resp.headers['Retry-After'], '1')
+            self.assertEqual(resp.json()['errors'][0]['detail'], 'Too Many Requests')
+
+        with ConformityStub(StubConfig(errorRate=1.0)) as stub:
+            self.assertEqual(scan(stub.url, 'x').status_code, 500)
+            self.assertEqual(stub.counts['errors'], 1)
+
+    def test_accounts(self):
+        with ConformityStub(StubConfig(accounts=[['CC1', '123456789012']])) as stub:
+            resp = requests.get(stub.url + ACCOUNTS_PATH)
+            self.assertEqual(resp.json()['data'][0]['attributes']['awsaccount-id'], '123456789012')
+            self.assertEqual(requests.get(stub.url + '/v1/other').status_code, 404)
+
+
+class TestBenchmark(TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(bench_validate.parse_size('512'), 512)
+        self.assertEqual(bench_validate.parse_size('32k'), 32 * 1024)
+        self.assertEqual(bench_validate.parse_size('2m'), 2 * 1024 * 1024)
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(bench_validate.percentile(samples, 50), 50)
+        self.assertEqual(bench_validate.percentile(samples, 99), 99)
+        self.assertEqual(bench_validate.percentile([3.0], 95), 3.0)
+
+    def test_benchmark_drives_handler(self):
+        specs = [TemplateSpec(resources=5), TemplateSpec(targetBytes=2048, seed=1)]
+        stats = bench_validate.benchmark(3, specs, iterations=2, warmup=0, config=StubConfig(throttleRate=0.5))
+        self.assertEqual(stats['statusCodes'], {'200': 2})
+        # 2 timed + 1 traced invocation, 3 templates each, the repeated first spec with a body of its own
+        self.assertEqual(stats['conformityCalls']['scan'], 9)
+        self.assertEqual(stats['conformityCalls']['accounts'], 1)
+        self.assertGreater(stats['peakMemoryBytes'], 0)
+        self.assertLessEqual(stats['latency']['p50'], stats['latency']['p99'])
+
+
+class TestExceptionsBenchmark(TestCase):
+
+    def test_benchmark_exceptions(self):
+        stats = bench_exceptions.benchmark(accounts=2, perAccount=20, approvedRatio=0.5, queries=4, writes=2)
+        self.assertEqual(stats['seed']['items'], 40)
+
+        operations = stats['operations']
+        query = operations['get_approved_exceptions']
+        self.assertEqual(query['calls'], 4)
+        self.assertGreater(query['itemsPerCall'], 0)
+        self.assertLess(query['itemsPerCall'], 20)
+        self.assertGreaterEqual(query['pagesPerCall'], 1)
+        self.assertEqual(operations['request']['statusCodes'], {'201': 2})
+        self.assertEqual(operations['approve']['statusCodes'], {'201': 2})
+        self.assertEqual(operations['delete']['statusCodes'], {'200': 2})
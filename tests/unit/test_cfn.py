@@ -0,0 +1,45 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from unittest import TestCase
+
+from validate import cfn
+
+YAML_TEMPLATE = """
+AWSTemplateFormatVersion: 2010-09-09
+Conditions:
+  IsProd: !Equals [!Ref Stage, prod]
+Resources:
+  Bucket:
+    Type: AWS::S3::Bucket
+    Condition: IsProd
+    Properties:
+      BucketName: !Sub '${AWS::StackName}-bucket'
+      Tags:
+        - Key: Arn
+          Value: !GetAtt Role.Arn
+        - Key: Joined
+          Value: !Join ['-', [!Ref Stage, !Select [0, !GetAZs '']]]
+"""
+
+
+class TestParse(TestCase):
+
+    def test_yaml_short_form(self):
+        template = cfn.parse(YAML_TEMPLATE)
+        self.assertEqual(template['AWSTemplateFormatVersion'], '2010-09-09')
+        self.assertEqual(template['Conditions']['IsProd'], {'Fn::Equals': [{'Ref': 'Stage'}, 'prod']})
+        properties = template['Resources']['Bucket']['Properties']
+        self.assertEqual(properties['BucketName'], {'Fn::Sub': '${AWS::StackName}-bucket'})
+        self.assertEqual(properties['Tags'][0]['Value'], {'Fn::GetAtt': ['Role', 'Arn']})
+        self.assertEqual(properties['Tags'][1]['Value'],
+                         {'Fn::Join': ['-', [{'Ref': 'Stage'}, {'Fn::Select': [0, {'Fn::GetAZs': ''}]}]]})
+
+    def test_json(self):
+        self.assertEqual(cfn.parse(' {"Resources": {"A": {"Type": "AWS::SNS::Topic"}}}'),
+                         {'Resources': {'A': {'Type': 'AWS::SNS::Topic'}}})
+
+    def test_invalid(self):
+        self.assertRaises(cfn.TemplateParseError, cfn.parse, '{"Resources": ')
+        self.assertRaises(cfn.TemplateParseError, cfn.parse, 'Resources: [')
+        self.assertRaises(cfn.TemplateParseError, cfn.parse, '- just a list')
+        self.assertRaises(cfn.TemplateParseError, cfn.parse, '---')
@@ -0,0 +1,224 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import base64
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+import requests
+
+from validate import app, client, serialization
+from validate.results import ResultStore
+
+
+class FakeValidateApi(BaseHTTPRequestHandler):
+    """
+    Stands in for the Validate API: every template gets the sample scanner
+    results, and each request gets an 'account not monitored' failure
+    """
+    requests = []
+
+    def do_POST(self):
+        if self.path != '/validate':
+            self.send_error(404)
+            return
+
+        # decode/encode bodies the way the validate function does behind API Gateway
+        self.event = {
+            'headers': dict(self.headers),
+            'body': base64.b64encode(self.rfile.read(int(self.headers['Content-Length']))).decode('ascii'),
+            'isBase64Encoded': True
+        }
+        body = json.loads(serialization.load_request_body(self.event))
+        FakeValidateApi.requests.append(body)
+
+        store = ResultStore(app.FAILURE_FILTER)
+        app.extract_account({}, store)
+        if body.get('describeOnly'):
+            responseBody = app.build_describe_body('', self.server.exceptionList, body['templates'], store)
+            self.respond(responseBody)
+            return
+
+        for entry in body['templates']:
+            response = requests.Response()
+            response.status_code = self.server.scanStatus
+            response._content = (self.server.scannerResponse if self.server.scanStatus == 200 else
+                                 json.dumps({'errors': [{'detail': 'Server error'}]})).encode('utf-8')
+            app.process_scan_response(response, entry['filename'], store, self.server.exceptionList)
+
+        self.respond(app.build_response_body(body.get('responseVersion', 1), 'cucumber', store))
+
+    def respond(self, body: str):
+        response = serialization.encode_response(self.event, {'statusCode': 200, 'body': body})
+        if response.get('isBase64Encoded'):
+            responseBody = base64.b64decode(response['body'])
+        else:
+            responseBody = response['body'].encode('utf-8')
+        self.send_response(200)
+        for header, value in response.get('headers', {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(responseBody)))
+        self.end_headers()
+        self.wfile.write(responseBody)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestClient(TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeValidateApi)
+        with open("tests/payloads/templatescanner_response.json") as scannerAPIfile:
+            cls.server.scannerResponse = scannerAPIfile.read()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/validate'
+        return super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+        return super().tearDownClass()
+
+    def setUp(self) -> None:
+        FakeValidateApi.requests = []
+        self.server.exceptionList = {}
+        self.server.scanStatus = 200
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        for relpath in ['a.yml', 'b.yaml', 'notes.txt', 'nested/c.json', 'nested/deep/d.template',
+                        'node_modules/e.yml', 'params.json']:
+            path = os.path.join(self.root, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write("AWSTemplateFormatVersion: '2010-09-09'\n")
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        return super().tearDown()
+
+    # Templates in sub directories are found, non-template files and ignored paths are not
+    def test_discover_recursive_with_ignores(self):
+        with open(os.path.join(self.root, '.validateignore'), 'w') as f:
+            f.write('# dependencies\nnode_modules/\n')
+
+        ignore = client.load_ignore_patterns(self.root, ['params.json'])
+        templates = client.discover_templates(self.root, ignore)
+
+        self.assertEqual([t.filename for t in templates], ['a.yml', 'b.yaml', 'nested/c.json', 'nested/deep/d.template'])
+
+    def test_chunking(self):
+        templates = [client.Template(f'{i}.yml', '', size) for i, size in enumerate([40, 40, 30, 100, 10])]
+
+        chunks = client.chunk_templates(templates, 100)
+
+        self.assertEqual([[t.filename for t in chunk] for chunk in chunks], [['0.yml', '1.yml'], ['2.yml'], ['3.yml'], ['4.yml']])
+
+    # When templates are split across several requests
+    # Then results are merged into one report, with request level checks only reported once
+    def test_main_merges_chunks(self):
+        output = os.path.join(self.root, 'results.json')
+
+        exitCode = client.main([
+            '--path', self.root, '--url', self.url, '--account-id', '010120201234',
+            '--ignore', 'node_modules', '--ignore', 'params.json',
+            '--max-chunk-bytes', '50', '--workers', '3', '--output', output, '--no-cache'])
+
+        self.assertEqual(len(FakeValidateApi.requests), 4)
+        self.assertTrue(all(r['accountId'] == '010120201234' and r['responseVersion'] == 2 for r in FakeValidateApi.requests))
+
+        with open(output) as f:
+            results = json.load(f)
+        veryHigh = next(feature for feature in results if feature['name'] == 'VERY_HIGH')
+        failed = [e['steps'][0]['keyword'] for e in veryHigh['elements'] if e['steps'][0]['result']['status'] == 'failed']
+        self.assertEqual(failed.count(': '), 1)
+        self.assertEqual(failed.count('nested/c.json: '), 2)
+
+        # 4 templates x 2 VERY_HIGH failures, plus the account check
+        self.assertEqual(exitCode, 255)
+        merged = client.merge_responses([{'results': results}])
+        self.assertEqual(merged['failures']['VERY_HIGH'], 9)
+
+    # When the merged responses list risk levels in different orders (eg. cached results first)
+    # Then the merged features are highest severity first, then PASSED
+    def test_merge_order(self):
+        def response(*riskLevels):
+            return {'results': [{'name': riskLevel, 'elements': []} for riskLevel in riskLevels]}
+
+        merged = client.merge_responses([response('LOW', 'PASSED'), response('EXEMPTED', 'VERY_HIGH', 'HIGH')])
+        self.assertEqual([feature['name'] for feature in merged['results']],
+                         ['VERY_HIGH', 'HIGH', 'LOW', 'PASSED', 'EXEMPTED'])
+
+    def test_api_error(self):
+        exitCode = client.main(['--path', self.root, '--url', self.url.replace('/validate', '/missing'),
+                                '--output', os.path.join(self.root, 'results.json'), '--no-cache'])
+        self.assertEqual(exitCode, 255)
+
+    def run_cached(self):
+        FakeValidateApi.requests = []
+        output = os.path.join(self.root, 'results.json')
+        client.main(['--path', self.root, '--url', self.url, '--ignore', 'node_modules', '--ignore', 'params.json',
+                     '--cache-dir', os.path.join(self.root, 'cache'), '--ignore', 'cache', '--ignore', 'results.json',
+                     '--output', output])
+        scanned = sorted(t['filename'] for r in FakeValidateApi.requests if not r.get('describeOnly') for t in r['templates'])
+        with open(output) as f:
+            return scanned, client.merge_responses([{'results': json.load(f)}])['failures']
+
+    # When templates haven't changed since the last build
+    # Then only changed templates, or templates whose exceptions changed, are scanned again
+    def test_cache(self):
+        scanned, failures = self.run_cached()
+        self.assertEqual(scanned, ['a.yml', 'b.yaml', 'nested/c.json', 'nested/deep/d.template'])
+
+        scanned, cachedFailures = self.run_cached()
+        self.assertEqual(scanned, [])
+        self.assertEqual(cachedFailures, failures)
+
+        with open(os.path.join(self.root, 'b.yaml'), 'a') as f:
+            f.write('Resources: {}\n')
+        self.server.exceptionList = {'a.yml#S3-013': {}}
+
+        scanned, changedFailures = self.run_cached()
+        self.assertEqual(scanned, ['a.yml', 'b.yaml'])
+        self.assertEqual(changedFailures['LOW'], failures['LOW'] - 1)
+
+    # When Conformity couldn't scan the templates
+    # Then the error isn't cached, and the next build scans them again
+    def test_cache_skips_errors(self):
+        self.server.scanStatus = 500
+        scanned, failures = self.run_cached()
+        self.assertEqual(len(scanned), 4)
+        self.assertEqual(failures['VERY_HIGH'], 5)
+
+        self.server.scanStatus = 200
+        scanned, failures = self.run_cached()
+        self.assertEqual(scanned, ['a.yml', 'b.yaml', 'nested/c.json', 'nested/deep/d.template'])
+        self.assertEqual(failures['VERY_HIGH'], 9)
+
+        scanned, _ = self.run_cached()
+        self.assertEqual(scanned, [])
+
+    # When gzip is enabled
+    # Then bodies are compressed both ways, and chunks over the limit once compressed are split
+    def test_gzip(self):
+        output = os.path.join(self.root, 'results.json')
+
+        exitCode = client.main(['--path', self.root, '--url', self.url, '--ignore', 'node_modules', '--ignore', 'params.json',
+                                '--max-chunk-bytes', '100', '--output', output, '--no-cache'])
+
+        self.assertEqual(exitCode, 255)
+        self.assertEqual(sorted(t['filename'] for r in FakeValidateApi.requests for t in r['templates']),
+                         ['a.yml', 'b.yaml', 'nested/c.json', 'nested/deep/d.template'])
+        with open(output) as f:
+            self.assertEqual(client.merge_responses([{'results': json.load(f)}])['failures']['VERY_HIGH'], 9)
+
+        uncompressed = client.ValidateClient(self.url, compress=False)
+        self.assertNotIn('Accept-Encoding', uncompressed.headers)
+        self.assertEqual(json.loads(uncompressed.encode({'templates': []})), {'templates': []})
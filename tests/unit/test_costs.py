@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+from unittest import TestCase, mock
+
+from validate import app, costs, scheduler
+from tests.benchmark import bench_validate, synthetic
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+
+
+class TestCostModel(TestCase):
+
+    def test_predict_from_size(self):
+        model = costs.CostModel()
+        self.assertGreater(model.predict(AWS_ACCOUNT, 'big.yml', 2_000_000), model.predict(AWS_ACCOUNT, 'a.yml', 1000))
+        # learns the average rate from every scan
+        model.observe(AWS_ACCOUNT, 'a.yml', 1000, 1.0)
+        self.assertGreater(model.secondsPerByte, costs.DEFAULT_SECONDS_PER_BYTE)
+        self.assertAlmostEqual(model.predict(AWS_ACCOUNT, 'new.yml', 1000), 1000 * model.secondsPerByte)
+
+    def test_per_file_history(self):
+        model = costs.CostModel()
+        # a small template that is slow to scan (eg. many resources that need remote lookups)
+        model.observe(AWS_ACCOUNT, 'slow.yml', 1000, 8.0)
+        self.assertEqual(model.predict(AWS_ACCOUNT, 'slow.yml', 1000), 8.0)
+        self.assertEqual(model.predict(AWS_ACCOUNT, 'slow.yml', 2000), 16.0)
+        self.assertLess(model.predict('444455556666', 'slow.yml', 1000), 8.0)
+
+        model.observe(AWS_ACCOUNT, 'slow.yml', 2000, 4.0)
+        self.assertAlmostEqual(model.predict(AWS_ACCOUNT, 'slow.yml', 2000), 0.3 * 4.0 + 0.7 * 16.0)
+
+    def test_history_bounded(self):
+        model = costs.CostModel(maxFiles=2)
+        for filename in ('a.yml', 'b.yml', 'c.yml'):
+            model.observe(AWS_ACCOUNT, filename, 100, 5.0)
+        self.assertEqual(model.predict(AWS_ACCOUNT, 'c.yml', 100), 5.0)
+        self.assertNotEqual(model.predict(AWS_ACCOUNT, 'a.yml', 100), 5.0)
+
+        sizeOnly = costs.CostModel(maxFiles=0)
+        sizeOnly.observe(AWS_ACCOUNT, 'a.yml', 100, 5.0)
+        self.assertEqual(sizeOnly.predict(AWS_ACCOUNT, 'a.yml', 100), 100 * sizeOnly.secondsPerByte)
+
+
+class TestScanOrder(TestCase):
+
+    def setUp(self) -> None:
+        scheduler.reset()
+        costs.reset()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        scheduler.reset()
+        costs.reset()
+        return super().tearDown()
+
+    def test_longest_first(self):
+        templates = [synthetic.generate(synthetic.TemplateSpec(resources=resources, seed=resources))
+                     for resources in (2, 20, 5, 10)]
+        responses = {t.digest: t.response for t in templates}
+        event = bench_validate.make_event(AWS_ACCOUNT, templates)
+
+        def scan_order():
+            scanned = []
+            scan = app.scan_shared_template
+
+            def record(targets, *args):
+                scanned.append(targets[0][0])
+                return scan(targets, *args)
+
+            with helpers.FakeConformity(responses) as stub, \
+                    mock.patch.object(app, 'scan_shared_template', record), \
+                    bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url, 'SCAN_CONCURRENCY': '1'}) as dynamodb:
+                bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+                response = app.lambda_handler(event, {}, dynamodb)
+            self.assertEqual(response['statusCode'], 200)
+            return scanned, json.loads(response['body'])
+
+        scanned, body = scan_order()
+        self.assertEqual(scanned, ['template1.yml', 'template3.yml', 'template2.yml', 'template0.yml'])
+        # results are still in template order
+        keywords = [step['keyword'] for feature in json.loads(body['results']) for element in feature['elements']
+                    for step in element['steps']]
+        for level in json.loads(body['results']):
+            files = [element['steps'][0]['keyword'] for element in level['elements']]
+            self.assertEqual(files, sorted(files))
+        self.assertEqual(len(keywords), sum(len(t.response['data']) for t in templates))
+
+        # template0.yml turns out to be the slowest to scan
+        costs.model().observe(AWS_ACCOUNT, 'template0.yml', len(templates[0].body), 60.0)
+        scanned, _ = scan_order()
+        self.assertEqual(scanned[0], 'template0.yml')
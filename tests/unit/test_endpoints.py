@@ -0,0 +1,147 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import os
+from unittest import TestCase, mock
+
+import requests
+import requests_mock
+
+from validate import endpoints, metrics, transport
+
+WEST = 'https://us-west-2-api.cloudconformity.com'
+EAST = 'https://us-east-1-api.cloudconformity.com'
+EU = 'https://eu-west-1-api.cloudconformity.com'
+
+
+class TestEndpoints(TestCase):
+
+    def setUp(self) -> None:
+        transport.reset()
+        endpoints.reset()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        transport.reset()
+        endpoints.reset()
+        return super().tearDown()
+
+    def test_endpoint_urls(self):
+        with mock.patch.dict(os.environ, {'AWS_REGION': 'ap-southeast-2'}, clear=True):
+            self.assertEqual(endpoints.endpoint_urls(), ['https://ap-southeast-2-api.cloudconformity.com'])
+        with mock.patch.dict(os.environ, {'AWS_REGION': 'ap-southeast-2', 'CONFORMITY_API_URL': 'http://localhost:9000'},
+                             clear=True):
+            self.assertEqual(endpoints.endpoint_urls(), ['http://localhost:9000'])
+        with mock.patch.dict(os.environ, {'CONFORMITY_API_URL': 'http://localhost:9000',
+                                          'CONFORMITY_ENDPOINTS': 'us-west-2, http://localhost:9001,'}, clear=True):
+            self.assertEqual(endpoints.endpoint_urls(), [WEST, 'http://localhost:9001'])
+
+    def test_routes_to_fastest(self):
+        router = endpoints.Router([WEST, EAST])
+        self.assertEqual([e.url for e in router.candidates()], [WEST, EAST])
+
+        router.endpoints[0].record_success(0.5)
+        router.endpoints[1].record_success(0.1)
+        self.assertEqual([e.url for e in router.candidates()], [EAST, WEST])
+
+        # moving average, one fast call doesn't undo a slow history
+        router.endpoints[0].record_success(0.01)
+        self.assertEqual([e.url for e in router.candidates()], [EAST, WEST])
+
+    def test_failover(self):
+        router = endpoints.Router([WEST, EAST, EU])
+        with requests_mock.Mocker() as mocked, metrics.invocation('Test', out=open(os.devnull, 'w')) as current:
+            mocked.get(WEST + '/v1/accounts', exc=requests.ConnectTimeout)
+            mocked.get(EAST + '/v1/accounts', status_code=503)
+            mocked.get(EU + '/v1/accounts', json={'data': []})
+
+            resp = router.request('GET', '/v1/accounts', headers={'Authorization': 'ApiKey x'})
+
+            self.assertEqual(resp.json(), {'data': []})
+            self.assertEqual([r.url for r in mocked.request_history],
+                             [WEST + '/v1/accounts', EAST + '/v1/accounts', EU + '/v1/accounts'])
+            self.assertEqual(current.timings()['counters']['EndpointFailovers'], 2)
+
+        # the healthy endpoint is tried first from then on
+        self.assertEqual(router.candidates()[0].url, EU)
+        self.assertEqual([s['errorRate'] for s in router.stats()], [1.0, 1.0, 0.0])
+
+    def test_client_errors_not_retried(self):
+        router = endpoints.Router([WEST, EAST])
+        with requests_mock.Mocker() as mocked:
+            mocked.post(WEST + '/v1/template-scanner/scan', status_code=422)
+            self.assertEqual(router.request('POST', '/v1/template-scanner/scan').status_code, 422)
+            self.assertEqual(mocked.call_count, 1)
+
+    def test_all_failed(self):
+        router = endpoints.Router([WEST, EAST])
+        with requests_mock.Mocker() as mocked:
+            mocked.get(WEST + '/v1/accounts', status_code=500)
+            mocked.get(EAST + '/v1/accounts', status_code=429)
+            self.assertEqual(router.request('GET', '/v1/accounts').status_code, 429)
+
+            mocked.get(WEST + '/v1/accounts', exc=requests.ConnectionError)
+            mocked.get(EAST + '/v1/accounts', exc=requests.ConnectionError)
+            self.assertRaises(requests.ConnectionError, router.request, 'GET', '/v1/accounts')
+
+    def test_ejection_and_cooldown(self):
+        west = endpoints.Endpoint(WEST, cooldown=60)
+        self.assertFalse(west.record_failure(0.1, now=100))
+        self.assertFalse(west.record_failure(0.1, now=100))
+        self.assertTrue(west.record_failure(0.1, now=100))
+        self.assertFalse(west.healthy(159))
+        self.assertTrue(west.healthy(160))
+
+        # back in rotation after the cool down, but a single failure takes it straight back out
+        self.assertTrue(west.record_failure(0.1, now=160))
+        self.assertFalse(west.healthy(161))
+
+        east = endpoints.Endpoint(EAST)
+        # or too many errors, even if not in a row
+        outcomes = [east.record_failure(0.1, now=0) if i % 2 == 0 else east.record_success(0.1) for i in range(5)]
+        self.assertEqual(outcomes, [False, None, False, None, True])
+
+    def test_rejected_key_fails_over(self):
+        # the key is for another region: not a healthy endpoint, the next one is tried
+        router = endpoints.Router([WEST, EAST])
+        with requests_mock.Mocker() as mocked:
+            mocked.get(WEST + '/v1/accounts', status_code=401)
+            mocked.get(EAST + '/v1/accounts', json={'data': []})
+
+            self.assertEqual(router.request('GET', '/v1/accounts').json(), {'data': []})
+            self.assertEqual(router.endpoints[0].error_rate, 1.0)
+            self.assertEqual([e.url for e in router.candidates()], [EAST, WEST])
+
+            # rejected everywhere, the caller gets the last rejection
+            mocked.get(EAST + '/v1/accounts', status_code=403)
+            self.assertEqual(router.request('GET', '/v1/accounts').status_code, 401)
+
+    def test_ejected_tried_last(self):
+        router = endpoints.Router([WEST, EAST])
+        with requests_mock.Mocker() as mocked:
+            mocked.get(WEST + '/v1/accounts', status_code=502)
+            mocked.get(EAST + '/v1/accounts', json={'data': []})
+            router.endpoints[0].latency = 0.01
+            router.endpoints[1].latency = 10.0
+
+            router.request('GET', '/v1/accounts')
+            # the failing endpoint drops behind straight away, even though it is faster
+            self.assertEqual([e.url for e in router.candidates()], [EAST, WEST])
+
+            router.endpoints[0].ejectedUntil = endpoints.time.monotonic() + 60
+            router.endpoints[0].consecutiveFailures = 0
+            self.assertEqual([e.url for e in router.candidates()], [EAST, WEST])
+            mocked.get(EAST + '/v1/accounts', status_code=500)
+            self.assertEqual(router.request('GET', '/v1/accounts').status_code, 502)
+
+    def test_shared_router_follows_settings(self):
+        with mock.patch.dict(os.environ, {'CONFORMITY_ENDPOINTS': 'us-west-2,us-east-1', 'CONFORMITY_TIMEOUT': '5'}):
+            first = endpoints.router()
+            self.assertIs(endpoints.router(), first)
+            self.assertEqual(first.timeout, (endpoints.DEFAULT_CONNECT_TIMEOUT, 5.0))
+        # a hung endpoint is failed over by default
+        with mock.patch.dict(os.environ, {'CONFORMITY_ENDPOINTS': 'us-west-2,us-east-1'}):
+            os.environ.pop('CONFORMITY_TIMEOUT', None)
+            self.assertEqual(endpoints.router().timeout,
+                             (endpoints.DEFAULT_CONNECT_TIMEOUT, endpoints.DEFAULT_READ_TIMEOUT))
+        with mock.patch.dict(os.environ, {'CONFORMITY_ENDPOINTS': 'eu-west-1'}):
+            self.assertEqual([e.url for e in endpoints.router().endpoints], [EU])
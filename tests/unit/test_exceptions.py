@@ -227,3 +227,34 @@ class TestExceptions(TestCase):
         response_body = json.loads(actual_response["body"], strict=False)
 
         return response_body
+
+    def test_get_approved_exceptions__unapproved_first(self):
+        # pending requests have no 'approved' attribute, they mustn't stop approved ones being returned
+        requests = [{"awsAccountId": "010120201234", "filename": f"{i}.yml", "ruleId": "S3-013",
+                     "requestReason": "reason", "requestedBy": "J Doe"} for i in range(3)]
+        addResponse = exceptions.request({"body": json.dumps(requests)}, {}, self.dynamodb)
+        self.assertEqual(addResponse['statusCode'], 201)
+
+        approval = {"awsAccountId": "010120201234", "filename": "2.yml", "ruleId": "S3-013", "approvedBy": "H Simpson"}
+        approvalResponse = exceptions.approve({"body": json.dumps(approval)}, {}, self.dynamodb)
+        self.assertEqual(approvalResponse['statusCode'], 201)
+
+        exceptionsDict = exceptions.get_approved_exceptions("010120201234", self.dynamodb)
+        self.assertEqual(list(exceptionsDict), ["2.yml#S3-013"])
+
+    def test_get_approved_exceptions__paginated(self):
+        pages = [
+            {'Items': [{'sortKey': '1.yml#S3-001', 'approved': 'true'}, {'sortKey': '1.yml#S3-002'}],
+             'LastEvaluatedKey': {'partKey': '010120201234', 'sortKey': '1.yml#S3-002'}},
+            {'Items': [{'sortKey': '2.yml#S3-001', 'approved': 'true'}]}
+        ]
+        dynamodb = mock.Mock()
+        dynamodb.Table.return_value.query.side_effect = pages
+
+        exceptionsDict = exceptions.get_approved_exceptions("010120201234", dynamodb)
+
+        self.assertEqual(sorted(exceptionsDict), ['1.yml#S3-001', '2.yml#S3-001'])
+        queries = dynamodb.Table.return_value.query.call_args_list
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('ExclusiveStartKey', queries[0].kwargs)
+        self.assertEqual(queries[1].kwargs['ExclusiveStartKey'], {'partKey': '010120201234', 'sortKey': '1.yml#S3-002'})
@@ -0,0 +1,77 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import xml.dom.minidom
+from unittest import TestCase
+
+from validate import app, formats
+from validate.results import ResultStore
+from validate.serialization import InvalidRequestError
+
+GOLDEN_DIR = "tests/payloads/golden"
+
+
+def build_store() -> ResultStore:
+    """
+    Results for the sample scanner response, with one approved exception
+    and the account validation failure added by the validate API
+    """
+    store = ResultStore(app.FAILURE_FILTER)
+    app.addTestResult('cloud-conformity-tests', 'AWS account number validation', 'VERY_HIGH',
+                      'AWS account INVALID_ACC_ID is NOT being monitored by Cloud Conformity', '', 'failed', store)
+    with open("tests/payloads/templatescanner_response.json") as scannerAPIfile:
+        app.processScanResults(scannerAPIfile.read(), 'mytemplate.yml', store, {'mytemplate.yml#S3-013': {}})
+    return store
+
+
+class TestOutputFormats(TestCase):
+
+    def setUp(self) -> None:
+        self.store = build_store()
+        return super().setUp()
+
+    def assertGolden(self, fmt: str, filename: str) -> str:
+        with open(f'{GOLDEN_DIR}/{filename}') as goldenFile:
+            golden = goldenFile.read()
+        rendered = formats.render(self.store, fmt)
+        self.assertEqual(rendered, golden)
+        return rendered
+
+    # The streamed Cucumber output must be identical to serialising the nested structure
+    def test_cucumber_golden(self):
+        rendered = self.assertGolden('cucumber', 'templatescanner_response.cucumber.json')
+        self.assertEqual(rendered, json.dumps(self.store.cucumber()))
+
+    def test_junit_golden(self):
+        rendered = self.assertGolden('junit', 'templatescanner_response.junit.xml')
+
+        suites = xml.dom.minidom.parseString(rendered).documentElement
+        self.assertEqual(suites.getAttribute('failures'), str(sum(self.store.failures.values())))
+        self.assertEqual(suites.getAttribute('skipped'), '1')
+
+    def test_sarif_golden(self):
+        rendered = self.assertGolden('sarif', 'templatescanner_response.sarif.json')
+
+        run = json.loads(rendered)['runs'][0]
+        ruleIds = {rule['id'] for rule in run['tool']['driver']['rules']}
+        self.assertTrue(all(result['ruleId'] in ruleIds for result in run['results']))
+        suppressed = [result['ruleId'] for result in run['results'] if 'suppressions' in result]
+        self.assertEqual(suppressed, ['S3-013'])
+
+    def test_output_format_selection(self):
+        self.assertEqual(formats.output_format({}), 'cucumber')
+        self.assertEqual(formats.output_format({'outputFormat': 'JUnit'}), 'junit')
+        self.assertRaises(InvalidRequestError, formats.output_format, {'outputFormat': 'html'})
+
+    # v2 responses nest JSON formats natively, and XML formats as a string
+    def test_v2_response_body(self):
+        sarifBody = json.loads(app.build_response_body(2, 'sarif', self.store))
+        self.assertEqual(sarifBody['format'], 'sarif')
+        self.assertEqual(sarifBody['results']['version'], '2.1.0')
+        self.assertEqual(sarifBody['failures'], self.store.failures)
+
+        junitBody = json.loads(app.build_response_body(2, 'junit', self.store))
+        self.assertTrue(junitBody['results'].startswith('<?xml'))
+
+        v1Body = json.loads(app.build_response_body(1, 'junit', self.store))
+        self.assertEqual(set(v1Body.keys()), {'failures', 'results'})
@@ -1,7 +1,12 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import base64
+import gzip
+import hashlib
 import json
 import os
+import threading
+from concurrent.futures import Future
 from requests import HTTPError
 import requests_mock
 import boto3
@@ -9,7 +14,9 @@ from moto import mock_secretsmanager, mock_dynamodb2
 from unittest import mock
 from unittest import TestCase
 
-from validate import app
+from validate import app, costs, logs, scheduler, serialization
+from tests.benchmark import bench_validate, synthetic
+from validate.results import CheckResult, ResultStore
 import tests.unit.helpers as helpers
 
 
@@ -296,6 +303,28 @@ class TestLambdaFunctions(TestCase):
         self.assertEqual(response_body["failures"]["MEDIUM"], 4)
         self.assertEqual(response_body["failures"]["LOW"], 12)
 
+    # When the log level is INFO
+    # Then the request and the scanner responses are not serialised or hashed for the logs
+    def test_info_logs_skip_payloads(self):
+
+        event = {
+            "body": "{ \"accountId\" : \"010120201234\", \"templates\": [ {\r\n  \r\n  \"filename\" : \"mytemplate.yml\",\r\n  \"template\" : \"---\nAWSTemplateFormatVersion: '2010-09-09'\nResources:\n  S3Bucket:\n    Type: AWS::S3::Bucket\n    Properties:\n      AccessControl: PublicRead\"\r\n} ] }"
+        }
+
+        with requests_mock.Mocker() as mock_request, \
+                mock.patch.object(logs.Summary, '__str__', autospec=True, return_value='') as summary, \
+                mock.patch.object(logs.Dump, '__str__', autospec=True, return_value='') as dump, \
+                mock.patch.object(app, 'API_KEY', 'api-key'), \
+                self.assertLogs('templateScanner', 'INFO') as logged:
+            mock_request.get("https://ap-southeast-2-api.cloudconformity.com/v1/accounts", text=self.responseAccounts)
+            mock_request.post("https://ap-southeast-2-api.cloudconformity.com/v1/template-scanner/scan", text=self.responseCCTemplateScannerAPI)
+            actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        self.assertEqual(actual_response['statusCode'], 200)
+        summary.assert_not_called()
+        dump.assert_not_called()
+        self.assertTrue(any('get_scan_result - response' in line for line in logged.output))
+
     def test_junk_payload(self):
 
         event = {
@@ -311,3 +340,306 @@ class TestLambdaFunctions(TestCase):
 
         self.assertEqual(actual_response['statusCode'], 500)
         self.assertEqual(actual_response['body'], '{"message": "Invalid JSON provided in request"}')
+
+    # When a v2 response is requested in the body
+    # Then results are nested natively rather than as an encoded string
+    def test_lambda_handler__v2_response(self):
+
+        event = {
+            "body": "{ \"accountId\" : \"INVALID_ACC_ID\", \"responseVersion\": 2, \"templates\": [ {\r\n  \r\n  \"filename\" : \"mytemplate.yml\",\r\n  \"template\" : \"---\nAWSTemplateFormatVersion: '2010-09-09'\nResources:\n  S3Bucket:\n    Type: AWS::S3::Bucket\n    Properties:\n      AccessControl: PublicRead\"\r\n} ] }"
+        }
+
+        with requests_mock.Mocker() as mock_request:
+            mock_request.get("https://ap-southeast-2-api.cloudconformity.com/v1/accounts", text=self.responseAccounts)
+            mock_request.post("https://ap-southeast-2-api.cloudconformity.com/v1/template-scanner/scan", text=self.responseCCTemplateScannerAPI)
+            actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        self.assertEqual(actual_response['statusCode'], 200)
+
+        response_body = json.loads(actual_response['body'])
+        validResult = json.loads(self.validS3Response)
+        self.assertEqual(response_body['version'], 2)
+        self.assertEqual(response_body['failures'], validResult['failures'])
+        self.assertEqual(response_body['results'], json.loads(validResult['results']))
+
+    # When a v2 response is requested via the X-Response-Version header
+    # Then results are nested natively
+    def test_lambda_handler__v2_header(self):
+
+        event = {
+            "headers": {"x-response-version": "2"},
+            "body": "{ \"accountId\" : \"010120201234\", \"templates\": [ { \"filename\" : \"mytemplate.yml\", \"template\" : \"---\nAWSTemplateFormatVersion: '2010-09-09'\"} ] }"
+        }
+
+        with requests_mock.Mocker() as mock_request:
+            mock_request.get("https://ap-southeast-2-api.cloudconformity.com/v1/accounts", text=self.responseAccounts)
+            mock_request.post("https://ap-southeast-2-api.cloudconformity.com/v1/template-scanner/scan", text=self.responseCCTemplateScannerAPI)
+            actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        response_body = json.loads(actual_response['body'])
+        self.assertEqual(response_body['version'], 2)
+        self.assertIsInstance(response_body['results'], list)
+        self.assertEqual(response_body['failures']['VERY_HIGH'], 2)
+
+    def test_lambda_handler__unsupported_version(self):
+
+        event = {
+            "body": "{ \"accountId\" : \"010120201234\", \"responseVersion\": 7, \"templates\": [] }"
+        }
+
+        actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        self.assertEqual(actual_response['statusCode'], 400)
+        self.assertIn('Unsupported response version', json.loads(actual_response['body'])['message'])
+
+    # When the request is gzip compressed and the caller accepts gzip
+    # Then the request is decoded, and the response is gzip compressed
+    def test_lambda_handler__gzip(self):
+
+        body = "{ \"accountId\" : \"INVALID_ACC_ID\", \"templates\": [ {\r\n  \r\n  \"filename\" : \"mytemplate.yml\",\r\n  \"template\" : \"---\nAWSTemplateFormatVersion: '2010-09-09'\nResources:\n  S3Bucket:\n    Type: AWS::S3::Bucket\n    Properties:\n      AccessControl: PublicRead\"\r\n} ] }"
+        event = {
+            "headers": {"Content-Encoding": "gzip", "Accept-Encoding": "gzip, deflate"},
+            "isBase64Encoded": True,
+            "body": base64.b64encode(gzip.compress(body.encode('utf-8'))).decode('ascii')
+        }
+
+        with requests_mock.Mocker() as mock_request:
+            mock_request.get("https://ap-southeast-2-api.cloudconformity.com/v1/accounts", text=self.responseAccounts)
+            mock_request.post("https://ap-southeast-2-api.cloudconformity.com/v1/template-scanner/scan", text=self.responseCCTemplateScannerAPI)
+            actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        self.assertEqual(actual_response['statusCode'], 200)
+        self.assertTrue(actual_response['isBase64Encoded'])
+        self.assertEqual(actual_response['headers']['Content-Encoding'], 'gzip')
+
+        results = json.loads(gzip.decompress(base64.b64decode(actual_response['body'])))
+        self.assertDictEqual(results, json.loads(self.validS3Response))
+
+    # When a small gzip body expands past MAX_REQUEST_BYTES
+    # Then it is refused with a 413, without being decompressed in full
+    def test_lambda_handler__gzip_too_large(self):
+
+        event = {
+            "headers": {"Content-Encoding": "gzip"},
+            "isBase64Encoded": True,
+            "body": base64.b64encode(gzip.compress(b' ' * (2 * 1024 * 1024))).decode('ascii')
+        }
+
+        with mock.patch.dict(os.environ, {serialization.MAX_REQUEST_BYTES_ENV: str(1024 * 1024)}):
+            actual_response = app.lambda_handler(event, {}, self.dynamodb)
+
+        self.assertEqual(actual_response['statusCode'], 413)
+        self.assertIn('larger than 1048576 bytes', json.loads(actual_response['body'])['message'])
+
+    # When timings are requested
+    # Then the response carries per phase timings, and the results are unchanged
+    def test_lambda_handler__timings(self):
+
+        event = {
+            "body": "{ \"accountId\" : \"010120201234\", \"includeTimings\": true, \"templates\": [ { \"filename\" : \"a.yml\", \"template\" : \"---\"}, { \"filename\" : \"b.yml\", \"template\" : \"...\"} ] }"
+        }
+
+        with requests_mock.Mocker() as mock_request:
+            mock_request.get("https://ap-southeast-2-api.cloudconformity.com/v1/accounts", text=self.responseAccounts)
+            mock_request.post("https://ap-southeast-2-api.cloudconformity.com/v1/template-scanner/scan", text=self.responseCCTemplateScannerAPI)
+            actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        response_body = json.loads(actual_response['body'])
+        timings = response_body['timings']
+        self.assertEqual(timings['ScanTime']['count'], 2)
+        self.assertEqual(timings['ProcessResultsTime']['count'], 2)
+        self.assertEqual(timings['ExceptionsQueryTime']['count'], 1)
+        self.assertEqual(timings['counters']['Scans'], 2)
+        self.assertEqual(timings['counters']['TemplateBytes'], 6)
+        self.assertEqual(response_body['failures']['VERY_HIGH'], 4)
+
+    # When profiling is enabled for the stage and requested
+    # Then the profile summary is returned with the results
+    def test_lambda_handler__profile(self):
+
+        event = {
+            "headers": {"X-Profile": "response"},
+            "body": "{ \"accountId\" : \"010120201234\", \"templates\": [ { \"filename\" : \"a.yml\", \"template\" : \"---\"} ] }"
+        }
+
+        with requests_mock.Mocker() as mock_request, mock.patch.dict(os.environ, {"PROFILE_STAGES": "dev"}):
+            mock_request.get("https://ap-southeast-2-api.cloudconformity.com/v1/accounts", text=self.responseAccounts)
+            mock_request.post("https://ap-southeast-2-api.cloudconformity.com/v1/template-scanner/scan", text=self.responseCCTemplateScannerAPI)
+            actual_response = invoke_validate_handler(event, self.dynamodb)
+
+        response_body = json.loads(actual_response['body'])
+        self.assertEqual(response_body['failures']['VERY_HIGH'], 2)
+        self.assertTrue(any('(validate)' in row['function'] for row in response_body['profile']['cpu']))
+
+
+class TestFailFast(TestCase):
+
+    def setUp(self) -> None:
+        self.clean = [synthetic.generate(synthetic.TemplateSpec(resources=6, failureRate=0, seed=seed))
+                      for seed in range(10, 13)]
+        self.large = synthetic.generate(synthetic.TemplateSpec(resources=12, failureRate=0.6, seed=0))
+        self.small = synthetic.generate(synthetic.TemplateSpec(resources=2, failureRate=0.6, seed=0))
+        templates = self.clean + [self.large, self.small]
+        self.responses = {t.digest: t.response for t in templates}
+        scheduler.reset()
+        costs.reset()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        scheduler.reset()
+        costs.reset()
+        return super().tearDown()
+
+    def validate(self, templates, hold=None, **options):
+        event = bench_validate.make_event('111122223333', templates, version=2)
+        event['body'] = json.dumps(dict(json.loads(event['body']), **options))
+        # one scan at a time, so the scans after the failing one are still queued
+        with helpers.FakeConformity(self.responses, hold=hold) as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url, 'SCAN_CONCURRENCY': '1'}) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            response = app.lambda_handler(event, {}, dynamodb)
+            scans = stub.counts['scan']
+            # a scan already running when the handler returned finishes against the fake
+            if hold is not None:
+                hold.set()
+            scheduler.reset(wait=True)
+        return response['statusCode'], json.loads(response['body']), scans
+
+    def test_blocking_failure(self):
+        # the largest template is scanned first, wherever it is in the request
+        # the template after the failing one is picked up by the worker, but doesn't finish before the handler returns
+        status, body, scans = self.validate(self.clean + [self.large], hold=threading.Event(), failFast=True)
+        self.assertEqual(status, 200)
+        self.assertTrue(body['partial'])
+        self.assertEqual(scans, 1)
+        self.assertEqual(len(body['notScanned']), 3)
+        self.assertNotIn('template3.yml', body['notScanned'])
+        self.assertEqual(body['notScanned'], sorted(body['notScanned']))
+        self.assertEqual(body['failures']['VERY_HIGH'], self.large.failures()['VERY_HIGH'])
+
+    def test_blocking_failure_last(self):
+        # the failing template is the smallest, so scanned last: nothing is left to cancel
+        status, body, scans = self.validate(self.clean + [self.small], failFast='VERY_HIGH')
+        self.assertEqual(status, 200)
+        self.assertNotIn('partial', body)
+        self.assertEqual(scans, 4)
+
+    def test_finished_scans_reported(self):
+        # a scan that finished before the blocking failure was handled is reported, not listed as not scanned
+        stores = [ResultStore(app.FAILURE_FILTER) for _ in range(3)]
+        stores[0].add('VERY_HIGH', CheckResult('F1', 'Failed check', 'failed', 'a.yml', 'failed'))
+        failing, finished, queued = Future(), Future(), Future()
+        failing.set_result(None)
+        scans = app.TemplateScans(['a.yml', 'b.yml', 'c.yml'], ['', '', ''], stores,
+                                  {failing: [0], finished: [1], queued: [2]})
+
+        def as_completed(futures):
+            # the second scan finishes just after the failing one is picked up
+            finished.set_result(None)
+            yield failing
+
+        failuresList = ResultStore(app.FAILURE_FILTER)
+        with mock.patch.object(app, 'as_completed', as_completed):
+            filenames, notScanned = scans.finish(failuresList, app.ScanOptions('', '', ['VERY_HIGH'], False))
+        self.assertEqual(filenames, ['a.yml', 'b.yml'])
+        self.assertEqual(notScanned, ['c.yml'])
+        self.assertTrue(queued.cancelled())
+
+    def test_severity(self):
+        self.assertEqual(app.fail_fast_levels({}), [])
+        self.assertEqual(app.fail_fast_levels({'failFast': True}), ['VERY_HIGH'])
+        self.assertEqual(app.fail_fast_levels({'failFast': 'HIGH'}), ['VERY_HIGH', 'HIGH'])
+        self.assertRaises(serialization.InvalidRequestError, app.fail_fast_levels, {'failFast': 'CRITICAL'})
+        self.assertRaises(serialization.InvalidRequestError, app.fail_fast_levels, {'failFast': 1})
+
+
+class TestAccountGroups(TestCase):
+
+    def setUp(self) -> None:
+        self.templates = [synthetic.generate(synthetic.TemplateSpec(resources=6, failureRate=0.5, seed=seed))
+                          for seed in range(3)]
+        self.responses = {t.digest: t.response for t in self.templates}
+        self.accounts = [['CC1', '111122223333'], ['CC2', '444455556666']]
+        return super().setUp()
+
+    def validate(self, body, exceptions=0):
+        with helpers.FakeConformity(self.responses, self.accounts) as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            # approved exceptions for the first account's templates
+            bench_validate.create_table(dynamodb, '111122223333', exceptions)
+            with mock.patch.object(app.exceptions, 'get_approved_exceptions_for_accounts',
+                                   wraps=app.exceptions.get_approved_exceptions_for_accounts) as getExceptions:
+                response = app.lambda_handler({'body': json.dumps(body)}, {}, dynamodb)
+            counts = dict(stub.counts)
+        return response['statusCode'], json.loads(response['body']), counts, getExceptions
+
+    def group(self, accountId, *indexes):
+        return {'accountId': accountId, 'templates': [
+            {'filename': f'template{i}.yml', 'template': self.templates[i].body} for i in indexes]}
+
+    def single(self, group, exceptions=0):
+        status, body, _, _ = self.validate(dict(group, responseVersion=2), exceptions)
+        self.assertEqual(status, 200)
+        return body
+
+    def test_groups(self):
+        groups = [self.group('111122223333', 0, 1), self.group('444455556666', 0, 2),
+                  self.group('999999999999', 1), self.group('111122223333', 2)]
+        status, body, counts, getExceptions = self.validate({'responseVersion': 2, 'groups': groups}, exceptions=3)
+        self.assertEqual(status, 200)
+
+        # one accounts refresh (for the unmonitored account) after the initial load, one exceptions lookup
+        self.assertEqual(counts['accounts'], 2)
+        getExceptions.assert_called_once()
+        self.assertEqual(getExceptions.call_args.args[0], ['111122223333', '444455556666', '999999999999'])
+
+        self.assertEqual([group['accountId'] for group in body['groups']], [g['accountId'] for g in groups])
+        for group, result in zip(groups, body['groups']):
+            expected = self.single(group, exceptions=3)
+            self.assertEqual(result['failures'], expected['failures'])
+            self.assertEqual(result['results'], expected['results'])
+        self.assertEqual(body['failures'], {risk: sum(group['failures'][risk] for group in body['groups'])
+                                            for risk in app.FAILURE_FILTER})
+        # the unmonitored account's group carries the account check
+        self.assertIn('AWS account 999999999999 is NOT being monitored', json.dumps(body['groups'][2]['results']))
+
+    def test_v1_groups(self):
+        status, body, _, _ = self.validate({'groups': [self.group('111122223333', 0)]})
+        self.assertEqual(status, 200)
+        self.assertNotIn('version', body)
+        self.assertIsInstance(body['groups'][0]['results'], str)
+
+    def test_invalid_groups(self):
+        for body in ({'groups': []}, {'groups': [{'templates': []}]}, {'groups': [{'accountId': 'x'}]},
+                     {'groups': [self.group('111122223333', 0)], 'accountId': '111122223333'}):
+            status, response, _, _ = self.validate(body)
+            self.assertEqual(status, 400, body)
+            self.assertIn('groups', response['message'])
+
+
+class TestPassedCheck(TestCase):
+
+    def setUp(self) -> None:
+        self.bodies = ['Resources: {}\n', 'Resources:\n  Queue:\n    Type: AWS::SQS::Queue\n']
+        # the scanner finds nothing at all in either template
+        self.responses = {hashlib.sha256(body.encode('utf-8')).hexdigest(): {'data': []} for body in self.bodies}
+        return super().setUp()
+
+    def validate(self, accountId):
+        event = {'body': json.dumps({'accountId': accountId, 'responseVersion': 2, 'templates': [
+            {'filename': f'clean{i}.yml', 'template': body} for i, body in enumerate(self.bodies)]})}
+        with helpers.FakeConformity(self.responses) as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            response = app.lambda_handler(event, {}, dynamodb)
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        return [(feature['name'], element['name'], element['steps'][0]['keyword'])
+                for feature in body['results'] for element in feature['elements']]
+
+    def test_clean_templates(self):
+        # one "found ZERO issues" check for the request, not one per template
+        self.assertEqual(self.validate('111122223333'), [('PASSED', 'Template Scanning', 'clean0.yml: ')])
+
+    def test_invalid_account(self):
+        self.assertEqual(self.validate('999999999999'), [('VERY_HIGH', 'AWS account number validation', ': ')])
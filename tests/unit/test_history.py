@@ -0,0 +1,178 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import copy
+import json
+import os
+from unittest import TestCase, mock
+
+import requests
+
+from validate import app, history, prescan, serialization
+from validate.results import ResultStore
+from tests.benchmark import bench_validate, synthetic
+from tests.unit.sample_data import sampleInput
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+STATE_TABLE = 'TEST_STATE_TABLE'
+
+
+def scanned(results, filename='1.yml'):
+    store = ResultStore(app.FAILURE_FILTER)
+    app.processScanResults(results, filename, store, {})
+    return store
+
+
+class TestCompare(TestCase):
+
+    def test_request_refs(self):
+        with mock.patch.dict(os.environ, {history.SCAN_STATE_TABLENAME_ENV: STATE_TABLE}):
+            self.assertEqual(history.request_refs({}), ('', ''))
+            self.assertEqual(history.request_refs({'ref': 'abc', 'baseline': 'main'}), ('abc', 'main'))
+            self.assertRaises(serialization.InvalidRequestError, history.request_refs, {'ref': 12})
+            self.assertRaises(serialization.InvalidRequestError, history.request_refs, {'baseline': 'x' * 300})
+        with mock.patch.dict(os.environ, {history.SCAN_STATE_TABLENAME_ENV: ''}):
+            self.assertEqual(history.request_refs({}), ('', ''))
+            self.assertRaises(serialization.InvalidRequestError, history.request_refs, {'baseline': 'main'})
+
+    def test_encode(self):
+        records = history.failed_records(scanned(sampleInput))['1.yml']
+        self.assertEqual(len(records), 9)
+        self.assertEqual(history.decode(history.encode(records)), records)
+
+    def test_compare(self):
+        before = json.loads(sampleInput)
+        after = copy.deepcopy(before)
+        # one failure fixed, one passing check now failing
+        fixedCheck = next(c for c in after['data'] if c['attributes']['status'] == 'FAILURE')
+        fixedCheck['attributes']['status'] = 'SUCCESS'
+        newCheck = next(c for c in after['data'] if c['attributes']['status'] == 'SUCCESS' and c is not fixedCheck)
+        newCheck['attributes']['status'] = 'FAILURE'
+
+        baseline = history.failed_records(scanned(json.dumps(before)))
+        current = scanned(json.dumps(after))
+        app.addTestResult('cloud-conformity-tests', 'AWS account number validation', 'VERY_HIGH',
+                          'not monitored', '', 'failed', current)
+
+        compared, changes = history.compare(current, baseline, app.FAILURE_FILTER)
+
+        newRisk = newCheck['attributes']['risk-level']
+        fixedRisk = fixedCheck['attributes']['risk-level']
+        expectedNew = dict.fromkeys(app.FAILURE_FILTER, 0)
+        expectedNew[newRisk] += 1
+        expectedNew['VERY_HIGH'] += 1
+        self.assertEqual(changes['new'], expectedNew)
+        self.assertEqual(compared.failures, expectedNew)
+        self.assertEqual(sum(changes['fixed'].values()), 1)
+        self.assertEqual(changes['fixed'][fixedRisk], 1)
+
+        results = [(result.id, result.status) for group in compared.groups.values() for result in group]
+        self.assertIn((newCheck['id'], 'failed'), results)
+        self.assertIn((fixedCheck['id'], 'passed'), results)
+        self.assertIn(('cloud-conformity-tests', 'failed'), results)
+        self.assertEqual(len(results), 3)
+
+    def test_compare_without_baseline(self):
+        current = scanned(sampleInput)
+        compared, changes = history.compare(current, None, app.FAILURE_FILTER)
+        self.assertEqual(changes['new'], current.failures)
+        self.assertEqual(sum(changes['fixed'].values()), 0)
+
+    def test_errored_scan_not_fixed(self):
+        baseline = history.failed_records(scanned(sampleInput))
+        current = ResultStore(app.FAILURE_FILTER)
+        error = requests.Response()
+        error.status_code = 500
+        error._content = b'{"errors": [{"status": 500, "detail": "Internal Server Error"}]}'
+        app.process_scan_response(error, '1.yml', current, {})
+        self.assertEqual(history.errored_files(current), {'1.yml'})
+
+        compared, changes = history.compare(current, baseline, app.FAILURE_FILTER)
+        self.assertEqual(sum(changes['fixed'].values()), 0)
+        self.assertEqual(compared.failures['VERY_HIGH'], 1)
+
+    def test_passed_check_not_errored(self):
+        current = ResultStore(app.FAILURE_FILTER)
+        app.addPassedResult(['1.yml'], current)
+        self.assertEqual(history.errored_files(current), set())
+
+
+class TestBaselineRequests(TestCase):
+
+    def setUp(self) -> None:
+        self.template = synthetic.generate(synthetic.TemplateSpec(resources=6, failureRate=0.5, seed=7))
+        self.stub = helpers.FakeConformity({self.template.digest: self.template.response}).start()
+        self.mocked = bench_validate.mocked_handler({'CONFORMITY_API_URL': self.stub.url,
+                                                     history.SCAN_STATE_TABLENAME_ENV: STATE_TABLE})
+        self.dynamodb = self.mocked.__enter__()
+        bench_validate.create_table(self.dynamodb, AWS_ACCOUNT, 0)
+        helpers.createExceptionsTable(STATE_TABLE, self.dynamodb)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.mocked.__exit__(None, None, None)
+        self.stub.stop()
+        return super().tearDown()
+
+    def validate(self, **options):
+        event = bench_validate.make_event(AWS_ACCOUNT, [self.template])
+        event['body'] = json.dumps(dict(json.loads(event['body']), **options))
+        response = app.lambda_handler(event, {}, self.dynamodb)
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def test_baseline(self):
+        full = self.validate(ref='main')
+        self.assertNotIn('baseline', full)
+        self.assertGreater(sum(full['failures'].values()), 0)
+
+        unchanged = self.validate(baseline='main', responseVersion=2)
+        self.assertEqual(unchanged['baseline']['ref'], 'main')
+        self.assertTrue(unchanged['baseline']['found'])
+        self.assertEqual(sum(unchanged['failures'].values()), 0)
+        self.assertEqual(unchanged['results'], [])
+
+        # fix one failing check
+        checks = self.template.response['data']
+        fixed = next(c for c in checks if c['attributes']['status'] == 'FAILURE')
+        fixed['attributes']['status'] = 'SUCCESS'
+
+        changed = self.validate(ref='feature', baseline='main', responseVersion=2)
+        self.assertEqual(sum(changed['baseline']['fixed'].values()), 1)
+        steps = [element for feature in changed['results'] for element in feature['elements']]
+        self.assertEqual([(s['id'], s['steps'][0]['result']['status']) for s in steps], [(fixed['id'], 'passed')])
+
+        # the feature branch was stored with the fix
+        self.assertEqual(sum(self.validate(baseline='feature')['failures'].values()), 0)
+
+    def test_all_fixed(self):
+        failed = self.template.failures()
+        self.validate(ref='main')
+
+        # the next run finds nothing, so only has the "found ZERO issues" check
+        self.template.response['data'] = []
+        body = self.validate(baseline='main', responseVersion=2)
+        self.assertEqual(body['baseline']['fixed'], {risk: failed.get(risk, 0) for risk in app.FAILURE_FILTER})
+        statuses = [element['steps'][0]['result']['status'] for feature in body['results']
+                    for element in feature['elements']]
+        self.assertEqual(statuses, ['passed'] * (sum(failed.values()) + 1))
+
+    def test_remote_scan_skipped(self):
+        self.validate(ref='main')
+        finding = prescan.Finding('PRE-003', 'Open bucket', 'VERY_HIGH', 'Bucket is public', 'Bucket')
+
+        # only the local finding, the baseline's Conformity failures aren't reported as fixed
+        with mock.patch.object(prescan, 'scan', return_value=[finding]):
+            body = self.validate(ref='main', baseline='main', prescan='skipRemote', responseVersion=2)
+        self.assertEqual(self.stub.counts['scan'], 1)
+        self.assertEqual(sum(body['baseline']['fixed'].values()), 0)
+        self.assertEqual(body['baseline']['new'], {'VERY_HIGH': 1, 'HIGH': 0, 'MEDIUM': 0, 'LOW': 0})
+
+        # and the stored history under the ref still has them
+        self.assertEqual(sum(self.validate(baseline='main')['failures'].values()), 0)
+
+    def test_unknown_baseline(self):
+        body = self.validate(baseline='never-scanned')
+        self.assertFalse(body['baseline']['found'])
+        self.assertEqual(body['baseline']['new'], body['failures'])
+        self.assertEqual(body['failures'], {risk: count for risk, count in self.template.failures().items()})
@@ -0,0 +1,57 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import hashlib
+import json
+import logging
+import os
+from unittest import mock
+from unittest import TestCase
+
+from validate import logs
+
+
+class Exploding:
+    """Fails the test if it is ever serialised"""
+    def __str__(self):
+        raise AssertionError('payload was serialised although the log level is disabled')
+
+
+class TestLogs(TestCase):
+
+    def test_level_from_env(self):
+        with mock.patch.dict(os.environ, {"LOG_LEVEL": "warning"}):
+            self.assertEqual(logs.get_logger("test-logs-env").level, logging.WARNING)
+
+        with mock.patch.dict(os.environ, {"LOG_LEVEL": "NOT_A_LEVEL"}):
+            self.assertEqual(logs.get_logger("test-logs-invalid").level, logging.INFO)
+
+    def test_summary(self):
+        text = "AWSTemplateFormatVersion: '2010-09-09'"
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+        self.assertEqual(str(logs.Summary(text)), f'<{len(text)} bytes sha256:{digest}>')
+
+    # When LOG_SAMPLE_RATE is 0 payloads are only summarised, at 1 they are dumped in full
+    def test_sampling(self):
+        event = {"body": "{}"}
+        with mock.patch.dict(os.environ, {"LOG_SAMPLE_RATE": "0"}):
+            self.assertIsInstance(logs.payload(event), logs.Summary)
+
+        with mock.patch.dict(os.environ, {"LOG_SAMPLE_RATE": "1"}):
+            dump = logs.payload(event)
+            self.assertIsInstance(dump, logs.Dump)
+            self.assertEqual(json.loads(str(dump)), event)
+
+    # When the level is disabled
+    # Then lazy payloads are never rendered
+    def test_lazy(self):
+        logger = logging.getLogger("test-logs-lazy")
+        logger.setLevel(logging.INFO)
+
+        logger.debug('payload: %s', Exploding())
+        logger.debug('fields: %s', logs.Fields(body=Exploding()))
+
+    def test_fields(self):
+        fields = logs.Fields(status=200, body=logs.Summary(b'abc'))
+
+        self.assertEqual(json.loads(str(fields)), {"status": 200, "body": str(logs.Summary(b'abc'))})
@@ -0,0 +1,72 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import io
+import json
+import os
+import threading
+from unittest import TestCase, mock
+
+from validate import metrics
+
+
+class TestMetrics(TestCase):
+
+    def test_no_op_outside_invocation(self):
+        self.assertIsNone(metrics.current())
+        with metrics.timer('Anything'):
+            pass
+        metrics.count('Anything')
+        self.assertIsNone(metrics.current())
+
+    def test_emf_line(self):
+        out = io.StringIO()
+        with mock.patch.dict(os.environ, {'STAGE': 'dev', 'METRICS_NAMESPACE': 'TestNamespace'}):
+            with metrics.invocation('Validate', mock.Mock(aws_request_id='req-1'), out) as invocationMetrics:
+                self.assertIs(metrics.current(), invocationMetrics)
+                for _ in range(2):
+                    with metrics.timer('ScanTime'):
+                        pass
+                metrics.count('Scans', 2)
+                metrics.count('TemplateBytes', 1024)
+
+        self.assertIsNone(metrics.current())
+        document = json.loads(out.getvalue())
+        definition = document['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual(definition['Namespace'], 'TestNamespace')
+        self.assertEqual(definition['Dimensions'], [['Stage', 'Operation']])
+        units = {metric['Name']: metric['Unit'] for metric in definition['Metrics']}
+        self.assertEqual(units, {'ScanTime': 'Milliseconds', 'InvocationTime': 'Milliseconds',
+                                 'Scans': 'Count', 'TemplateBytes': 'Bytes'})
+        self.assertEqual(document['Stage'], 'dev')
+        self.assertEqual(document['Operation'], 'Validate')
+        self.assertEqual(document['requestId'], 'req-1')
+        self.assertEqual(len(document['ScanTime']), 2)
+        self.assertIsInstance(document['InvocationTime'], float)
+        self.assertEqual(document['Scans'], 2)
+
+    def test_disabled(self):
+        out = io.StringIO()
+        with mock.patch.dict(os.environ, {'METRICS_ENABLED': 'false'}):
+            with metrics.invocation('Validate', None, out):
+                metrics.count('Scans')
+        self.assertEqual(out.getvalue(), '')
+
+    def test_timings_summary_threads(self):
+        collected = metrics.Metrics('Validate')
+
+        def record():
+            for _ in range(100):
+                collected.add_time('ScanTime', 1.5)
+                collected.count('Checks', 2)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        timings = collected.timings()
+        self.assertEqual(timings['ScanTime'], {'count': 400, 'totalMs': 600.0, 'maxMs': 1.5})
+        self.assertEqual(timings['counters'], {'Checks': 800})
+        # EMF caps the values per metric
+        self.assertEqual(len(collected.emf('ns', {'Stage': 'dev'})['ScanTime']), metrics.MAX_VALUES_PER_METRIC)
@@ -0,0 +1,108 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+from unittest import TestCase
+
+from validate import app, nested
+from tests.benchmark import bench_validate
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+
+
+def parent(*urls):
+    resources = ''.join(f"""
+  Stack{i}:
+    Type: AWS::CloudFormation::Stack
+    Properties:
+      TemplateURL: {url}""" for i, url in enumerate(urls))
+    return 'Resources:' + resources + '\n'
+
+
+CHILD = 'Resources:\n  Topic:\n    Type: AWS::SNS::Topic\n'
+
+
+class TestMatch(TestCase):
+
+    def test_relative(self):
+        filenames = ['stacks/child.yaml', 'other/child.yaml']
+        self.assertEqual(nested.match('child.yaml', 'stacks/parent.yaml', filenames), 'stacks/child.yaml')
+        self.assertEqual(nested.match('../other/child.yaml', 'stacks/parent.yaml', filenames), 'other/child.yaml')
+        self.assertEqual(nested.match('./missing.yaml', 'stacks/parent.yaml', filenames), None)
+
+    def test_urls(self):
+        filenames = ['stacks/network/vpc.yaml', 'stacks/app/vpc.yaml', 'stacks/app/queue.yaml']
+        self.assertEqual(nested.match('s3://bucket/prefix/network/vpc.yaml', 'root.yaml', filenames),
+                         'stacks/network/vpc.yaml')
+        self.assertEqual(nested.match('https://bucket.s3.amazonaws.com/queue.yaml?versionId=1', 'root.yaml',
+                                      filenames), 'stacks/app/queue.yaml')
+        # ambiguous
+        self.assertEqual(nested.match('https://bucket.s3.amazonaws.com/vpc.yaml', 'root.yaml', filenames), None)
+
+    def test_template_urls(self):
+        template = {'Resources': {
+            'A': {'Type': nested.STACK_TYPE, 'Properties': {'TemplateURL': 'a.yaml'}},
+            'B': {'Type': nested.STACK_TYPE, 'Properties': {'TemplateURL': {'Fn::Sub': 'b.yaml'}}},
+            'C': {'Type': nested.STACK_TYPE, 'Properties': {'TemplateURL': {'Fn::Sub': 's3://${Bucket}/c.yaml'}}},
+            'D': {'Type': 'AWS::SNS::Topic', 'Properties': {'TemplateURL': 'd.yaml'}},
+        }}
+        self.assertEqual(nested.template_urls(template), ['a.yaml', 'b.yaml'])
+
+
+class TestStackGraph(TestCase):
+
+    def test_shared_child(self):
+        graph = nested.resolve(['a.yaml', 'child.yaml', 'b.yaml', 'other.yaml'],
+                               [parent('child.yaml'), CHILD, parent('./child.yaml'), CHILD])
+        self.assertEqual(graph.reported(), [
+            ('a.yaml', 'a.yaml'),
+            ('a.yaml > child.yaml', 'child.yaml'),
+            ('b.yaml', 'b.yaml'),
+            ('b.yaml > child.yaml', 'child.yaml'),
+            ('other.yaml', 'other.yaml'),
+        ])
+
+    def test_grandchildren(self):
+        graph = nested.resolve(['mid.yaml', 'root.yaml', 'leaf.yaml'],
+                               [parent('leaf.yaml'), parent('mid.yaml', 'leaf.yaml'), CHILD])
+        self.assertEqual([name for name, _ in graph.reported()], [
+            'root.yaml', 'root.yaml > mid.yaml', 'root.yaml > mid.yaml > leaf.yaml', 'root.yaml > leaf.yaml'])
+
+    def test_cycle(self):
+        graph = nested.resolve(['a.yaml', 'b.yaml'], [parent('b.yaml'), parent('a.yaml')])
+        self.assertEqual(graph.reported(), [('a.yaml', 'a.yaml'), ('a.yaml > b.yaml', 'b.yaml')])
+
+    def test_unparseable_parent(self):
+        graph = nested.resolve(['a.yaml', 'child.yaml'], ['Type: AWS::CloudFormation::Stack\n  - [', CHILD])
+        self.assertEqual(graph.reported(), [('a.yaml', 'a.yaml'), ('child.yaml', 'child.yaml')])
+
+
+class TestNestedRequests(TestCase):
+
+    def validate(self, templates, **options):
+        event = {'body': json.dumps(dict({'accountId': AWS_ACCOUNT, 'responseVersion': 2, 'templates': [
+            {'filename': filename, 'template': body} for filename, body in templates]}, **options))}
+        with helpers.FakeConformity() as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+            response = app.lambda_handler(event, {}, dynamodb)
+            scans = stub.counts['scan']
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        steps = [step['keyword'] for feature in body['results'] for element in feature['elements']
+                 for step in element['steps']]
+        return scans, set(steps)
+
+    def test_child_scanned_once(self):
+        # the child is submitted by each parent's pipeline, as well as used by both parents
+        templates = [('a.yaml', parent('child.yaml')), ('b.yaml', parent('child.yaml')), ('child.yaml', CHILD),
+                     ('copy/child.yaml', CHILD)]
+        scans, files = self.validate(templates, resolveNestedStacks=True)
+        self.assertEqual(scans, 2)
+        self.assertEqual(files, {'a.yaml: ', 'b.yaml: ', 'a.yaml > child.yaml: ', 'b.yaml > child.yaml: ',
+                                 'copy/child.yaml: '})
+
+        # by default
+        scans, files = self.validate(templates)
+        self.assertEqual(scans, 2)
+        self.assertEqual(files, {'a.yaml: ', 'b.yaml: ', 'child.yaml: ', 'copy/child.yaml: '})
@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+from pathlib import Path
+from unittest import TestCase, mock
+
+from validate import app, cfn, prescan, serialization
+from tests.benchmark import bench_validate
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+OPEN_BUCKET = (Path(__file__).parent.parent / 'payloads' / 'openS3bucket.yaml').read_text()
+
+OPEN_SECURITY_GROUP = """
+Resources:
+  Ssh:
+    Type: AWS::EC2::SecurityGroup
+    Properties:
+      GroupDescription: ssh
+      SecurityGroupIngress:
+        - {IpProtocol: tcp, FromPort: 22, ToPort: 22, CidrIp: 10.0.0.0/8}
+        - {IpProtocol: tcp, FromPort: 20, ToPort: 25, CidrIp: 0.0.0.0/0}
+  Https:
+    Type: AWS::EC2::SecurityGroup
+    Properties:
+      GroupDescription: https
+      SecurityGroupIngress:
+        - {IpProtocol: tcp, FromPort: 443, ToPort: 443, CidrIp: 0.0.0.0/0}
+        - {IpProtocol: tcp, FromPort: !Ref Port, ToPort: !Ref Port, CidrIp: 0.0.0.0/0}
+  Everything:
+    Type: AWS::EC2::SecurityGroupIngress
+    Properties:
+      GroupId: !Ref Https
+      IpProtocol: -1
+      CidrIpv6: ::/0
+"""
+
+PUBLIC_POLICY = """
+Resources:
+  Policy:
+    Type: AWS::S3::BucketPolicy
+    Properties:
+      Bucket: !Ref Bucket
+      PolicyDocument:
+        Statement:
+          - {Effect: Deny, Principal: '*', Action: 's3:*'}
+          - {Effect: Allow, Principal: {AWS: '*'}, Action: 's3:GetObject', Resource: !Sub '${Bucket.Arn}/*'}
+  Internal:
+    Type: AWS::S3::BucketPolicy
+    Properties:
+      Bucket: !Ref Bucket
+      PolicyDocument:
+        Statement:
+          - Effect: Allow
+            Principal: '*'
+            Action: 's3:GetObject'
+            Condition: {StringEquals: {'aws:SourceVpce': vpce-1}}
+"""
+
+
+def rule_ids(findings):
+    return [(f.ruleId, f.resource) for f in findings]
+
+
+class TestRules(TestCase):
+
+    def test_public_bucket(self):
+        findings = prescan.scan(OPEN_BUCKET)
+        self.assertEqual(rule_ids(findings), [('PRE-003', 'ExampleBucket')])
+        self.assertEqual(findings[0].riskLevel, 'VERY_HIGH')
+        self.assertEqual(findings[0].id, 'prescan-PRE-003-ExampleBucket')
+
+    def test_public_bucket_policy(self):
+        self.assertEqual(rule_ids(prescan.scan(PUBLIC_POLICY)), [('PRE-004', 'Policy')])
+
+    def test_open_security_group(self):
+        self.assertEqual(rule_ids(prescan.scan(OPEN_SECURITY_GROUP)), [('PRE-005', 'Ssh'), ('PRE-005', 'Everything')])
+
+    def test_invalid_template(self):
+        findings = prescan.scan('Resources:\n  Bucket: [')
+        self.assertEqual(rule_ids(findings), [('PRE-001', '')])
+        self.assertEqual(rule_ids(prescan.scan('{"AWSTemplateFormatVersion": "2010-09-09"}')), [('PRE-002', '')])
+
+    def test_yaml_parser_missing(self):
+        # without PyYAML a YAML template isn't reported as invalid, it is left to Conformity
+        with mock.patch.object(cfn, 'yaml', None):
+            self.assertEqual(prescan.scan(OPEN_BUCKET), [])
+            self.assertEqual(rule_ids(prescan.scan('{"AWSTemplateFormatVersion": "2010-09-09"}')), [('PRE-002', '')])
+
+    def test_selected_rules(self):
+        with mock.patch.dict(os.environ, {prescan.PRESCAN_RULES_ENV: 'PRE-002, PRE-004'}):
+            self.assertEqual(prescan.scan(OPEN_BUCKET), [])
+
+    def test_broken_rule(self):
+        broken = prescan.Rule('PRE-999', 'Broken', 'LOW', lambda template: iter([None]))
+        with mock.patch.object(prescan, 'RULES', prescan.RULES + [broken]):
+            self.assertEqual(rule_ids(prescan.scan(OPEN_BUCKET)), [('PRE-003', 'ExampleBucket')])
+
+    def test_options(self):
+        self.assertEqual(app.prescan_options({}, []), (False, []))
+        self.assertEqual(app.prescan_options({'prescan': True}, ['VERY_HIGH', 'HIGH']), (True, []))
+        self.assertEqual(app.prescan_options({'prescan': 'skipRemote'}, []), (True, ['VERY_HIGH']))
+        self.assertEqual(app.prescan_options({'prescan': 'skipRemote'}, ['VERY_HIGH', 'HIGH']),
+                         (True, ['VERY_HIGH', 'HIGH']))
+        self.assertRaises(serialization.InvalidRequestError, app.prescan_options, {'prescan': 'yes'}, [])
+
+
+class TestPrescanRequests(TestCase):
+
+    def validate(self, exceptions=(), **options):
+        event = {'body': json.dumps(dict({'accountId': AWS_ACCOUNT, 'responseVersion': 2, 'templates': [
+            {'filename': 'bucket.yaml', 'template': OPEN_BUCKET}]}, **options))}
+        with helpers.FakeConformity() as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+            table = dynamodb.Table(bench_validate.TABLE_NAME)
+            for sortKey in exceptions:
+                table.put_item(Item={'partKey': AWS_ACCOUNT, 'sortKey': sortKey, 'approved': 'true'})
+            response = app.lambda_handler(event, {}, dynamodb)
+            scans = stub.counts['scan']
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        checks = {element['id']: element['steps'][0]['result']['status']
+                  for feature in body['results'] for element in feature['elements']}
+        return body, checks, scans
+
+    def test_off_by_default(self):
+        _, checks, scans = self.validate()
+        self.assertEqual(scans, 1)
+        self.assertNotIn('prescan-PRE-003-ExampleBucket', checks)
+
+    def test_prescan(self):
+        body, checks, scans = self.validate(prescan=True)
+        self.assertEqual(scans, 1)
+        self.assertEqual(checks['prescan-PRE-003-ExampleBucket'], 'failed')
+        # alongside the Conformity checks
+        self.assertGreater(len(checks), 1)
+
+    def test_skip_remote(self):
+        body, checks, scans = self.validate(prescan='skipRemote')
+        self.assertEqual(scans, 0)
+        self.assertEqual(checks, {'prescan-PRE-003-ExampleBucket': 'failed'})
+        self.assertEqual(body['failures']['VERY_HIGH'], 1)
+
+    def test_skip_remote_yaml_parser_missing(self):
+        with mock.patch.object(cfn, 'yaml', None):
+            body, checks, scans = self.validate(prescan='skipRemote')
+        self.assertEqual(scans, 1)
+        self.assertFalse([check for check in checks if check.startswith('prescan-')])
+
+    def test_skip_remote_scan_error(self):
+        # a local scan that failed found nothing, so Conformity still scans the template
+        with mock.patch.object(prescan, 'scan', side_effect=RuntimeError('broken')):
+            body, checks, scans = self.validate(prescan='skipRemote')
+        self.assertEqual(scans, 1)
+        self.assertEqual(checks['prescan-scan-error'], 'failed')
+
+    def test_excepted_finding(self):
+        body, checks, scans = self.validate(exceptions=['bucket.yaml#PRE-003'], prescan='skipRemote')
+        self.assertEqual(scans, 1)
+        self.assertEqual(checks['prescan-PRE-003-ExampleBucket'], 'skipped')
@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import contextvars
+import json
+import os
+import threading
+import tracemalloc
+from unittest import TestCase, mock
+
+from validate import profiling
+
+
+def busy():
+    return sorted([str(i) * 10 for i in range(5000)])
+
+
+def busy_worker():
+    with profiling.worker():
+        return busy()
+
+
+class TestProfiling(TestCase):
+
+    def test_requested_mode(self):
+        event = {'headers': {'x-profile': 'response'}}
+        with mock.patch.dict(os.environ, {'STAGE': 'prd', 'PROFILE_STAGES': ''}):
+            self.assertIsNone(profiling.requested_mode(event))
+        with mock.patch.dict(os.environ, {'STAGE': 'prd', 'PROFILE_STAGES': 'dev, uat'}):
+            self.assertIsNone(profiling.requested_mode(event))
+        with mock.patch.dict(os.environ, {'STAGE': 'uat', 'PROFILE_STAGES': 'dev, uat'}):
+            self.assertEqual(profiling.requested_mode(event), 'response')
+            self.assertEqual(profiling.requested_mode({'headers': {'X-Profile': 'true'}}), 'log')
+            self.assertIsNone(profiling.requested_mode({}))
+            with mock.patch.dict(os.environ, {'PROFILE_REQUESTS': 'true'}):
+                self.assertEqual(profiling.requested_mode({}), 'log')
+
+    def test_disabled_does_nothing(self):
+        with mock.patch.dict(os.environ, {'STAGE': 'dev', 'PROFILE_STAGES': ''}):
+            self.assertIsNone(profiling.start({'headers': {'X-Profile': 'log'}}))
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_summary(self):
+        with mock.patch.dict(os.environ, {'STAGE': 'dev', 'PROFILE_STAGES': 'dev', 'PROFILE_TOP_N': '5'}):
+            profile = profiling.start({'headers': {'X-Profile': 'response'}})
+            busy()
+            with self.assertLogs('templateScannerProfiling', 'INFO') as logged:
+                summary = profiling.finish(profile, 'Test')
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertLessEqual(len(summary['cpu']), 5)
+        self.assertTrue(any('(busy)' in row['function'] for row in summary['cpu']))
+        self.assertGreater(summary['memory']['peakBytes'], 0)
+        self.assertLessEqual(len(summary['memory']['top']), 5)
+        self.assertIn('profile Test: {"wallMs"', logged.output[0])
+
+        response = profile.attach({'statusCode': 200, 'body': json.dumps({'failures': {}})})
+        self.assertEqual(json.loads(response['body'])['profile'], summary)
+        error = {'statusCode': 500, 'body': '{"message": "oops"}'}
+        self.assertIs(profile.attach(error), error)
+
+    def test_workers(self):
+        with mock.patch.dict(os.environ, {'STAGE': 'dev', 'PROFILE_STAGES': 'dev', 'PROFILE_TOP_N': '50'}):
+            profile = profiling.start({'headers': {'X-Profile': 'log'}})
+            # as the scheduler runs a scan, in a copy of the request's context
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(busy_worker,))
+            thread.start()
+            thread.join()
+            summary = profiling.finish(profile, 'Test')
+
+        self.assertTrue(any('(busy)' in row['function'] for row in summary['cpu']))
+        # and nothing once the request is done
+        with mock.patch('cProfile.Profile') as profiler:
+            busy_worker()
+        profiler.assert_not_called()
+
+    def test_leaves_existing_tracing(self):
+        tracemalloc.start()
+        try:
+            with mock.patch.dict(os.environ, {'STAGE': 'dev', 'PROFILE_STAGES': 'dev'}):
+                profile = profiling.start({'headers': {'X-Profile': 'log'}})
+                profiling.finish(profile, 'Test')
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+    def test_one_at_a_time(self):
+        with mock.patch.dict(os.environ, {'STAGE': 'dev', 'PROFILE_STAGES': 'dev'}):
+            profile = profiling.start({'headers': {'X-Profile': 'log'}})
+            # a concurrent request (eg. in validate-server) isn't profiled
+            with self.assertLogs('templateScannerProfiling', 'WARNING'):
+                self.assertIsNone(contextvars.Context().run(profiling.start, {'headers': {'X-Profile': 'log'}}))
+            self.assertTrue(tracemalloc.is_tracing())
+            profiling.finish(profile, 'Test')
+            self.assertFalse(tracemalloc.is_tracing())
+
+            # nor one started while another profiler is running (python 3.12+)
+            with mock.patch('cProfile.Profile.enable', side_effect=ValueError('Another profiling tool is already active')):
+                self.assertIsNone(profiling.start({'headers': {'X-Profile': 'log'}}))
+            self.assertFalse(tracemalloc.is_tracing())
+
+            profiling.finish(profiling.start({'headers': {'X-Profile': 'log'}}), 'Test')
@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+from unittest import TestCase
+
+from validate import app
+from validate.results import ResultStore
+from tests.unit.sample_data import sampleInput
+
+
+class TestResultStore(TestCase):
+
+    # When scan results are added to the store
+    # Then failures are counted per risk level as they are inserted
+    def test_failures_counted_on_insert(self):
+        store = ResultStore(app.FAILURE_FILTER)
+        app.processScanResults(sampleInput, '1.yml', store, {})
+
+        self.assertEqual(store.failures, {"VERY_HIGH": 2, "HIGH": 1, "MEDIUM": 1, "LOW": 5})
+
+    # When an approved exception matches a failing check
+    # Then the check is skipped and not counted as a failure
+    def test_exception_not_counted(self):
+        store = ResultStore(app.FAILURE_FILTER)
+        app.processScanResults(sampleInput, '1.yml', store, {'1.yml#S3-013': {}})
+
+        self.assertEqual(store.failures["LOW"], 4)
+
+    # When results are rendered
+    # Then the Cucumber JSON matches the nested structure, highest sev first
+    def test_cucumber_rendering(self):
+        store = ResultStore(app.FAILURE_FILTER)
+        app.addTestResult('a', 'rule a', 'LOW', 'S3-012: low', '1.yml', 'FAILURE', store)
+        app.addTestResult('b', 'rule b', 'VERY_HIGH', 'S3-001: very high', '1.yml', 'SUCCESS', store)
+        app.addTestResult('c', 'rule c', 'NOT_A_LEVEL', 'ignored', '1.yml', 'FAILURE', store)
+
+        expected = [
+            {
+                "id": "cloud-conformity-rules",
+                "description": "Results from scanning templates through Cloud Conformity",
+                "name": "VERY_HIGH",
+                "elements": [{"id": "b", "name": "rule b", "steps": [
+                    {"result": {"status": "passed"}, "name": "S3-001: very high", "keyword": "1.yml: "}]}]
+            },
+            {
+                "id": "cloud-conformity-rules",
+                "description": "Results from scanning templates through Cloud Conformity",
+                "name": "LOW",
+                "elements": [{"id": "a", "name": "rule a", "steps": [
+                    {"result": {"status": "failed"}, "name": "S3-012: low", "keyword": "1.yml: "}]}]
+            }
+        ]
+        self.assertEqual(json.dumps(store.cucumber()), json.dumps(expected))
+        self.assertEqual(store.failures, {"VERY_HIGH": 0, "HIGH": 0, "MEDIUM": 0, "LOW": 1})
+
+    # When stores from separately scanned templates are merged
+    # Then the result is the same as adding all the results to one store in turn
+    def test_merge(self):
+        single = ResultStore(app.FAILURE_FILTER)
+        app.processScanResults(sampleInput, '1.yml', single, {})
+        app.processScanResults(sampleInput, '2.yml', single, {'2.yml#S3-013': {}})
+
+        merged = ResultStore(app.FAILURE_FILTER)
+        for filename, exceptionList in (('1.yml', {}), ('2.yml', {'2.yml#S3-013': {}})):
+            store = ResultStore(app.FAILURE_FILTER)
+            app.processScanResults(sampleInput, filename, store, exceptionList)
+            merged.merge(store)
+
+        self.assertEqual(merged.failures, single.failures)
+        self.assertEqual(json.dumps(merged.cucumber()), json.dumps(single.cucumber()))
+
+    def test_renamed(self):
+        store = ResultStore(app.FAILURE_FILTER)
+        app.processScanResults(sampleInput, 'child.yml', store, {})
+        renamed = store.renamed('parent.yml > child.yml')
+
+        self.assertEqual(renamed.failures, store.failures)
+        self.assertEqual(json.dumps(renamed.cucumber()),
+                         json.dumps(store.cucumber()).replace('"child.yml: "', '"parent.yml > child.yml: "'))
+        # the original is unchanged
+        self.assertEqual({r.filename for group in store.groups.values() for r in group}, {'child.yml'})
@@ -0,0 +1,235 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+import threading
+import time
+from unittest import TestCase, mock
+
+import boto3
+from moto import mock_dynamodb2
+
+from validate import app, metrics, scheduler
+from tests.benchmark import bench_validate, synthetic
+import tests.unit.helpers as helpers
+
+
+class TestQuota(TestCase):
+
+    def test_rate(self):
+        quota = scheduler.Quota(rate=60, burst=2)
+        state, leaseId, _ = scheduler.take(quota, None, now=100)
+        self.assertTrue(leaseId)
+        state, _, _ = scheduler.take(quota, state, now=100)
+        self.assertEqual(state['tokens'], 0)
+
+        denied, leaseId, retryAfter = scheduler.take(quota, state, now=100.5)
+        self.assertIsNone(denied)
+        self.assertEqual(leaseId, '')
+        self.assertAlmostEqual(retryAfter, 0.5)
+
+        # refilled at a token a second
+        state, leaseId, _ = scheduler.take(quota, state, now=101)
+        self.assertTrue(leaseId)
+
+    def test_concurrency(self):
+        quota = scheduler.Quota(concurrency=1, leaseTtl=10)
+        state, leaseId, _ = scheduler.take(quota, None, now=0)
+        self.assertEqual(scheduler.take(quota, state, now=5)[0], None)
+        # a lease that was never released (eg. the invocation crashed) expires
+        self.assertIsNotNone(scheduler.take(quota, state, now=11)[0])
+
+        store = scheduler.LocalQuotaStore()
+        leaseId, _ = store.acquire('A', quota, now=0)
+        self.assertEqual(store.acquire('A', quota, now=0), ('', scheduler.CONCURRENCY_POLL))
+        self.assertTrue(store.acquire('B', quota, now=0)[0])
+        store.release('A', leaseId)
+        self.assertTrue(store.acquire('A', quota, now=0)[0])
+
+    @mock_dynamodb2
+    def test_dynamo_store(self):
+        with mock.patch.dict(os.environ, {'AWS_REGION': 'ap-southeast-2'}):
+            helpers.createExceptionsTable('TEST_STATE_TABLE', boto3.resource('dynamodb', region_name='ap-southeast-2'))
+            store = scheduler.DynamoQuotaStore('TEST_STATE_TABLE')
+            quota = scheduler.Quota(concurrency=2, rate=60, burst=10)
+
+            first, _ = store.acquire('111122223333', quota, now=1000)
+            second, _ = store.acquire('111122223333', quota, now=1000)
+            self.assertTrue(first and second)
+            self.assertEqual(store.acquire('111122223333', quota, now=1000), ('', scheduler.CONCURRENCY_POLL))
+
+            store.release('111122223333', first)
+            self.assertTrue(store.acquire('111122223333', quota, now=1000)[0])
+
+            item = store._table().get_item(Key=store._key('111122223333'))['Item']
+            self.assertEqual(len(item['leases']), 2)
+            self.assertEqual(float(item['tokens']), 7)
+            self.assertEqual(item['version'], 4)
+
+    @mock_dynamodb2
+    def test_dynamo_store_conflict(self):
+        with mock.patch.dict(os.environ, {'AWS_REGION': 'ap-southeast-2'}):
+            helpers.createExceptionsTable('TEST_STATE_TABLE', boto3.resource('dynamodb', region_name='ap-southeast-2'))
+            store = scheduler.DynamoQuotaStore('TEST_STATE_TABLE')
+            quota = scheduler.Quota(concurrency=1)
+            table = store._table()
+            getItem = table.get_item
+
+            def racing_get_item(**kwargs):
+                # another invocation takes the only slot between our read and write
+                response = getItem(**kwargs)
+                if not racing_get_item.raced:
+                    racing_get_item.raced = True
+                    self.assertTrue(scheduler.DynamoQuotaStore('TEST_STATE_TABLE').acquire('A', quota, now=0)[0])
+                return response
+            racing_get_item.raced = False
+
+            with mock.patch.object(table, 'get_item', racing_get_item):
+                self.assertEqual(store.acquire('A', quota, now=0), ('', scheduler.CONCURRENCY_POLL))
+
+
+class TestScheduler(TestCase):
+
+    def run_blocked(self, sched, submissions):
+        """
+        Runs submissions [(accountId, cost)] while the only worker is busy, so they are all queued
+        :return: accounts in the order their scans ran
+        """
+        release = threading.Event()
+        order = []
+        blocker = sched.submit('X', 1, release.wait, 5)
+        futures = [sched.submit(accountId, cost, order.append, f'{accountId}{i}')
+                   for i, (accountId, cost) in enumerate(submissions)]
+        release.set()
+        blocker.result(5)
+        for future in futures:
+            future.result(5)
+        return order
+
+    def test_fair_queuing(self):
+        sched = scheduler.Scheduler(workers=1)
+        order = self.run_blocked(sched, [('A', 100)] * 4 + [('B', 100)])
+        # B's one scan goes after A's first, not behind all of them
+        self.assertEqual(order, ['A0', 'B4', 'A1', 'A2', 'A3'])
+        sched.shutdown()
+
+    def test_weights(self):
+        sched = scheduler.Scheduler(workers=1, weights={'B': 2})
+        order = self.run_blocked(sched, [('A', 100)] * 3 + [('B', 100)] * 3)
+        self.assertEqual(order, ['B3', 'A0', 'B4', 'B5', 'A1', 'A2'])
+        sched.shutdown()
+
+    def test_concurrency_quota_doesnt_hold_workers(self):
+        sched = scheduler.Scheduler(workers=2, quota=scheduler.Quota(concurrency=1))
+        release = threading.Event()
+        first = sched.submit('A', 1, release.wait, 5)
+        second = sched.submit('A', 1, lambda: 'A')
+        # the free worker goes to B rather than A's second scan, which would only wait on A's quota
+        self.assertEqual(sched.submit('B', 1, lambda: 'B').result(1), 'B')
+        self.assertFalse(second.done())
+        release.set()
+        self.assertEqual(second.result(5), 'A')
+        self.assertTrue(first.result())
+        sched.shutdown()
+
+    def test_throttled(self):
+        sched = scheduler.Scheduler(workers=2, quota=scheduler.Quota(rate=1), wait=0.1)
+        self.assertEqual(sched.submit('A', 1, lambda: 1).result(5), 1)
+        with self.assertRaises(scheduler.ThrottledError) as raised:
+            sched.submit('A', 1, lambda: 2).result(5)
+        self.assertGreater(raised.exception.retryAfter, 50)
+        self.assertEqual(raised.exception.accountId, 'A')
+        sched.shutdown()
+
+    def test_cancel_and_metrics(self):
+        sched = scheduler.Scheduler(workers=1)
+        release = threading.Event()
+        ran = []
+        with metrics.invocation('Test', out=open(os.devnull, 'w')) as current:
+            sched.submit('A', 1, release.wait, 5)
+            queued = sched.submit('A', 1, ran.append, 'queued')
+            self.assertTrue(queued.cancel())
+            release.set()
+            sched.submit('A', 1, metrics.count, 'FromWorker').result(5)
+        self.assertEqual(ran, [])
+        # scans record into the metrics of the invocation that submitted them
+        self.assertEqual(current.counters['FromWorker'], 1)
+        sched.shutdown()
+
+    def test_shutdown_runs_queued_scans(self):
+        sched = scheduler.Scheduler(workers=1)
+        release = threading.Event()
+        running = sched.submit('A', 1, release.wait, 5)
+        queued = sched.submit('A', 1, lambda: 'queued')
+        # as when the shared scheduler is replaced while a request's scans are queued
+        sched.shutdown()
+        release.set()
+        self.assertTrue(running.result(5))
+        self.assertEqual(queued.result(5), 'queued')
+        # once drained, later scans fail rather than waiting forever
+        with self.assertRaises(RuntimeError):
+            sched.submit('A', 1, lambda: 'late').result(5)
+
+    def test_shared_scheduler_follows_settings(self):
+        scheduler.reset()
+        try:
+            with mock.patch.dict(os.environ, {'SCAN_CONCURRENCY': '2', 'SCAN_WEIGHTS': 'A=2, B=0.5'}):
+                first = scheduler.scheduler()
+                self.assertIs(scheduler.scheduler(), first)
+                self.assertEqual((first.workers, first.weights), (2, {'A': 2.0, 'B': 0.5}))
+                self.assertIsInstance(first.store, scheduler.LocalQuotaStore)
+            with mock.patch.dict(os.environ, {'SCAN_QUOTA_RATE': '30', 'SCAN_STATE_TABLENAME': 'state'}):
+                second = scheduler.scheduler()
+                self.assertEqual((second.quota.rate, second.quota.burst), (30.0, 30.0))
+                self.assertIsInstance(second.store, scheduler.DynamoQuotaStore)
+        finally:
+            scheduler.reset()
+
+
+class TestValidateScheduling(TestCase):
+
+    def test_parallel_scans_keep_template_order(self):
+        templates = [synthetic.generate(synthetic.TemplateSpec(resources=3, failureRate=1.0, seed=seed))
+                     for seed in range(4)]
+        responses = {t.digest: t.response for t in templates}
+        event = bench_validate.make_event('111122223333', templates)
+
+        with helpers.FakeConformity(responses) as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            with mock.patch.dict(os.environ, {'SCAN_CONCURRENCY': '1'}):
+                sequential = app.lambda_handler(event, {}, dynamodb)
+            with mock.patch.dict(os.environ, {'SCAN_CONCURRENCY': '4'}):
+                getScanResult = app.get_scan_result
+
+                # later templates answer first
+                def slower_first(payload):
+                    index = [t.body for t in templates].index(payload['data']['attributes']['contents'])
+                    time.sleep(0.05 * (len(templates) - index))
+                    return getScanResult(payload)
+
+                with mock.patch.object(app, 'get_scan_result', slower_first):
+                    parallel = app.lambda_handler(event, {}, dynamodb)
+
+        self.assertEqual(parallel['statusCode'], 200)
+        self.assertEqual(parallel['body'], sequential['body'])
+
+    def test_throttled_response(self):
+        templates = [synthetic.generate(synthetic.TemplateSpec(resources=2, seed=seed)) for seed in range(3)]
+        event = bench_validate.make_event('111122223333', templates)
+        env = {'SCAN_QUOTA_RATE': '2', 'SCAN_QUOTA_WAIT': '0'}
+
+        with helpers.FakeConformity() as stub, \
+                bench_validate.mocked_handler(dict(env, CONFORMITY_API_URL=stub.url)) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            try:
+                response = app.lambda_handler(event, {}, dynamodb)
+            finally:
+                scheduler.reset()
+
+        self.assertEqual(response['statusCode'], 429)
+        body = json.loads(response['body'])
+        self.assertEqual(response['headers']['Retry-After'], str(body['retryAfter']))
+        self.assertGreater(body['retryAfter'], 0)
+        self.assertIn('111122223333 is over its scan quota', body['message'])
+        self.assertLessEqual(stub.counts['scan'], 2)
@@ -0,0 +1,104 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import base64
+import gzip
+import json
+import os
+from unittest import mock
+from unittest import TestCase
+
+from validate import serialization
+
+
+class TestSerialization(TestCase):
+
+    def test_dumps_stdlib_fallback(self):
+        obj = {"failures": {"VERY_HIGH": 1}, "results": [{"name": "VERY_HIGH", "elements": []}]}
+
+        with mock.patch.object(serialization, 'orjson', None):
+            fallback = serialization.dumps(obj)
+
+        self.assertEqual(json.loads(fallback), obj)
+        self.assertEqual(json.loads(serialization.dumps(obj)), obj)
+
+    def test_response_version_default(self):
+        self.assertEqual(serialization.response_version({}, {}), 1)
+        self.assertEqual(serialization.response_version({"headers": None}, {}), 1)
+
+    def test_response_version_body_overrides_header(self):
+        event = {"headers": {"X-Response-Version": "2"}}
+        self.assertEqual(serialization.response_version(event, {}), 2)
+        self.assertEqual(serialization.response_version(event, {"responseVersion": 1}), 1)
+
+    def test_response_version_invalid(self):
+        self.assertRaises(serialization.InvalidRequestError, serialization.response_version, {}, {"responseVersion": "latest"})
+
+    def test_load_request_body(self):
+        body = '{"templates": []}'
+        compressed = base64.b64encode(gzip.compress(body.encode('utf-8'))).decode('ascii')
+
+        self.assertEqual(serialization.load_request_body({"body": body}), body)
+        self.assertEqual(serialization.load_request_body(
+            {"body": base64.b64encode(body.encode('utf-8')).decode('ascii'), "isBase64Encoded": True}), body)
+        self.assertEqual(serialization.load_request_body(
+            {"body": compressed, "isBase64Encoded": True, "headers": {"content-encoding": "gzip"}}), body)
+
+    def test_load_request_body_invalid_gzip(self):
+        event = {"body": base64.b64encode(b'not gzip').decode('ascii'), "isBase64Encoded": True,
+                 "headers": {"Content-Encoding": "gzip"}}
+        self.assertRaises(serialization.InvalidRequestError, serialization.load_request_body, event)
+
+    # A gzip body is never decompressed past the limit
+    def test_load_request_body_too_large(self):
+        def event(size):
+            return {"body": base64.b64encode(gzip.compress(b'0' * size)).decode('ascii'), "isBase64Encoded": True,
+                    "headers": {"Content-Encoding": "gzip"}}
+
+        with mock.patch.dict(os.environ, {serialization.MAX_REQUEST_BYTES_ENV: '1000'}):
+            self.assertEqual(serialization.load_request_body(event(1000)), '0' * 1000)
+            self.assertRaises(serialization.RequestTooLargeError, serialization.load_request_body, event(1001))
+            # a bomb: ~10KB expanding to 10MB
+            self.assertRaises(serialization.RequestTooLargeError, serialization.load_request_body, event(10 * 1024 * 1024))
+
+    def test_load_request_body_truncated_gzip(self):
+        truncated = gzip.compress(b'{"templates": []}')[:-8]
+        event = {"body": base64.b64encode(truncated).decode('ascii'), "isBase64Encoded": True,
+                 "headers": {"Content-Encoding": "gzip"}}
+        self.assertRaises(serialization.InvalidRequestError, serialization.load_request_body, event)
+
+    def test_accepts_gzip(self):
+        self.assertTrue(serialization.accepts_gzip({"headers": {"Accept-Encoding": "br, gzip;q=0.8"}}))
+        self.assertFalse(serialization.accepts_gzip({"headers": {"Accept-Encoding": "gzip;q=0"}}))
+        self.assertFalse(serialization.accepts_gzip({"headers": {"Accept-Encoding": "identity"}}))
+        self.assertFalse(serialization.accepts_gzip({}))
+        # an explicit gzip entry wins over "*", wherever it is listed
+        self.assertTrue(serialization.accepts_gzip({"headers": {"Accept-Encoding": "*;q=0, gzip"}}))
+        self.assertFalse(serialization.accepts_gzip({"headers": {"Accept-Encoding": "gzip;q=0, *"}}))
+        self.assertTrue(serialization.accepts_gzip({"headers": {"Accept-Encoding": "br, *;q=0.5"}}))
+        self.assertFalse(serialization.accepts_gzip({"headers": {"Accept-Encoding": "*;q=0"}}))
+
+    # A bad MAX_REQUEST_BYTES is a deployment error, not reported as the caller's bad request
+    def test_max_request_bytes_invalid(self):
+        event = {"body": base64.b64encode(gzip.compress(b'{}')).decode('ascii'), "isBase64Encoded": True,
+                 "headers": {"Content-Encoding": "gzip"}}
+        for value in ('64MB', '0'):
+            with mock.patch.dict(os.environ, {serialization.MAX_REQUEST_BYTES_ENV: value}):
+                with self.assertRaises(ValueError) as raised:
+                    serialization.load_request_body(event)
+                self.assertNotIsInstance(raised.exception, serialization.InvalidRequestError)
+                self.assertIn(serialization.MAX_REQUEST_BYTES_ENV, str(raised.exception))
+        self.assertEqual(serialization.max_request_bytes(), serialization.DEFAULT_MAX_REQUEST_BYTES)
+
+    # Only bodies worth compressing are gzipped, and only when the caller accepts it
+    def test_encode_response(self):
+        event = {"headers": {"Accept-Encoding": "gzip"}}
+        small = {"statusCode": 200, "body": '{"failures": {}}'}
+        self.assertEqual(serialization.encode_response(event, dict(small)), small)
+
+        body = json.dumps({"results": ["x" * 10] * 500})
+        self.assertEqual(serialization.encode_response({}, {"statusCode": 200, "body": body})["body"], body)
+
+        response = serialization.encode_response(event, {"statusCode": 200, "body": body})
+        self.assertTrue(response["isBase64Encoded"])
+        self.assertEqual(response["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(base64.b64decode(response["body"])).decode('utf-8'), body)
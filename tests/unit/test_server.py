@@ -0,0 +1,193 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+
+import requests
+
+from validate import client, server
+from tests.benchmark import bench_validate, synthetic
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+
+
+class RunningServer:
+    """ValidateServer on a free port, served from a background thread"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.httpd = server.ValidateServer(('127.0.0.1', 0), pool)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.pool.shutdown(5)
+
+
+class TestServer(TestCase):
+
+    def setUp(self) -> None:
+        self.stub = helpers.FakeConformity().start()
+        self.mocked = bench_validate.mocked_handler({'CONFORMITY_API_URL': self.stub.url})
+        dynamodb = self.mocked.__enter__()
+        bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.mocked.__exit__(None, None, None)
+        self.stub.stop()
+        return super().tearDown()
+
+    def test_validate(self):
+        template = synthetic.generate(synthetic.TemplateSpec(resources=5, failureRate=1.0, seed=3))
+        self.stub.responses[template.digest] = template.response
+        event = bench_validate.make_event(AWS_ACCOUNT, [template])
+
+        with RunningServer(server.WorkerPool(workers=2)) as running:
+            resp = requests.post(running.url + '/validate', data=event['body'])
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Type'], 'application/json')
+        self.assertEqual(resp.json()['failures'], {risk: count for risk, count in template.failures().items() if count})
+
+    def test_client_nested_child(self):
+        # a parent using a failing child as a nested stack, validated through the client's result cache
+        parent = 'Resources:\n  Child:\n    Type: AWS::CloudFormation::Stack\n    Properties:\n      TemplateURL: child.yaml\n'
+        self.stub.responses[hashlib.sha256(parent.encode('utf-8')).hexdigest()] = {'data': []}
+
+        with tempfile.TemporaryDirectory() as root, RunningServer(server.WorkerPool(workers=2)) as running:
+            for filename, body in (('parent.yaml', parent), ('child.yaml', 'Resources: {}\n')):
+                with open(os.path.join(root, filename), 'w') as f:
+                    f.write(body)
+            output = os.path.join(root, 'results.json')
+            argv = ['--path', root, '--url', running.url + '/validate', '--account-id', AWS_ACCOUNT,
+                    '--cache-dir', os.path.join(root, 'cache'), '--ignore', 'cache', '--ignore', 'results.json',
+                    '--output', output]
+
+            def run():
+                with mock.patch('sys.stdout', new_callable=io.StringIO):
+                    exitCode = client.main(argv)
+                with open(output) as f:
+                    return exitCode, client.merge_responses([{'results': json.load(f)}])['failures']
+
+            exitCode, failures = run()
+            self.assertEqual(self.stub.counts['scan'], 2)
+            self.assertEqual(exitCode, 255)
+            self.assertGreater(failures['VERY_HIGH'], 0)
+            # the child's failures come back from the cache
+            self.assertEqual(run(), (exitCode, failures))
+            self.assertEqual(self.stub.counts['scan'], 2)
+
+    def test_exceptions(self):
+        ruleException = [{'awsAccountId': AWS_ACCOUNT, 'filename': 'template0.yml', 'ruleId': 'S3-001',
+                          'requestReason': 'test', 'requestedBy': 'tester'}]
+        approval = {'awsAccountId': AWS_ACCOUNT, 'filename': 'template0.yml', 'ruleId': 'S3-001',
+                    'approvedBy': 'approver'}
+
+        with RunningServer(server.WorkerPool(workers=2)) as running:
+            self.assertEqual(requests.post(running.url + '/exceptions', json=ruleException).status_code, 201)
+            self.assertEqual(requests.put(running.url + '/exceptions', json=approval).status_code, 201)
+            self.assertEqual(requests.delete(running.url + '/exceptions', json=approval).status_code, 200)
+
+    def test_routes(self):
+        with RunningServer(server.WorkerPool(workers=1)) as running:
+            self.assertEqual(requests.get(running.url + '/validate').status_code, 404)
+            self.assertEqual(requests.post(running.url + '/other', data='{}').status_code, 404)
+
+            health = requests.get(running.url + '/health')
+            self.assertEqual(health.status_code, 200)
+            self.assertEqual(health.json(), {'status': 'ok', 'inFlight': 0, 'workers': 1})
+
+    def test_full_pool_rejected(self):
+        release = threading.Event()
+
+        def slow(event, context, dynamodb):
+            release.wait(5)
+            return {'statusCode': 200, 'body': '{}'}
+
+        with mock.patch.dict(server.HANDLERS, {'validate': slow}), \
+                RunningServer(server.WorkerPool(workers=1, maxQueue=0)) as running:
+            first = threading.Thread(target=requests.post, args=(running.url + '/validate',), kwargs={'data': '{}'})
+            first.start()
+            while running.pool.inFlight == 0:
+                time.sleep(0.01)
+
+            busy = requests.post(running.url + '/validate', data='{}')
+            self.assertEqual(busy.status_code, 503)
+            self.assertEqual(busy.headers['Retry-After'], '1')
+
+            release.set()
+            first.join()
+            self.assertEqual(requests.post(running.url + '/validate', data='{}').status_code, 200)
+
+    def test_shutdown_drains(self):
+        finished = []
+
+        def slow(event, context, dynamodb):
+            time.sleep(0.2)
+            finished.append(event['path'])
+            return {'statusCode': 200, 'body': '{}'}
+
+        pool = server.WorkerPool(workers=1, maxQueue=1)
+        with mock.patch.dict(server.HANDLERS, {'validate': slow}):
+            caller = threading.Thread(target=pool.submit, args=('validate', server.to_event('POST', '/validate', {}, b'{}')))
+            caller.start()
+            while pool.inFlight == 0:
+                time.sleep(0.01)
+
+            self.assertTrue(pool.shutdown(5))
+            caller.join()
+        self.assertEqual(finished, ['/validate'])
+        self.assertIsNone(pool.submit('validate', {}))
+
+    def test_timeout(self):
+        def slow(event, context, dynamodb):
+            time.sleep(0.3)
+            return {'statusCode': 200, 'body': '{}'}
+
+        with mock.patch.dict(server.HANDLERS, {'validate': slow}):
+            pool = server.WorkerPool(workers=1)
+            running = RunningServer(pool)
+            running.httpd.requestTimeout = 0.05
+            with running:
+                self.assertEqual(requests.post(running.url + '/validate', data='{}').status_code, 504)
+
+
+class TestMain(TestCase):
+
+    def main(self, *argv):
+        env = {'AWS_REGION': 'ap-southeast-2', 'STAGE': 'dev', 'EXCEPTIONS_TABLENAME': 'TEST_EXCEPTIONS_TABLE'}
+        with mock.patch.dict(os.environ, env), mock.patch.object(server, 'WorkerPool'), \
+                mock.patch.object(server, 'serve') as serve, mock.patch('sys.stderr', new_callable=io.StringIO) as err:
+            status = server.main(list(argv))
+        return status, serve, err.getvalue()
+
+    def test_loopback_by_default(self):
+        status, serve, _ = self.main()
+        self.assertEqual(status, 0)
+        self.assertEqual(serve.call_args.args[:2], ('127.0.0.1', server.DEFAULT_PORT))
+
+    def test_remote_needs_flag(self):
+        status, serve, err = self.main('--host', '0.0.0.0')
+        self.assertEqual(status, 2)
+        serve.assert_not_called()
+        self.assertIn('--allow-remote', err)
+
+        status, serve, _ = self.main('--host', '0.0.0.0', '--allow-remote')
+        self.assertEqual(status, 0)
+        self.assertEqual(serve.call_args.args[0], '0.0.0.0')
+        for host in ('localhost', '127.0.0.2', '::1'):
+            self.assertEqual(self.main('--host', host)[0], 0)
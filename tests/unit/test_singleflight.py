@@ -0,0 +1,155 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from unittest import TestCase, mock
+
+import boto3
+import requests
+from moto import mock_dynamodb2
+
+from validate import app, singleflight
+from tests.benchmark import bench_validate, synthetic
+import tests.unit.helpers as helpers
+
+STATE_TABLE = 'TEST_STATE_TABLE'
+
+
+def make_response(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode('utf-8')
+    return response
+
+
+class CountingScan:
+    def __init__(self, status=200, delay=0.0):
+        self.status = status
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(self.delay)
+        return make_response(self.status, {'data': [], 'call': call})
+
+
+@mock_dynamodb2
+class TestSingleFlight(TestCase):
+
+    def setUp(self) -> None:
+        self.mock_env = mock.patch.dict(os.environ, {'AWS_REGION': 'ap-southeast-2'})
+        self.mock_env.start()
+        self.table = helpers.createExceptionsTable(STATE_TABLE, boto3.resource('dynamodb', region_name='ap-southeast-2'))
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.mock_env.stop()
+        return super().tearDown()
+
+    def flight(self, **kwargs):
+        return singleflight.SingleFlight(self.table, **dict({'ttl': 60, 'wait': 5, 'lockTtl': 5}, **kwargs))
+
+    def test_result_shared(self):
+        scan = CountingScan()
+        first = self.flight().run('key', scan)
+        second = self.flight().run('key', scan)
+        self.assertEqual(scan.calls, 1)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(self.flight().run('other', scan).json()['call'], 2)
+
+    def test_concurrent_scans_deduplicated(self):
+        scan = CountingScan(delay=0.3)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.flight().run('key', scan).json()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(scan.calls, 1)
+        self.assertEqual(results, [{'data': [], 'call': 1}] * 5)
+
+    def test_crashed_owner(self):
+        # claimed by an invocation that died, the claim is only honoured until lockedUntil
+        self.table.put_item(Item=dict(singleflight.SingleFlight._key('key'), owner='crashed',
+                                      lockedUntil=Decimal(str(time.time() + 0.5))))
+        scan = CountingScan()
+        start = time.monotonic()
+        self.assertEqual(self.flight().run('key', scan).status_code, 200)
+        self.assertEqual(scan.calls, 1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+        # and the result is shared from then on
+        self.flight().run('key', scan)
+        self.assertEqual(scan.calls, 1)
+
+    def test_wait_timeout(self):
+        self.table.put_item(Item=dict(singleflight.SingleFlight._key('key'), owner='slow',
+                                      lockedUntil=Decimal(str(time.time() + 60))))
+        scan = CountingScan()
+        self.assertEqual(self.flight(wait=0.3).run('key', scan).status_code, 200)
+        self.assertEqual(scan.calls, 1)
+        # the result of a scan that timed out waiting isn't stored, the claim is still the other invocation's
+        self.assertEqual(self.table.get_item(Key=singleflight.SingleFlight._key('key'))['Item']['owner'], 'slow')
+
+    def test_errors_not_shared(self):
+        failing = CountingScan(status=500)
+        self.assertEqual(self.flight().run('key', failing).status_code, 500)
+        self.assertNotIn('Item', self.table.get_item(Key=singleflight.SingleFlight._key('key')))
+
+        self.assertRaises(requests.ConnectionError, self.flight().run, 'key', mock.Mock(side_effect=requests.ConnectionError))
+        self.assertNotIn('Item', self.table.get_item(Key=singleflight.SingleFlight._key('key')))
+
+    def test_expired_result(self):
+        scan = CountingScan()
+        self.flight(ttl=0.2).run('key', scan)
+        time.sleep(0.3)
+        self.assertEqual(self.flight().run('key', scan).json()['call'], 2)
+
+    def test_disabled(self):
+        scan = CountingScan()
+        with mock.patch.dict(os.environ, {singleflight.SCAN_STATE_TABLENAME_ENV: STATE_TABLE,
+                                          singleflight.SINGLEFLIGHT_TTL_ENV: '0'}):
+            singleflight.run({'data': {}}, scan)
+            singleflight.run({'data': {}}, scan)
+        self.assertEqual(scan.calls, 2)
+
+    def test_payload_key(self):
+        first = {'data': {'attributes': {'type': 'cloudformation-template', 'contents': 'a', 'account': 'x'}}}
+        reordered = {'data': {'attributes': {'account': 'x', 'contents': 'a', 'type': 'cloudformation-template'}}}
+        self.assertEqual(singleflight.payload_key(first), singleflight.payload_key(reordered))
+        first['data']['attributes']['account'] = 'y'
+        self.assertNotEqual(singleflight.payload_key(first), singleflight.payload_key(reordered))
+
+
+class TestSharedScans(TestCase):
+
+    def test_identical_requests_scan_once(self):
+        template = synthetic.generate(synthetic.TemplateSpec(resources=4, failureRate=0.5, seed=11))
+        event = bench_validate.make_event('111122223333', [template])
+        env = {singleflight.SCAN_STATE_TABLENAME_ENV: STATE_TABLE, singleflight.SINGLEFLIGHT_TTL_ENV: '60'}
+
+        with helpers.FakeConformity({template.digest: template.response}) as stub, \
+                bench_validate.mocked_handler(dict(env, CONFORMITY_API_URL=stub.url)) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            helpers.createExceptionsTable(STATE_TABLE, dynamodb)
+
+            responses = []
+            # concurrent invocations, as from several pipelines
+            threads = [threading.Thread(target=lambda: responses.append(app.lambda_handler(event, {}, dynamodb)))
+                       for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(stub.counts['scan'], 1)
+        self.assertEqual([r['statusCode'] for r in responses], [200] * 3)
+        self.assertEqual(len({r['body'] for r in responses}), 1)
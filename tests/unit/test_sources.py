@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+from unittest import TestCase, mock
+
+import boto3
+from botocore.config import Config
+from moto import mock_s3
+
+from validate import app, serialization, sources
+from tests.benchmark import bench_validate, synthetic
+import tests.unit.helpers as helpers
+
+AWS_ACCOUNT = '111122223333'
+REGION = 'ap-southeast-2'
+BUCKET = 'templates-bucket'
+
+
+@mock_s3
+class TestSources(TestCase):
+
+    def setUp(self) -> None:
+        self.mock_env = mock.patch.dict(os.environ, {'AWS_REGION': REGION, sources.TEMPLATE_BUCKETS_ENV: BUCKET})
+        self.mock_env.start()
+        sources.reset()
+        # moto doesn't understand the checksummed uploads newer botocore versions make by default
+        self.s3 = boto3.client('s3', region_name=REGION, config=Config(request_checksum_calculation='when_required'))
+        self.s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        sources.reset()
+        self.mock_env.stop()
+        return super().tearDown()
+
+    def test_s3_ref(self):
+        self.assertIsNone(sources.s3_ref({'filename': 'a.yml', 'template': '---'}))
+        self.assertEqual(sources.s3_ref({'s3': {'bucket': BUCKET, 'key': 'a.yml', 'version': 'v1'}}),
+                         sources.S3Ref(BUCKET, 'a.yml', 'v1'))
+        self.assertRaises(serialization.InvalidRequestError, sources.s3_ref, {'s3': 's3://bucket/a.yml'})
+        self.assertRaises(serialization.InvalidRequestError, sources.s3_ref, {'s3': {'bucket': BUCKET}})
+        self.assertRaises(serialization.InvalidRequestError, sources.s3_ref, {'s3': {'bucket': 'other', 'key': 'a'}})
+
+    def test_fetch(self):
+        self.s3.put_object(Bucket=BUCKET, Key='stacks/a.yml', Body=b'a: 1')
+        self.s3.put_object(Bucket=BUCKET, Key='b.yml', Body=b'b: 2')
+        templates = [{'filename': 'inline.yml', 'template': 'c: 3'},
+                     {'s3': {'bucket': BUCKET, 'key': 'stacks/a.yml'}},
+                     {'filename': 'renamed.yml', 's3': {'bucket': BUCKET, 'key': 'b.yml'}},
+                     {'s3': {'bucket': BUCKET, 'key': 'missing.yml'}}]
+
+        fetched, failed = sources.fetch_templates(templates)
+        self.assertEqual(fetched, [{'filename': 'inline.yml', 'template': 'c: 3'},
+                                   {'filename': 'stacks/a.yml', 'template': 'a: 1'},
+                                   {'filename': 'renamed.yml', 'template': 'b: 2'}])
+        self.assertEqual([filename for filename, _ in failed], ['missing.yml'])
+        self.assertIn('s3://templates-bucket/missing.yml', failed[0][1])
+
+    def test_cache(self):
+        self.s3.put_object(Bucket=BUCKET, Key='a.yml', Body=b'a: 1')
+        cache = sources.TemplateCache(1024)
+        ref = sources.S3Ref(BUCKET, 'a.yml')
+        s3 = mock.Mock(wraps=sources.client())
+
+        self.assertEqual(sources.download(s3, ref, cache, 1024), 'a: 1')
+        # unchanged, revalidated by ETag
+        self.assertEqual(sources.download(s3, ref, cache, 1024), 'a: 1')
+        self.assertIn('IfNoneMatch', s3.get_object.call_args.kwargs)
+        self.s3.put_object(Bucket=BUCKET, Key='a.yml', Body=b'a: 2')
+        self.assertEqual(sources.download(s3, ref, cache, 1024), 'a: 2')
+
+        # versions never change, so aren't fetched again
+        s3.get_object.reset_mock()
+        self.s3.put_bucket_versioning(Bucket=BUCKET, VersioningConfiguration={'Status': 'Enabled'})
+        version = self.s3.put_object(Bucket=BUCKET, Key='a.yml', Body=b'a: 3')['VersionId']
+        versioned = sources.S3Ref(BUCKET, 'a.yml', version)
+        self.assertEqual(sources.download(s3, versioned, cache, 1024), 'a: 3')
+        self.assertEqual(sources.download(s3, versioned, cache, 1024), 'a: 3')
+        self.assertEqual(s3.get_object.call_count, 1)
+
+    def test_cache_eviction(self):
+        cache = sources.TemplateCache(10)
+        cache.put(sources.S3Ref(BUCKET, 'a'), 'e1', 'x' * 6)
+        cache.put(sources.S3Ref(BUCKET, 'b'), 'e2', 'y' * 3)
+        cache.get(sources.S3Ref(BUCKET, 'a'))
+        cache.put(sources.S3Ref(BUCKET, 'c'), 'e3', 'z' * 3)
+        self.assertIsNone(cache.get(sources.S3Ref(BUCKET, 'b')))
+        self.assertEqual(cache.get(sources.S3Ref(BUCKET, 'a')), ('e1', 'x' * 6))
+        self.assertEqual(cache.size, 9)
+        # too big to cache at all
+        cache.put(sources.S3Ref(BUCKET, 'd'), 'e4', 'w' * 11)
+        self.assertIsNone(cache.get(sources.S3Ref(BUCKET, 'd')))
+
+    def test_too_large(self):
+        self.s3.put_object(Bucket=BUCKET, Key='big.yml', Body=b'x' * 2048)
+        self.s3.put_object(Bucket=BUCKET, Key='binary.yml', Body=b'\xff\xfe')
+        cache = sources.TemplateCache(4096)
+        self.assertRaisesRegex(sources.TemplateDownloadError, 'larger than 1024 bytes', sources.download,
+                               sources.client(), sources.S3Ref(BUCKET, 'big.yml'), cache, 1024)
+        self.assertRaisesRegex(sources.TemplateDownloadError, 'not a UTF-8', sources.download,
+                               sources.client(), sources.S3Ref(BUCKET, 'binary.yml'), cache, 1024)
+
+    def test_validate(self):
+        template = synthetic.generate(synthetic.TemplateSpec(resources=4, failureRate=0.5, seed=3))
+        self.s3.put_object(Bucket=BUCKET, Key='stacks/large.yml', Body=template.body.encode('utf-8'))
+        event = {'body': json.dumps({'accountId': AWS_ACCOUNT, 'templates': [
+            {'s3': {'bucket': BUCKET, 'key': 'stacks/large.yml'}},
+            {'filename': 'gone.yml', 's3': {'bucket': BUCKET, 'key': 'gone.yml'}}]})}
+
+        with helpers.FakeConformity({template.digest: template.response}) as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+            response = app.lambda_handler(event, {}, dynamodb)
+            self.assertEqual(stub.counts['scan'], 1)
+
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        expected = template.failures()
+        expected['VERY_HIGH'] = expected.get('VERY_HIGH', 0) + 1
+        self.assertEqual(body['failures'], expected)
+        self.assertIn('"keyword": "gone.yml: "', body['results'])
+        self.assertIn('"keyword": "stacks/large.yml: "', body['results'])
+
+    def test_bucket_not_allowed(self):
+        event = {'body': json.dumps({'accountId': AWS_ACCOUNT, 'templates': [
+            {'s3': {'bucket': 'someone-elses-bucket', 'key': 'a.yml'}}]})}
+        with helpers.FakeConformity() as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url}) as dynamodb:
+            bench_validate.create_table(dynamodb, AWS_ACCOUNT, 0)
+            response = app.lambda_handler(event, {}, dynamodb)
+            self.assertEqual(stub.counts['scan'], 0)
+        self.assertEqual(response['statusCode'], 400)
+        self.assertIn('someone-elses-bucket', json.loads(response['body'])['message'])
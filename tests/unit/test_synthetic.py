@@ -0,0 +1,78 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+from unittest import TestCase, skipUnless
+
+from tests.benchmark import synthetic
+from validate import app
+from validate.results import ResultStore
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+
+def load_yaml(body):
+    class Loader(yaml.SafeLoader):
+        pass
+
+    def intrinsic(loader, suffix, node):
+        if isinstance(node, yaml.ScalarNode):
+            return {suffix: loader.construct_scalar(node)}
+        return {suffix: loader.construct_sequence(node)}
+
+    Loader.add_multi_constructor('!', intrinsic)
+    return yaml.load(body, Loader=Loader)
+
+
+class TestSynthetic(TestCase):
+
+    def test_deterministic(self):
+        spec = synthetic.TemplateSpec(resources=40, nesting=2, duplication=0.3, seed=7)
+        first, second = synthetic.generate(spec), synthetic.generate(spec)
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(first.response, second.response)
+        self.assertNotEqual(first.body, synthetic.generate(synthetic.TemplateSpec(resources=40, seed=8)).body)
+
+    def test_json(self):
+        template = synthetic.generate(synthetic.TemplateSpec(resources=30, format='json', duplication=0.5))
+        document = json.loads(template.body)
+        self.assertEqual(len(document['Resources']), 30)
+        self.assertIn('{"Fn::Sub": "${AWS::StackName}', json.dumps(document))
+
+    @skipUnless(yaml, 'PyYAML not installed')
+    def test_yaml(self):
+        template = synthetic.generate(synthetic.TemplateSpec(resources=200, nesting=3))
+        document = load_yaml(template.body)
+        self.assertEqual(list(document['Resources']), [logicalId for logicalId, _ in template.resources])
+        resource = document['Resources'][template.resources[0][0]]
+        self.assertEqual(resource['Metadata']['Nested']['Nested'].keys(), {'Owner', 'Tier'})
+        self.assertIn('!Sub', template.body)
+        self.assertIn('!GetAtt', template.body)
+
+    def test_mix_and_duplication(self):
+        spec = synthetic.TemplateSpec(resources=100, mix={'AWS::S3::Bucket': 1, 'AWS::IAM::Role': 1},
+                                      duplication=1.0, format='json')
+        template = synthetic.generate(spec)
+        self.assertEqual({resourceType for _, resourceType in template.resources}, {'AWS::S3::Bucket', 'AWS::IAM::Role'})
+        # with full duplication every resource is a copy of the first of its type
+        resources = json.loads(template.body)['Resources']
+        self.assertEqual(len({json.dumps(resource, sort_keys=True) for resource in resources.values()}), 2)
+
+        with self.assertRaises(ValueError):
+            synthetic.TemplateSpec(mix={'AWS::Nope::Nope': 1})
+
+    def test_target_bytes(self):
+        template = synthetic.generate(synthetic.TemplateSpec(targetBytes=64 * 1024))
+        self.assertGreaterEqual(len(template.body), 64 * 1024)
+        self.assertLess(len(template.body), 72 * 1024)
+
+    # Then a 500 resource stack goes through processScanResults with the expected failure counts
+    def test_process_scan_results(self):
+        template = synthetic.generate(synthetic.TemplateSpec(resources=500))
+        store = ResultStore(app.FAILURE_FILTER)
+        app.processScanResults(json.dumps(template.response), 'synthetic.yml', store, {})
+
+        self.assertEqual(store.failures, template.failures())
+        self.assertEqual(sum(len(group) for group in store.groups.values()), len(template.response['data']))
@@ -0,0 +1,132 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+import requests
+
+from tests.benchmark import bench_validate, synthetic
+from tests.benchmark.conformity_stub import ConformityStub, StubConfig
+from validate import app, transport
+
+
+class TestTransport(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cassette = os.path.join(self.tmp.name, 'conformity.jsonl')
+        transport.reset()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        transport.reset()
+        self.tmp.cleanup()
+        return super().tearDown()
+
+    def env(self, mode, **extra):
+        return mock.patch.dict(os.environ, dict({transport.CONFORMITY_TRANSPORT_ENV: mode,
+                                                 transport.CONFORMITY_CASSETTE_ENV: self.cassette}, **extra))
+
+    def record(self, stub, bodies):
+        with self.env('record'):
+            session = transport.new_session()
+            responses = [session.post(stub.url + '/v1/template-scanner/scan',
+                                      data=json.dumps({'data': {'attributes': {'contents': body}}}),
+                                      headers={'Authorization': 'ApiKey secret-key'})
+                         for body in bodies]
+            responses.append(session.get(stub.url + '/v1/accounts', headers={'Authorization': 'ApiKey secret-key'}))
+        return responses
+
+    def test_record_redacts(self):
+        with ConformityStub(StubConfig(latency=0.01, bytesPerCheck=10)) as stub:
+            recorded = self.record(stub, ['a' * 100, 'b' * 50])
+
+        with open(self.cassette) as f:
+            text = f.read()
+        self.assertNotIn('secret-key', text)
+
+        interactions = transport.Cassette(self.cassette).load()
+        self.assertEqual([(i['method'], i['path']) for i in interactions],
+                         [('POST', '/v1/template-scanner/scan')] * 2 + [('GET', '/v1/accounts')])
+        self.assertEqual(interactions[0]['requestHeaders']['Authorization'], transport.REDACTED)
+        self.assertEqual(json.loads(interactions[0]['body']), recorded[0].json())
+        self.assertGreaterEqual(interactions[0]['elapsed'], 0.01)
+        self.assertNotIn('a' * 100, text)
+
+    def test_replay(self):
+        with ConformityStub(StubConfig(bytesPerCheck=10)) as stub:
+            recorded = self.record(stub, ['a' * 100, 'b' * 50])
+
+        # the stand-in is gone, and a different host is used: everything comes from the cassette
+        with self.env('replay', **{transport.CONFORMITY_REPLAY_SPEED_ENV: '0'}):
+            session = transport.new_session()
+            url = 'https://us-east-1-api.cloudconformity.com/v1/template-scanner/scan'
+            exact = session.post(url, data=json.dumps({'data': {'attributes': {'contents': 'b' * 50}}}))
+            self.assertEqual(exact.json(), recorded[1].json())
+
+            # unknown bodies are answered by the recorded interactions for the path, in order
+            others = [session.post(url, data='{"other": true}').json() for _ in range(3)]
+            self.assertEqual(others, [recorded[0].json(), recorded[1].json(), recorded[0].json()])
+
+            self.assertEqual(session.get('https://us-east-1-api.cloudconformity.com/v1/accounts').json(),
+                             recorded[2].json())
+            with self.assertRaises(requests.ConnectionError):
+                session.get('https://us-east-1-api.cloudconformity.com/v1/other')
+
+    def test_replay_timing(self):
+        transport.Cassette(self.cassette).append({
+            'method': 'GET', 'path': '/v1/accounts', 'requestHeaders': {}, 'requestSha256': transport.body_digest(None),
+            'requestBytes': 0, 'status': 429, 'headers': {'Retry-After': '1'}, 'body': '{}', 'elapsed': 0.2})
+
+        with self.env('replay', **{transport.CONFORMITY_REPLAY_SPEED_ENV: '0.25'}):
+            start = time.perf_counter()
+            response = transport.new_session().get('https://example.com/v1/accounts')
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 0.2)
+
+    def test_gzip_cassette(self):
+        self.cassette += '.gz'
+        with ConformityStub(StubConfig()) as stub:
+            recorded = self.record(stub, ['x'])
+        with self.env('replay', **{transport.CONFORMITY_REPLAY_SPEED_ENV: '0'}):
+            self.assertEqual(transport.new_session().get('https://example.com/v1/accounts').json(), recorded[1].json())
+
+    def test_modes(self):
+        with mock.patch.dict(os.environ, {transport.CONFORMITY_TRANSPORT_ENV: 'tape'}):
+            with self.assertRaises(ValueError):
+                transport.new_session()
+        with mock.patch.dict(os.environ, {transport.CONFORMITY_TRANSPORT_ENV: 'replay',
+                                          transport.CONFORMITY_CASSETTE_ENV: ''}):
+            with self.assertRaises(ValueError):
+                transport.new_session()
+        with mock.patch.dict(os.environ, {transport.CONFORMITY_TRANSPORT_ENV: ''}):
+            self.assertIs(transport.session(), transport.session())
+
+    # Then a validate request recorded against the stand-in replays to the same response offline
+    def test_handler_record_replay(self):
+        specs = [synthetic.TemplateSpec(resources=10, seed=i) for i in range(2)]
+        generated = bench_validate.make_templates(2, specs)
+        config = StubConfig(responses={template.digest: template.response for template in generated})
+        event = bench_validate.make_event('111122223333', generated)
+
+        with ConformityStub(config) as stub, \
+                bench_validate.mocked_handler({'CONFORMITY_API_URL': stub.url, transport.CONFORMITY_TRANSPORT_ENV: 'record',
+                                               transport.CONFORMITY_CASSETTE_ENV: self.cassette}) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            recorded = app.lambda_handler(event, {}, dynamodb)
+
+        with bench_validate.mocked_handler({transport.CONFORMITY_TRANSPORT_ENV: 'replay',
+                                            transport.CONFORMITY_CASSETTE_ENV: self.cassette,
+                                            transport.CONFORMITY_REPLAY_SPEED_ENV: '0'}) as dynamodb:
+            bench_validate.create_table(dynamodb, '111122223333', 0)
+            replayed = app.lambda_handler(event, {}, dynamodb)
+
+        self.assertEqual(recorded['statusCode'], 200)
+        self.assertEqual(replayed, recorded)